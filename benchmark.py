@@ -0,0 +1,374 @@
+"""Benchmark af appens eget overhead mod en lokal mock LLM server (ingen GPU krævet).
+
+Starter en OpenAI kompatibel fake server i processen (/v1/models,
+/v1/chat/completions med og uden streaming, /v1/embeddings) med justerbar
+latens og token hastighed, og måler:
+
+  - tur latens og time-to-first-token gennem ChatEngine
+  - hukommelse udtræk (beskeder og minder pr. sekund)
+  - gem og load af sessions med 10 / 1.000 / 100.000 beskeder
+
+Resultatet skrives som JSON, og --baseline sammenligner med en tidligere kørsel:
+
+    python benchmark.py --output resultat.json
+    python benchmark.py --baseline resultat.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from chat_engine import ChatEngine
+
+WORDS = ("kaffe", "cykel", "python", "have", "musik", "løb", "bog", "tog", "hund", "kat", "ferie",
+         "arbejde", "skak", "guitar", "maleri", "fodbold", "bager", "sejlads", "film", "køkken")
+
+MIN_DELTA_MS = 1.0  # Mindre ændringer er målestøj og tæller ikke som regression
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """Svarer som LM Studio / llama.cpp med tidsforbrug styret af serverens indstillinger"""
+    
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Ellers måles TCP forsinkelse (delayed ACK) i stedet for appen
+    
+    def log_message(self, format, *args):
+        pass  # Ingen log pr. forespørgsel
+    
+    def _send_json(self, body, status=200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _send_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+    
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json({"object": "list", "data": [{"id": "mock-model", "context_length": self.server.context_length}]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.server.count(self.path)
+        
+        if self.path.endswith("/embeddings"):
+            texts = body.get("input") or []
+            self._send_json({"data": [{"index": i, "embedding": self.server.embedding(text)} for i, text in enumerate(texts)]})
+        elif self.path.endswith("/chat/completions"):
+            self._chat(body)
+        else:
+            self._send_json({"error": "not found"}, 404)
+    
+    def _chat(self, body):
+        server = self.server
+        prompt = body["messages"][-1]["content"]
+        if "SAMTALE:" in prompt:
+            tokens = [server.memory_reply(prompt)]  # Hukommelse udtræk svarer med JSON
+        else:
+            tokens = [f"{random.choice(WORDS)} " for _ in range(server.reply_tokens)]
+        usage = {"prompt_tokens": sum(len(msg["content"]) // 4 for msg in body["messages"]),
+                 "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        
+        time.sleep(server.latency)
+        if not body.get("stream"):
+            time.sleep(len(tokens) / server.token_rate)
+            try:
+                self._send_json({"choices": [{"message": {"role": "assistant", "content": "".join(tokens)}}], "usage": usage})
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # Klienten afbrød forespørgslen
+            return
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            started = time.perf_counter()
+            for i, token in enumerate(tokens, 1):
+                event = {"choices": [{"delta": {"content": token}}]}
+                self._send_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                # Faste tidspunkter pr. token så sleep-unøjagtighed ikke hober sig op
+                time.sleep(max(0.0, started + i / server.token_rate - time.perf_counter()))
+            self._send_chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+            self._send_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Klienten afbrød svaret
+
+class MockLLMServer(ThreadingHTTPServer):
+    """Fake OpenAI kompatibel server i en baggrundstråd"""
+    
+    daemon_threads = True
+    
+    def __init__(self, latency=0.05, token_rate=200.0, reply_tokens=50, context_length=8192, port=0):
+        super().__init__(("127.0.0.1", port), MockLLMHandler)
+        self.latency = latency  # Sekunder før første token
+        self.token_rate = token_rate  # Tokens pr. sekund
+        self.reply_tokens = reply_tokens  # Tokens pr. chat svar
+        self.context_length = context_length
+        self.requests = {}  # Sti -> antal forespørgsler
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/v1/chat/completions"
+    
+    def count(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+    
+    def expected_turn_time(self):
+        """Sekunder et chat svar tager i serveren (alt derudover er appens overhead)"""
+        return self.latency + self.reply_tokens / self.token_rate
+    
+    @staticmethod
+    def embedding(text):
+        rng = random.Random(text)
+        return [rng.uniform(-1, 1) for _ in range(32)]
+    
+    @staticmethod
+    def memory_reply(prompt):
+        """Ét minde pr. brugerbesked i samtalen (teksterne er unikke, så dublet-tjekket beholder dem)"""
+        conversation = prompt.split("SAMTALE:", 1)[1]
+        memories = [{"info": line[len("user: "):].strip(), "importance": 7}
+                    for line in conversation.splitlines() if line.startswith("user: ")]
+        return json.dumps({"memories": memories}, ensure_ascii=False)
+    
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def make_messages(count, seed=0):
+    """Realistisk udseende samtale med skiftevis bruger og assistent beskeder"""
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        role = "user" if i % 2 == 0 else "assistant"
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 40)))
+        messages.append({"role": role, "content": f"{i}: {text}"})
+    return messages
+
+def summarize(samples):
+    """Nøgletal i millisekunder for en liste af målinger i sekunder"""
+    samples_ms = sorted(sample * 1000 for sample in samples)
+    return {
+        "n": len(samples_ms),
+        "mean": round(statistics.fmean(samples_ms), 3),
+        "p50": round(samples_ms[len(samples_ms) // 2], 3),
+        "p95": round(samples_ms[min(len(samples_ms) - 1, int(len(samples_ms) * 0.95))], 3),
+        "min": round(samples_ms[0], 3),
+        "max": round(samples_ms[-1], 3),
+    }
+
+def log(text):
+    print(text, file=sys.stderr, flush=True)
+
+def new_engine(server, data_dir, **settings):
+    engine = ChatEngine("benchmark", data_dir, server.url)
+    engine.update_settings(auto_memory_enabled=False, summary_enabled=False, **settings)
+    return engine
+
+async def bench_turns(server, turns, stream):
+    """Tur latens og time-to-first-token gennem ChatEngine.stream"""
+    with tempfile.TemporaryDirectory() as data_dir:
+        engine = new_engine(server, data_dir, stream_enabled=stream)
+        await engine.start()
+        await engine.check_connection()
+        session_id = await engine.create_session("benchmark")
+        
+        ttft, total = [], []
+        for i in range(turns):
+            started = time.perf_counter()
+            first = None
+            async for _ in engine.stream(session_id, f"Spørgsmål {i}: {' '.join(random.sample(WORDS, 5))}"):
+                if first is None:
+                    first = time.perf_counter() - started
+            total.append(time.perf_counter() - started)
+            ttft.append(first)
+        await engine.close()
+    
+    expected = server.expected_turn_time()
+    return {
+        "turns": turns,
+        "stream": stream,
+        "ttft_ms": summarize(ttft),
+        "total_ms": summarize(total),
+        "server_ms": round(expected * 1000, 3),
+        "overhead_ms": round((statistics.fmean(total) - expected) * 1000, 3),
+    }
+
+async def bench_memory(server, message_count):
+    """Hukommelse udtræk af en hel samtale (LLM kald, dublet-tjek, indeksering og gemning)"""
+    with tempfile.TemporaryDirectory() as data_dir:
+        engine = new_engine(server, data_dir)
+        await engine.start()
+        session_id = await engine.create_session("hukommelse")
+        engine.history(session_id).extend(make_messages(message_count, seed=1))
+        await engine.save_session(session_id)
+        
+        calls_before = sum(server.requests.values())
+        started = time.perf_counter()
+        new_ids = await engine.extract_memories(session_id)
+        elapsed = time.perf_counter() - started
+        calls = sum(server.requests.values()) - calls_before
+        await engine.close()
+    
+    return {
+        "messages": message_count,
+        "memories": len(new_ids),
+        "llm_calls": calls,
+        "total_ms": round(elapsed * 1000, 3),
+        "messages_per_s": round(message_count / elapsed, 1),
+        "memories_per_s": round(len(new_ids) / elapsed, 1),
+    }
+
+async def bench_sessions(server, message_count):
+    """Gem og load af én session med message_count beskeder"""
+    messages = make_messages(message_count, seed=2)
+    with tempfile.TemporaryDirectory() as data_dir:
+        engine = new_engine(server, data_dir, session_cache_max_messages=message_count + 10)
+        session_id = await engine.create_session("stor")
+        engine.history(session_id).extend(messages)
+        
+        started = time.perf_counter()
+        engine.save_sessions()
+        save_full = time.perf_counter() - started
+        
+        # En ny tur i en stor samtale skal kun skrive de nye beskeder
+        engine.history(session_id).extend(make_messages(2, seed=3))
+        started = time.perf_counter()
+        engine.save_sessions()
+        save_incremental = time.perf_counter() - started
+        await engine.close()
+        
+        started = time.perf_counter()
+        engine = new_engine(server, data_dir, session_cache_max_messages=message_count + 10)
+        load_sessions = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        history = await engine.load_session(session_id)
+        load_history = time.perf_counter() - started
+        assert len(history) == message_count + 3, "Sessionen blev ikke gemt korrekt"
+        await engine.close()
+    
+    return {
+        "messages": message_count,
+        "save_full_ms": round(save_full * 1000, 3),
+        "save_incremental_ms": round(save_incremental * 1000, 3),
+        "load_sessions_ms": round(load_sessions * 1000, 3),
+        "load_history_ms": round(load_history * 1000, 3),
+    }
+
+async def run_benchmarks(args):
+    server = MockLLMServer(args.latency, args.token_rate, args.reply_tokens).start()
+    results = {}
+    try:
+        log(f"⏱️ Ture ({args.turns}, stream)...")
+        results["turn_stream"] = await bench_turns(server, args.turns, stream=True)
+        log(f"⏱️ Ture ({args.turns}, uden stream)...")
+        results["turn_no_stream"] = await bench_turns(server, args.turns, stream=False)
+        log(f"⏱️ Hukommelse udtræk ({args.memory_messages} beskeder)...")
+        results["memory_extraction"] = await bench_memory(server, args.memory_messages)
+        for size in args.sizes:
+            log(f"⏱️ Sessions med {size} beskeder...")
+            results[f"sessions_{size}"] = await bench_sessions(server, size)
+    finally:
+        server.stop()
+    
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "server": {"latency_s": args.latency, "token_rate": args.token_rate, "reply_tokens": args.reply_tokens},
+        },
+        "results": results,
+    }
+
+def flatten_timings(results, prefix=""):
+    """{"a": {"b_ms": 1}} -> {"a.b_ms": 1} for alle tider (mindre er bedre)"""
+    timings = {}
+    for name, value in results.items():
+        key = f"{prefix}{name}"
+        if isinstance(value, dict):
+            timings.update(flatten_timings(value, key + "."))
+        elif isinstance(value, (int, float)) and ("_ms" in key and not key.endswith(("server_ms", ".n"))):
+            timings[key] = value
+    return timings
+
+def compare(baseline, current, tolerance):
+    """Print ændringer i forhold til en tidligere kørsel - returnerer antal regressioner"""
+    old = flatten_timings(baseline["results"])
+    new = flatten_timings(current["results"])
+    regressions = 0
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] <= 0 or abs(new[key] - old[key]) < MIN_DELTA_MS:
+            continue
+        change = (new[key] - old[key]) / old[key]
+        flag = ""
+        if change > tolerance:
+            flag = "  ⚠️ langsommere"
+            regressions += 1
+        elif change < -tolerance:
+            flag = "  ✅ hurtigere"
+        log(f"{key:45} {old[key]:10.2f} -> {new[key]:10.2f} ms ({change:+.0%}){flag}")
+    return regressions
+
+def main():
+    """Hovedfunktion"""
+    parser = argparse.ArgumentParser(description="Benchmark af LLM chat mod en lokal mock server")
+    parser.add_argument("--latency", type=float, default=0.05, help="sekunder før første token (standard: %(default)s)")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="tokens pr. sekund (standard: %(default)s)")
+    parser.add_argument("--reply-tokens", type=int, default=50, help="tokens pr. svar (standard: %(default)s)")
+    parser.add_argument("--turns", type=int, default=20, help="antal chat ture (standard: %(default)s)")
+    parser.add_argument("--memory-messages", type=int, default=200, help="beskeder i hukommelse testen (standard: %(default)s)")
+    parser.add_argument("--sizes", default="10,1000,100000", help="session størrelser (standard: %(default)s)")
+    parser.add_argument("--quick", action="store_true", help="hurtig kørsel (5 ture, sessions op til 1.000)")
+    parser.add_argument("--output", help="skriv JSON resultatet hertil (ellers stdout)")
+    parser.add_argument("--baseline", help="sammenlign med et tidligere JSON resultat")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="tilladt forværring før regression (standard: %(default)s)")
+    args = parser.parse_args()
+    
+    args.sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    if args.quick:
+        args.turns = min(args.turns, 5)
+        args.sizes = [size for size in args.sizes if size <= 1000]
+    
+    report = asyncio.run(run_benchmarks(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        log(f"💾 Resultat gemt i {args.output}")
+    else:
+        print(output)
+    
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2439 @@
+"""GUI-uafhængig chat motor: chat, hukommelse og sessions som asyncio coroutines.
+
+Bruges af Tk vinduet i test.py, men kan også køre headless (flere samtaler
+på samme event loop) uden tkinter, pyttsx3 eller speech_recognition.
+"""
+
+import asyncio
+import bisect
+import contextlib
+import getpass
+import hashlib
+import io
+import json
+import math
+import os
+import pickle
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Uden numpy vælges minder kun efter vigtighed
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None  # Uden tiktoken estimeres tokens ud fra antal tegn
+
+DEFAULT_LLM_URL = "http://localhost:1234/v1/chat/completions"
+
+DANISH_PROMPT = """Du er en hjælpsom assistent der svarer på dansk. Hold svarene korte og præcise. 
+        Du har adgang til information om brugeren som kan hjælpe dig med at give bedre og mere personlige svar."""
+
+ENGLISH_PROMPT = """You are a helpful assistant that always responds in English, even if the user writes in Danish or other languages. 
+        Keep responses concise and clear. You have access to user information that can help you provide better, more personalized responses."""
+
+def get_user_id(username=None, computer_name=None):
+    """Bruger ID baseret på system (hash af bruger@computer) - serveren giver selv navnene"""
+    # Kombiner username og computer navn for unik ID
+    username = username or getpass.getuser()
+    computer_name = computer_name or os.environ.get('COMPUTERNAME', os.environ.get('HOSTNAME', 'unknown'))
+    user_string = f"{username}@{computer_name}"
+    
+    # Lav hash for privatliv
+    return hashlib.md5(user_string.encode()).hexdigest()[:8]
+
+def user_data_dir(user_id):
+    """Mappe med en brugers sessions og minder"""
+    return f"user_data_{user_id}"
+
+class LLMTimeout(Exception):
+    """LLM backenden svarede ikke inden for timeout"""
+
+class LLMUnavailable(Exception):
+    """Kunne ikke forbinde til LLM backenden"""
+
+class RollingHistogram:
+    """De seneste `size` målinger af én størrelse + totaler siden start"""
+    
+    def __init__(self, size=1000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+    
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+    
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    
+    def summary(self):
+        """Nøgletal for vinduet (count/sum er siden start som i Prometheus)"""
+        summary = {"count": self.count, "sum": self.total}
+        if self.samples:
+            summary.update(mean=sum(self.samples) / len(self.samples), p50=self.quantile(0.5),
+                           p90=self.quantile(0.9), p99=self.quantile(0.99), max=max(self.samples))
+        return summary
+
+class Metrics:
+    """Tidsmålinger for LLM kald, gemning og UI - trådsikre, kun i RAM, kan eksporteres
+
+    Hver måling har et navn og labels (fx kind="chat"). Seneste LLM kald gemmes
+    også som enkelte records til JSONL eksport.
+    """
+    
+    PREFIX = "llmchat_"
+    HELP = {
+        "llm_queue_wait_seconds": "Ventetid på en fri forbindelse i poolen",
+        "llm_connect_seconds": "Tid til at oprette en ny forbindelse",
+        "llm_ttft_seconds": "Tid til første token (hele svaret uden streaming)",
+        "llm_request_seconds": "Samlet tid for et LLM kald",
+        "llm_prompt_tokens": "Prompt tokens pr. kald (usage)",
+        "llm_completion_tokens": "Svar tokens pr. kald (usage)",
+        "llm_tokens_per_second": "Genererede tokens pr. sekund efter første token",
+        "llm_requests_total": "LLM kald fordelt på type og udfald",
+        "persist_seconds": "Tid pr. skrivning til disk",
+        "session_load_seconds": "Tid til at loade en sessions historik",
+        "ui_render_seconds": "Tid brugt på at tegne chatten",
+    }
+    
+    def __init__(self, window=1000, records=1000):
+        self.window = window
+        self.histograms = {}  # (navn, labels) -> RollingHistogram
+        self.counters = {}  # (navn, labels) -> antal
+        self.records = deque(maxlen=records)  # Seneste LLM kald til JSONL
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+    
+    def observe(self, name, value, **labels):
+        """Tilføj en måling til et histogram"""
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = RollingHistogram(self.window)
+            self.histograms[key].observe(value)
+    
+    def increment(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+    
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Mål tiden for en blok i sekunder"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    def record_request(self, trace):
+        """Registrer et færdigt LLM kald ud fra dets trace (se LLMClient.request)"""
+        kind = trace["kind"]
+        self.increment("llm_requests_total", kind=kind, status=trace["status"])
+        for name, field in (("llm_queue_wait_seconds", "queue_wait"), ("llm_connect_seconds", "connect"),
+                            ("llm_ttft_seconds", "ttft"), ("llm_request_seconds", "total"),
+                            ("llm_prompt_tokens", "prompt_tokens"), ("llm_completion_tokens", "completion_tokens"),
+                            ("llm_tokens_per_second", "tokens_per_second")):
+            if trace.get(field) is not None:
+                self.observe(name, trace[field], kind=kind)
+        
+        record = {"ts": round(time.time(), 3)}
+        record.update((name, round(value, 6) if isinstance(value, float) else value)
+                      for name, value in trace.items() if name not in ("started", "queued_at", "connect_at"))
+        with self._lock:
+            self.records.append(record)
+    
+    def summary(self, name, **labels):
+        """Nøgletal for et histogram (None hvis der ingen målinger er)"""
+        with self._lock:
+            histogram = self.histograms.get(self._key(name, labels))
+            return histogram.summary() if histogram and histogram.samples else None
+    
+    def snapshot(self):
+        """Alle histogrammer og tællere som JSON-venlig dict"""
+        with self._lock:
+            return {
+                "histograms": [{"name": name, "labels": dict(labels), **histogram.summary()}
+                               for (name, labels), histogram in sorted(self.histograms.items())],
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+            }
+    
+    @staticmethod
+    def _labels(labels, **extra):
+        items = list(labels) + list(extra.items())
+        if not items:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+    
+    def prometheus_text(self):
+        """Prometheus tekst format (histogrammer som summary med kvantiler over vinduet)"""
+        lines = []
+        typed = set()
+        with self._lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = self.PREFIX + name
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# HELP {metric} {self.HELP.get(name, name)}")
+                    lines.append(f"# TYPE {metric} summary")
+                for q in (0.5, 0.9, 0.99):
+                    value = histogram.quantile(q)
+                    if value is not None:
+                        lines.append(f"{metric}{self._labels(labels, quantile=q)} {value:.6g}")
+                lines.append(f"{metric}_sum{self._labels(labels)} {histogram.total:.6g}")
+                lines.append(f"{metric}_count{self._labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = self.PREFIX + name
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# HELP {metric} {self.HELP.get(name, name)}")
+                    lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric}{self._labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+    
+    def write_prometheus(self, path):
+        """Skriv en .prom fil (fx til node_exporter's textfile collector)"""
+        write_atomic(path, self.prometheus_text().encode("utf-8"))
+    
+    def write_jsonl(self, path):
+        """Skriv de seneste LLM kald, én JSON record pr. linje"""
+        with self._lock:
+            records = list(self.records)
+        write_atomic(path, "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8"))
+
+class LLMClient:
+    """Fælles async HTTP klient til LLM backend (genbruger forbindelser på tværs af kald)"""
+    
+    CONNECT_TIMEOUT = 5  # Sekunder til at oprette forbindelse
+    PROBE_TIMEOUT = 3  # Sekunder til hurtige status kald (/models)
+    EMBEDDING_TIMEOUT = 15  # Sekunder til /embeddings kald
+    
+    def __init__(self, llm_url, timeout_seconds=45, timeout_enabled=True, pool_size=8, metrics=None):
+        self.base_url = self.base_url_from(llm_url)
+        self.timeout_seconds = timeout_seconds
+        self.timeout_enabled = timeout_enabled
+        self.pool_size = pool_size
+        self.metrics = metrics  # Metrics der får en trace pr. kald (None = ingen måling)
+        self._session = None  # Oprettes i den kørende event loop
+    
+    @staticmethod
+    def base_url_from(url):
+        """Find API base URL (fx http://localhost:1234/v1) ud fra en endpoint URL"""
+        url = url.rstrip("/")
+        for suffix in ("/chat/completions", "/completions", "/models"):
+            if url.endswith(suffix):
+                return url[:-len(suffix)]
+        return url
+    
+    def set_base_url(self, url):
+        """Peg alle kald mod en anden backend"""
+        self.base_url = self.base_url_from(url)
+    
+    def configure(self, timeout_seconds, timeout_enabled):
+        """Opdater timeout indstillinger"""
+        self.timeout_seconds = timeout_seconds
+        self.timeout_enabled = timeout_enabled
+    
+    def url(self, path):
+        """Byg fuld URL til et API endpoint"""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+    
+    def timeout_for(self, kind):
+        """Timeout for en type kald (sock_read gælder pr. læsning, så streams kan køre længe)"""
+        import aiohttp
+        if kind == "probe":
+            return aiohttp.ClientTimeout(total=self.PROBE_TIMEOUT)
+        if kind == "embedding":
+            return aiohttp.ClientTimeout(total=None, connect=self.CONNECT_TIMEOUT, sock_read=self.EMBEDDING_TIMEOUT)
+        if not self.timeout_enabled:
+            return aiohttp.ClientTimeout(total=None, connect=self.CONNECT_TIMEOUT)
+        if kind == "memory":
+            # Baggrundsanalyse må gerne vente lidt længere end chatten
+            return aiohttp.ClientTimeout(total=None, connect=self.CONNECT_TIMEOUT, sock_read=self.timeout_seconds * 1.5)
+        return aiohttp.ClientTimeout(total=None, connect=self.CONNECT_TIMEOUT, sock_read=self.timeout_seconds)
+    
+    def _get_session(self):
+        """Keep-alive pool så chat og hukommelse deler sockets"""
+        import aiohttp  # Først ved første kald - holder opstarten hurtig
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, trace_configs=[self._trace_config()],
+                                                  headers={"Content-Type": "application/json"})
+        return self._session
+    
+    @staticmethod
+    def _trace_config():
+        """aiohttp hooks der skriver kø-ventetid og connect tid i kaldets trace dict"""
+        import aiohttp
+        
+        def mark(field):
+            async def hook(session, context, params):
+                context.trace_request_ctx[field] = time.perf_counter()
+            return hook
+        
+        def measure(field, started_field):
+            async def hook(session, context, params):
+                trace = context.trace_request_ctx
+                if started_field in trace:
+                    trace[field] = trace.get(field, 0.0) + time.perf_counter() - trace[started_field]
+            return hook
+        
+        config = aiohttp.TraceConfig()
+        config.on_connection_queued_start.append(mark("queued_at"))
+        config.on_connection_queued_end.append(measure("queue_wait", "queued_at"))
+        config.on_connection_create_start.append(mark("connect_at"))
+        config.on_connection_create_end.append(measure("connect", "connect_at"))
+        return config
+    
+    @contextlib.asynccontextmanager
+    async def request(self, method, path, kind="chat", trace=None, **kwargs):
+        """Lav et HTTP kald og oversæt netværksfejl til LLMTimeout/LLMUnavailable
+
+        `trace` er en dict som kalderen kan skrive ttft og tokens i - den får
+        også kø-ventetid, connect og total tid og sendes til metrics til sidst.
+        """
+        import aiohttp
+        trace = {} if trace is None else trace
+        trace.update(kind=kind, endpoint=self.base_url, path=path, status="ok")
+        started = time.perf_counter()
+        try:
+            async with self._get_session().request(method, self.url(path), timeout=self.timeout_for(kind),
+                                                   trace_request_ctx=trace, **kwargs) as response:
+                response.raise_for_status()
+                try:
+                    yield response
+                except (asyncio.CancelledError, GeneratorExit):
+                    # Afbrudt kald: luk forbindelsen så backenden stopper genereringen
+                    trace["status"] = "cancelled"
+                    response.close()
+                    raise
+        except asyncio.TimeoutError as e:
+            trace["status"] = "timeout"
+            raise LLMTimeout(str(e) or "timeout") from e
+        except aiohttp.ClientConnectionError as e:
+            trace["status"] = "unavailable"
+            raise LLMUnavailable(str(e)) from e
+        except aiohttp.ClientResponseError as e:
+            trace["status"] = f"http_{e.status}"
+            raise
+        except asyncio.CancelledError:
+            trace["status"] = "cancelled"
+            raise
+        finally:
+            trace["total"] = time.perf_counter() - started
+            if self.metrics is not None and kind != "probe":
+                self._finish_trace(trace)
+    
+    def _finish_trace(self, trace):
+        """Udregn afledte tal (tokens/s) og giv trace videre til metrics"""
+        ttft = trace.setdefault("ttft", trace["total"])
+        trace.setdefault("queue_wait", 0.0)  # Genbrugt forbindelse uden ventetid
+        trace.setdefault("connect", 0.0)
+        completion_tokens = trace.get("completion_tokens")
+        if completion_tokens:
+            # Efter første token - uden streaming hele kaldet
+            generation_time = trace["total"] - ttft if trace["total"] - ttft > 0.001 else trace["total"]
+            trace["tokens_per_second"] = completion_tokens / generation_time
+        self.metrics.record_request(trace)
+    
+    @staticmethod
+    def _read_usage(trace, body):
+        """Kopier prompt/completion tokens fra et svars usage felt"""
+        usage = body.get("usage") or {}
+        for field in ("prompt_tokens", "completion_tokens"):
+            if usage.get(field) is not None:
+                trace[field] = usage[field]
+    
+    async def chat(self, data, kind="chat"):
+        """POST til /chat/completions og returner JSON svaret"""
+        trace = {}
+        async with self.request("POST", "chat/completions", kind, trace, json=dict(data, stream=False)) as response:
+            body = await response.json(content_type=None)
+            self._read_usage(trace, body)
+            return body
+    
+    async def stream_chat(self, data, kind="chat"):
+        """POST til /chat/completions med stream=True og giv tokens efterhånden (SSE)"""
+        trace = {}
+        started = time.perf_counter()
+        request_data = dict(data, stream=True, stream_options={"include_usage": True})
+        async with self.request("POST", "chat/completions", kind, trace, json=request_data) as response:
+            streamed_tokens = 0
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8", errors="replace").strip()
+                if not line.startswith("data:"):
+                    continue
+                
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                
+                try:
+                    event = json.loads(payload)
+                except json.JSONDecodeError:
+                    continue
+                
+                # Usage kommer i sidste chunk (uden choices) - ellers tælles chunks til sidst
+                self._read_usage(trace, event)
+                choices = event.get("choices") or []
+                if not choices:
+                    continue
+                token = (choices[0].get("delta") or {}).get("content")
+                if token:
+                    if "ttft" not in trace:
+                        trace["ttft"] = time.perf_counter() - started
+                    streamed_tokens += 1
+                    yield token
+            trace.setdefault("completion_tokens", streamed_tokens)
+    
+    async def embed(self, texts, model=None):
+        """Hent embeddings for en liste af tekster (samme rækkefølge som input)"""
+        data = {"input": list(texts)}
+        if model:
+            data["model"] = model
+        async with self.request("POST", "embeddings", "embedding", json=data) as response:
+            body = await response.json(content_type=None)
+        items = sorted(body["data"], key=lambda item: item.get("index", 0))
+        return [item["embedding"] for item in items]
+    
+    async def models(self):
+        """Hent listen af modeller fra backend"""
+        async with self.request("GET", "models", "probe") as response:
+            return await response.json(content_type=None)
+    
+    async def context_length(self):
+        """Find den indlæste models kontekst længde (None hvis backenden ikke oplyser den)"""
+        root_url = self.base_url[:-len("/v1")] if self.base_url.endswith("/v1") else self.base_url
+        probes = [
+            # OpenAI kompatibel /models (llama.cpp's "meta.n_ctx_train" er trænings-konteksten,
+            # ikke den serveren er startet med, så den bruges ikke - se /props nedenfor)
+            (self.url("models"), lambda body: [model.get("context_length") for model in body.get("data", [])]),
+            # LM Studio REST API
+            (f"{root_url}/api/v0/models", lambda body: [model.get("loaded_context_length")
+                                                        for model in body.get("data", []) if model.get("state") == "loaded"]),
+            # llama.cpp server (kontekst fra -c)
+            (f"{root_url}/props", lambda body: [(body.get("default_generation_settings") or {}).get("n_ctx")
+                                                or body.get("n_ctx")]),
+        ]
+        
+        for url, extract in probes:
+            try:
+                async with self.request("GET", url, "probe") as response:
+                    body = await response.json(content_type=None)
+                lengths = [int(length) for length in extract(body) if length]
+                if lengths:
+                    return min(lengths)
+            except Exception:
+                continue
+        return None
+    
+    async def close(self):
+        """Luk alle forbindelser i poolen"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+class BackendPool:
+    """Flere LLM backends bag samme interface som LLMClient
+
+    Hvert kald går til den raske backend med færrest igangværende kald, og
+    ved forbindelsesfejl eller timeout prøves den næste. /models tjekkes
+    periodisk så døde servere springes over og kommer med igen når de svarer.
+    """
+    
+    def __init__(self, llm_urls, timeout_seconds=45, timeout_enabled=True, pool_size=8, health_interval=30, metrics=None):
+        self.clients = [LLMClient(url, timeout_seconds, timeout_enabled, pool_size, metrics)
+                        for url in self.parse_urls(llm_urls)]
+        if not self.clients:
+            raise ValueError("Mindst én LLM URL er påkrævet")
+        self.health_interval = health_interval  # Sekunder mellem health checks
+        self.healthy = {client: True for client in self.clients}
+        self.outstanding = {client: 0 for client in self.clients}  # Igangværende kald pr. backend
+        self.on_health_change = None  # Callback(raske, total) når en backend går ned eller op
+        self._rotation = 0  # Fordeler kald ligeligt mellem lige travle backends
+    
+    @staticmethod
+    def parse_urls(llm_urls):
+        """Liste af URLs ud fra en liste eller en komma-separeret streng"""
+        if isinstance(llm_urls, str):
+            llm_urls = llm_urls.split(",")
+        return [url.strip() for url in llm_urls if url.strip()]
+    
+    @property
+    def healthy_count(self):
+        return sum(self.healthy.values())
+    
+    def configure(self, timeout_seconds, timeout_enabled):
+        """Opdater timeout indstillinger på alle backends"""
+        for client in self.clients:
+            client.configure(timeout_seconds, timeout_enabled)
+    
+    def _set_healthy(self, client, healthy):
+        if self.healthy[client] != healthy:
+            self.healthy[client] = healthy
+            print(f"LLM backend {client.base_url} {'oppe' if healthy else 'nede'}")
+            if self.on_health_change:
+                self.on_health_change(self.healthy_count, len(self.clients))
+    
+    def _candidates(self):
+        """Backends i den rækkefølge de skal prøves: raske efter belastning, så de nede (sidste udvej)"""
+        start = self._rotation % len(self.clients)
+        self._rotation += 1
+        rotated = self.clients[start:] + self.clients[:start]
+        return sorted(rotated, key=lambda client: (not self.healthy[client], self.outstanding[client]))
+    
+    async def _call(self, method, *args, **kwargs):
+        """Kald method på den mindst belastede backend med failover til de næste"""
+        error = None
+        for client in self._candidates():
+            self.outstanding[client] += 1
+            try:
+                result = await getattr(client, method)(*args, **kwargs)
+            except (LLMUnavailable, LLMTimeout) as e:
+                self._set_healthy(client, False)
+                error = e
+                continue
+            finally:
+                self.outstanding[client] -= 1
+            self._set_healthy(client, True)
+            return result
+        raise error
+    
+    async def chat(self, data, kind="chat"):
+        return await self._call("chat", data, kind)
+    
+    async def stream_chat(self, data, kind="chat"):
+        """Stream fra den mindst belastede backend - failover kun før første token"""
+        error = None
+        for client in self._candidates():
+            started = False
+            self.outstanding[client] += 1
+            try:
+                async for token in client.stream_chat(data, kind):
+                    started = True
+                    yield token
+            except (LLMUnavailable, LLMTimeout) as e:
+                if started:
+                    raise  # Et halvt svar kan ikke fortsættes på en anden backend
+                self._set_healthy(client, False)
+                error = e
+                continue
+            finally:
+                self.outstanding[client] -= 1
+            self._set_healthy(client, True)
+            return
+        raise error
+    
+    async def embed(self, texts, model=None):
+        return await self._call("embed", texts, model)
+    
+    async def check_health(self):
+        """Tjek /models på alle backends samtidig - returnerer de svar der kom"""
+        results = await asyncio.gather(*(client.models() for client in self.clients), return_exceptions=True)
+        for client, result in zip(self.clients, results):
+            self._set_healthy(client, not isinstance(result, BaseException))
+        return [result for result in results if not isinstance(result, BaseException)]
+    
+    async def run_health_checks(self):
+        """Tjek backends med faste mellemrum (kører som baggrunds-task)"""
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health()
+    
+    async def models(self):
+        """Samlet liste af modeller fra alle raske backends"""
+        bodies = await self.check_health()
+        if not bodies:
+            raise LLMUnavailable("Ingen LLM backends svarer")
+        models = {}
+        for body in bodies:
+            for model in body.get("data", []):
+                models.setdefault(model.get("id"), model)
+        return {"object": "list", "data": list(models.values())}
+    
+    async def context_length(self):
+        """Mindste kontekst længde blandt de raske backends (så beskederne passer overalt)"""
+        clients = [client for client in self.clients if self.healthy[client]]
+        lengths = await asyncio.gather(*(client.context_length() for client in clients))
+        lengths = [length for length in lengths if length]
+        return min(lengths) if lengths else None
+    
+    async def close(self):
+        for client in self.clients:
+            await client.close()
+
+class ContextBuilder:
+    """Samler samtale kontekst inden for et token budget (nyeste beskeder først)"""
+    
+    CHARS_PER_TOKEN = 3.5  # Estimat når der ikke er en tokenizer
+    MESSAGE_OVERHEAD = 4  # Tokens til rolle og formatering pr. besked
+    
+    def __init__(self, context_length=4096, max_tokens=400, context_budget=None, safety_margin=64):
+        self.context_length = context_length  # Modellens kontekst længde
+        self.max_tokens = max_tokens  # Plads reserveret til svaret
+        self.context_budget = context_budget  # Valgfrit loft under context_length
+        self.safety_margin = safety_margin
+        self._encoding = None  # Tokenizer loades først ved første optælling
+        self._encoding_loaded = tiktoken is None
+    
+    def count_tokens(self, text):
+        """Antal tokens i en tekst (præcist med tiktoken, ellers estimeret)"""
+        if not self._encoding_loaded:
+            self._encoding_loaded = True
+            try:
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                self._encoding = None
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / self.CHARS_PER_TOKEN)
+    
+    def message_tokens(self, message):
+        """Tokens for en besked - caches i beskeden så hver besked kun tælles én gang"""
+        tokens = message.get("_tokens")
+        if tokens is None:
+            tokens = self.count_tokens(message["content"]) + self.MESSAGE_OVERHEAD
+            message["_tokens"] = tokens
+        return tokens
+    
+    def available_tokens(self, system_content):
+        """Tokens til historik efter system prompt, minder og svar er trukket fra"""
+        total = self.context_length
+        if self.context_budget:
+            total = min(total, self.context_budget)
+        system_tokens = self.count_tokens(system_content) + self.MESSAGE_OVERHEAD
+        return total - self.max_tokens - self.safety_margin - system_tokens
+    
+    def fits(self, history, system_content, start):
+        """Tjek om alle beskeder fra start kan være i budgettet"""
+        budget = self.available_tokens(system_content)
+        used = 0
+        for message in history[start:]:
+            if message["role"] == "system":
+                continue
+            used += self.message_tokens(message)
+            if used > budget:
+                return False
+        return True
+    
+    def build(self, history, system_content, min_start=0, fill_ratio=1.0):
+        """Byg beskeder til API'et - returnerer (beskeder, index på ældste medtagne besked)
+
+        Beskeder før min_start (fx allerede opsummerede) tages ikke med, og
+        fill_ratio < 1 efterlader plads så vinduet kan vokse et stykke tid.
+        """
+        budget = int(self.available_tokens(system_content) * fill_ratio)
+        selected = []
+        start = len(history)
+        used = 0
+        
+        for i in range(len(history) - 1, min(min_start, len(history) - 1) - 1, -1):
+            message = history[i]
+            if message["role"] == "system":
+                continue
+            tokens = self.message_tokens(message)
+            # Den nyeste besked kommer altid med, også selvom den er for lang
+            if selected and used + tokens > budget:
+                break
+            used += tokens
+            selected.append({"role": message["role"], "content": message["content"]})
+            start = i
+        
+        selected.reverse()
+        return [{"role": "system", "content": system_content}] + selected, start
+
+class MemoryIndex:
+    """Embedding indeks over minder - relevans findes med ét matrix-vektor produkt"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ids = []
+        self.positions = {}  # memory_id -> række i vectors
+        self.vectors = None  # (kapacitet, dim) float32 med normaliserede rækker
+        self.importance = None  # (kapacitet,) float32
+    
+    @property
+    def available(self):
+        """Indekset kræver numpy"""
+        return np is not None
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __contains__(self, memory_id):
+        return memory_id in self.positions
+    
+    def load(self):
+        """Load indeks fra disk"""
+        if np is None or not os.path.exists(self.path):
+            return
+        
+        with np.load(self.path, allow_pickle=False) as data:
+            ids = [str(memory_id) for memory_id in data["ids"]]
+            vectors = data["vectors"].astype(np.float32)
+            importance = data["importance"].astype(np.float32)
+        
+        with self.lock:
+            self.ids = ids
+            self.positions = {memory_id: i for i, memory_id in enumerate(ids)}
+            self.vectors = vectors if ids else None
+            self.importance = importance if ids else None
+    
+    def save(self):
+        """Gem indeks atomisk (write_atomic)"""
+        if np is None:
+            return
+        
+        with self.lock:
+            count = len(self.ids)
+            ids = np.array(self.ids, dtype=str)
+            vectors = self.vectors[:count].copy() if count else np.zeros((0, 0), dtype=np.float32)
+            importance = self.importance[:count].copy() if count else np.zeros(0, dtype=np.float32)
+        
+        buffer = io.BytesIO()
+        np.savez(buffer, ids=ids, vectors=vectors, importance=importance)
+        write_atomic(self.path, buffer.getvalue())
+    
+    def add(self, memory_ids, vectors, importances):
+        """Tilføj (eller opdater) embeddings for minder"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+        
+        with self.lock:
+            if self.vectors is not None and self.vectors.shape[1] != vectors.shape[1]:
+                # Ny embedding model med anden dimension - start forfra
+                self._reset()
+            
+            for memory_id, vector, importance in zip(memory_ids, vectors, importances):
+                position = self.positions.get(memory_id)
+                if position is None:
+                    position = len(self.ids)
+                    self._ensure_capacity(position + 1, vectors.shape[1])
+                    self.ids.append(memory_id)
+                    self.positions[memory_id] = position
+                self.vectors[position] = vector
+                self.importance[position] = importance
+    
+    def _ensure_capacity(self, needed, dim):
+        """Voks arrays med fordobling så tilføjelser er amortiseret O(1)"""
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if needed <= capacity:
+            return
+        
+        new_capacity = max(needed, capacity * 2, 64)
+        vectors = np.zeros((new_capacity, dim), dtype=np.float32)
+        importance = np.zeros(new_capacity, dtype=np.float32)
+        if capacity:
+            vectors[:capacity] = self.vectors
+            importance[:capacity] = self.importance
+        self.vectors = vectors
+        self.importance = importance
+    
+    def remove(self, memory_ids):
+        """Fjern minder (sidste række flyttes ind i hullet)"""
+        with self.lock:
+            for memory_id in memory_ids:
+                position = self.positions.pop(memory_id, None)
+                if position is None:
+                    continue
+                last = len(self.ids) - 1
+                if position != last:
+                    moved_id = self.ids[last]
+                    self.ids[position] = moved_id
+                    self.positions[moved_id] = position
+                    self.vectors[position] = self.vectors[last]
+                    self.importance[position] = self.importance[last]
+                self.ids.pop()
+    
+    def sync(self, existing_ids):
+        """Fjern embeddings for minder der ikke længere findes"""
+        existing_ids = set(existing_ids)
+        self.remove([memory_id for memory_id in list(self.ids) if memory_id not in existing_ids])
+    
+    def clear(self):
+        """Ryd hele indekset"""
+        with self.lock:
+            self._reset()
+    
+    def _reset(self):
+        self.ids = []
+        self.positions = {}
+        self.vectors = None
+        self.importance = None
+    
+    def search(self, query_vector, k=8, similarity_weight=0.7):
+        """Find top-k minder efter en blanding af cosine lighed og vigtighed"""
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+        
+        with self.lock:
+            count = len(self.ids)
+            if count == 0 or query.shape[0] != self.vectors.shape[1]:
+                return []
+            
+            scores = self.vectors[:count] @ query
+            scores = similarity_weight * scores + (1.0 - similarity_weight) * (self.importance[:count] / 10.0)
+            
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [self.ids[i] for i in top]
+
+class MemoryDedupIndex:
+    """Dublet-indeks over minder: normaliseret tekst, ord-indeks og prefix-filter over indholdsord
+
+    Et nyt minde er en dublet hvis teksten findes i forvejen, hvis den ene tekst
+    indgår i den anden (hele ord), eller hvis indholdsordene (uden fyldord og med
+    enkle bøjninger fjernet) kun adskiller sig ved tilføjede ord - en udskiftet
+    oplysning ("kaffe" -> "te") gør altid to minder forskellige. Alle opslag er
+    deterministiske; prefix-filteret finder alle par over tærsklen.
+    """
+    
+    STOPWORDS = frozenset("""
+        brugeren brugerens bruger brugers personen han hun hans hendes sin sit sine
+        og eller men i en et er var at der som på til med af for den det de dem om fra
+        har havde kan vil skal gerne godt meget også nu lige bare både
+    """.split())
+    NEGATIONS = frozenset(["ikke", "aldrig", "ingen", "intet"])
+    SYNONYMS = {"navn": "hedder", "kaldes": "hedder", "elsker": "lide", "bosat": "bor"}
+    SUFFIXES = ("erne", "ene", "ens", "ers", "er", "en", "et", "e", "s")
+    
+    def __init__(self, threshold=0.7):
+        self.lock = threading.Lock()
+        self._threshold = threshold  # Jaccard lighed (over indholdsord) hvor to minder regnes som dubletter
+        self.clear()
+    
+    @property
+    def threshold(self):
+        return self._threshold
+    
+    @threshold.setter
+    def threshold(self, value):
+        with self.lock:
+            if value == self._threshold:
+                return
+            # Prefix længderne afhænger af tærsklen - byg prefix-indekset om
+            self._threshold = value
+            self.prefixes = {}
+            for memory_id, (normalized, terms, _) in list(self.entries.items()):
+                prefix = self._prefix(terms)
+                self.entries[memory_id] = (normalized, terms, prefix)
+                for term in prefix:
+                    self.prefixes.setdefault(term, set()).add(memory_id)
+    
+    @staticmethod
+    def normalize(text):
+        """Små bogstaver, uden tegnsætning og ekstra mellemrum"""
+        return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+    
+    def _terms(self, normalized):
+        """Indholdsord uden fyldord, med få synonymer samlet og enkle endelser fjernet"""
+        terms = set()
+        for word in normalized.split():
+            if word in self.STOPWORDS:
+                continue
+            word = self.SYNONYMS.get(word, word)
+            for suffix in () if word in self.NEGATIONS else self.SUFFIXES:
+                if len(word) - len(suffix) >= 3 and word.endswith(suffix):
+                    word = word[:-len(suffix)]
+                    break
+            terms.add(word)
+        return frozenset(terms)
+    
+    def _prefix(self, terms):
+        """Prefix i fast orden: to mængder med Jaccard >= tærsklen deler altid et prefix ord"""
+        ordered = sorted(terms, key=lambda term: (zlib.crc32(term.encode("utf-8")), term))
+        return ordered[:len(ordered) - math.ceil(self._threshold * len(ordered)) + 1]
+    
+    def clear(self):
+        """Ryd indekset"""
+        with self.lock:
+            self.exact = {}  # normaliseret tekst -> memory_id
+            self.words = {}  # ord -> set af memory_id (til "indeholdt i" tjekket)
+            self.prefixes = {}  # prefix ord -> set af memory_id
+            self.entries = {}  # memory_id -> (normaliseret tekst, indholdsord, prefix ord)
+    
+    def rebuild(self, memories):
+        """Byg indekset op fra bunden ud fra {memory_id: memory_data}"""
+        self.clear()
+        for memory_id, memory_data in memories.items():
+            self.add(memory_id, memory_data.get("info", ""))
+    
+    def add(self, memory_id, text):
+        """Tilføj et minde til indekset"""
+        normalized = self.normalize(text)
+        if not normalized:
+            return
+        terms = self._terms(normalized)
+        
+        with self.lock:
+            self._remove_locked(memory_id)
+            prefix = self._prefix(terms)
+            self.exact[normalized] = memory_id
+            for word in set(normalized.split()):
+                self.words.setdefault(word, set()).add(memory_id)
+            for term in prefix:
+                self.prefixes.setdefault(term, set()).add(memory_id)
+            self.entries[memory_id] = (normalized, terms, prefix)
+    
+    def remove(self, memory_id):
+        """Fjern et minde fra indekset"""
+        with self.lock:
+            self._remove_locked(memory_id)
+    
+    def _remove_locked(self, memory_id):
+        entry = self.entries.pop(memory_id, None)
+        if entry is None:
+            return
+        normalized, _, prefix = entry
+        if self.exact.get(normalized) == memory_id:
+            del self.exact[normalized]
+        for index, keys in ((self.words, set(normalized.split())), (self.prefixes, prefix)):
+            for key in keys:
+                bucket = index.get(key)
+                if bucket is not None:
+                    bucket.discard(memory_id)
+                    if not bucket:
+                        del index[key]
+    
+    def _find_containment(self, normalized):
+        """Minde hvis tekst indgår i den nye (eller omvendt) som hele ord"""
+        words = normalized.split()
+        # Eksisterende minder inde i den nye tekst: alle sammenhængende ordsekvenser slås op
+        for start in range(len(words)):
+            for end in range(len(words), start, -1):
+                span = " ".join(words[start:end])
+                if len(span) <= 10:
+                    break
+                if span in self.exact:
+                    return self.exact[span]
+        
+        # Den nye tekst inde i et eksisterende minde: det må indeholde alle ordene
+        if len(normalized) <= 10:
+            return None
+        postings = [self.words.get(word, ()) for word in set(words)]
+        for memory_id in min(postings, key=len):
+            if not all(memory_id in posting for posting in postings):
+                continue
+            if f" {normalized} " in f" {self.entries[memory_id][0]} ":
+                return memory_id
+        return None
+    
+    def _is_rewording(self, terms, existing_terms):
+        """Samme oplysning med andre ord: kun tilføjede ord, ingen udskiftede og samme nægtelse"""
+        if terms & self.NEGATIONS != existing_terms & self.NEGATIONS:
+            return False
+        if not (terms <= existing_terms or existing_terms <= terms):
+            return False
+        return len(terms & existing_terms) / len(terms | existing_terms) >= self._threshold
+    
+    def find_duplicate(self, text):
+        """Returner id på et eksisterende minde der ligner teksten, ellers None"""
+        normalized = self.normalize(text)
+        if not normalized:
+            return None
+        terms = self._terms(normalized)
+        
+        with self.lock:
+            if normalized in self.exact:
+                return self.exact[normalized]
+            
+            memory_id = self._find_containment(normalized)
+            if memory_id is not None:
+                return memory_id
+            
+            if not terms:
+                return None
+            candidates = set()
+            for term in self._prefix(terms):
+                candidates.update(self.prefixes.get(term, ()))
+            for memory_id in candidates:
+                existing_terms = self.entries[memory_id][1]
+                if existing_terms and self._is_rewording(terms, existing_terms):
+                    return memory_id
+        return None
+
+class MemoryStore:
+    """Minder med kollisionsfrie id'er og sorterede indekser efter vigtighed og oprettelse"""
+    
+    HEADER = "\n\nVigtig information om brugeren (brug til at give bedre svar):\n"
+    
+    def __init__(self, memories=None):
+        self._last_id = 0
+        self.load(memories or {})
+    
+    def load(self, memories):
+        """Erstat alle minder med {memory_id: memory_data} (fx fra user_memory.json)"""
+        # Nye objekter frem for at tømme de gamle, så skrive-tråden altid ser et helt øjebliksbillede
+        self._memories = {}
+        self._by_importance = []  # Sorteret efter (-vigtighed, oprettet, id)
+        self._by_created = []  # Sorteret efter (oprettet, id)
+        self._blocks = {}  # Cache af færdige prompt blokke pr. k
+        self.version = 0
+        for memory_id, memory_data in memories.items():
+            self.insert(memory_id, memory_data)
+    
+    def clear(self):
+        self.load({})
+    
+    def _new_id(self):
+        """Millisekund id som de gamle, men aldrig det samme to gange"""
+        candidate = max(int(time.time() * 1000), self._last_id + 1)
+        while str(candidate) in self._memories:
+            candidate += 1
+        self._last_id = candidate
+        return str(candidate)
+    
+    @staticmethod
+    def _importance_key(memory_id, memory_data):
+        return (-memory_data.get("importance", 0), memory_data.get("created", ""), memory_id)
+    
+    @staticmethod
+    def _created_key(memory_id, memory_data):
+        return (memory_data.get("created", ""), memory_id)
+    
+    def add(self, memory_data):
+        """Tilføj et nyt minde og returner dets id"""
+        memory_id = self._new_id()
+        self.insert(memory_id, memory_data)
+        return memory_id
+    
+    def insert(self, memory_id, memory_data):
+        """Indsæt (eller erstat) et minde under et bestemt id"""
+        if memory_id in self._memories:
+            self.remove(memory_id)
+        if memory_id.isdigit():
+            self._last_id = max(self._last_id, int(memory_id))
+        self._memories[memory_id] = memory_data
+        bisect.insort(self._by_importance, self._importance_key(memory_id, memory_data))
+        bisect.insort(self._by_created, self._created_key(memory_id, memory_data))
+        self._changed()
+    
+    def remove(self, memory_id):
+        """Fjern et minde - returnerer dets data eller None"""
+        memory_data = self._memories.pop(memory_id, None)
+        if memory_data is None:
+            return None
+        for index, key in ((self._by_importance, self._importance_key(memory_id, memory_data)),
+                           (self._by_created, self._created_key(memory_id, memory_data))):
+            del index[bisect.bisect_left(index, key)]
+        self._changed()
+        return memory_data
+    
+    def _changed(self):
+        self.version += 1
+        self._blocks = {}
+    
+    def __len__(self):
+        return len(self._memories)
+    
+    def __contains__(self, memory_id):
+        return memory_id in self._memories
+    
+    def __getitem__(self, memory_id):
+        return self._memories[memory_id]
+    
+    def __iter__(self):
+        return iter(self._memories)
+    
+    def get(self, memory_id, default=None):
+        return self._memories.get(memory_id, default)
+    
+    def keys(self):
+        return self._memories.keys()
+    
+    def values(self):
+        return self._memories.values()
+    
+    def items(self):
+        return self._memories.items()
+    
+    def copy(self):
+        """Almindelig dict kopi (til JSON)"""
+        return dict(self._memories)
+    
+    def _ordered(self, index, limit=None, reverse=False):
+        # Lokale referencer: GUI tråden kan læse mens motoren rydder (clear laver nye objekter)
+        memories = self._memories
+        keys = index[::-1] if reverse else index[:]
+        return [(key[-1], memories[key[-1]]) for key in keys[:limit] if key[-1] in memories]
+    
+    def by_importance(self):
+        """[(memory_id, memory_data)] med de vigtigste først"""
+        return self._ordered(self._by_importance)
+    
+    def by_created(self, newest=False):
+        """[(memory_id, memory_data)] efter oprettelse (ældste først som standard)"""
+        return self._ordered(self._by_created, reverse=newest)
+    
+    def top(self, k):
+        """De k vigtigste minder uden at sortere"""
+        return self._ordered(self._by_importance[:k])
+    
+    def prompt_block(self, k):
+        """Minde-blok til system prompten - bygges kun igen når minderne ændres"""
+        block = self._blocks.get(k)
+        if block is None:
+            lines = [f"- {memory_data['info']}\n" for _, memory_data in self.top(k) if memory_data.get("info")]
+            block = self.HEADER + "".join(lines) if lines else ""
+            self._blocks[k] = block
+        return block
+
+class SessionStore:
+    """SQLite lager til samtaler - hver besked er en række, så en gemning skriver kun nye beskeder"""
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        
+        # WAL giver atomiske, crash-sikre skrivninger uden at omskrive hele filen
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                created TEXT NOT NULL,
+                user TEXT,
+                user_count INTEGER NOT NULL DEFAULT 0,
+                summary TEXT NOT NULL DEFAULT '',
+                summary_upto INTEGER NOT NULL DEFAULT 0,
+                memory_watermark INTEGER NOT NULL DEFAULT 0,
+                updated TEXT
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            ) WITHOUT ROWID;
+        """)
+        self._migrate()
+    
+    def _migrate(self):
+        """Tilføj metadata kolonner til databaser oprettet af ældre versioner"""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(sessions)")}
+        if "user_count" not in columns:
+            self.conn.execute("ALTER TABLE sessions ADD COLUMN user_count INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute("""UPDATE sessions SET user_count = (
+                SELECT COUNT(*) FROM messages WHERE session_id = sessions.id AND role = 'user')""")
+        if "summary" not in columns:
+            self.conn.execute("ALTER TABLE sessions ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+            self.conn.execute("ALTER TABLE sessions ADD COLUMN summary_upto INTEGER NOT NULL DEFAULT 0")
+        if "memory_watermark" not in columns:
+            self.conn.execute("ALTER TABLE sessions ADD COLUMN memory_watermark INTEGER NOT NULL DEFAULT 0")
+        if "updated" not in columns:
+            self.conn.execute("ALTER TABLE sessions ADD COLUMN updated TEXT")
+            self.conn.execute("UPDATE sessions SET updated = created")
+    
+    @staticmethod
+    def _user_count(messages):
+        """Antal brugerbeskeder i en liste af beskeder"""
+        return sum(1 for msg in messages if msg["role"] == "user")
+    
+    def _transaction(self, statements):
+        """Kør en række SQL statements som én atomisk transaktion"""
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN")
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        self.conn.executemany(sql, params)
+                    else:
+                        self.conn.execute(sql, params)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+    
+    def is_empty(self):
+        """Tjek om lageret endnu ikke har nogen sessions"""
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone() is None
+    
+    def create_session(self, session_id, name, created, user, history=()):
+        """Opret (eller overskriv) en session med evt. start historik"""
+        rows = [(session_id, seq, msg["role"], msg["content"]) for seq, msg in enumerate(history)]
+        self._transaction([
+            ("DELETE FROM messages WHERE session_id = ?", (session_id,)),
+            ("INSERT OR REPLACE INTO sessions (id, name, created, user, user_count, updated) VALUES (?, ?, ?, ?, ?, ?)",
+             (session_id, name, created.isoformat(), user, self._user_count(history), created.isoformat())),
+            ("INSERT INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)", rows),
+        ])
+    
+    def append_messages(self, session_id, start_seq, messages, updated=None):
+        """Tilføj nye beskeder fra position start_seq"""
+        rows = [(session_id, start_seq + i, msg["role"], msg["content"]) for i, msg in enumerate(messages)]
+        if rows:
+            updated = updated or datetime.now()
+            self._transaction([
+                ("INSERT OR REPLACE INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)", rows),
+                ("UPDATE sessions SET user_count = user_count + ?, updated = ? WHERE id = ?",
+                 (self._user_count(messages), updated.isoformat(), session_id)),
+            ])
+    
+    def replace_history(self, session_id, history, updated=None):
+        """Erstat hele historikken (fx når chatten ryddes)"""
+        rows = [(session_id, seq, msg["role"], msg["content"]) for seq, msg in enumerate(history)]
+        updated = updated or datetime.now()
+        self._transaction([
+            ("DELETE FROM messages WHERE session_id = ?", (session_id,)),
+            ("INSERT INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)", rows),
+            ("UPDATE sessions SET user_count = ?, updated = ? WHERE id = ?",
+             (self._user_count(history), updated.isoformat(), session_id)),
+        ])
+    
+    def update_summary(self, session_id, summary, summary_upto):
+        """Gem løbende resumé af beskeder før position summary_upto"""
+        self._transaction([
+            ("UPDATE sessions SET summary = ?, summary_upto = ? WHERE id = ?", (summary, summary_upto, session_id)),
+        ])
+    
+    def update_memory_watermark(self, session_id, watermark):
+        """Gem hvor langt hukommelse-analysen er nået i en session"""
+        self._transaction([
+            ("UPDATE sessions SET memory_watermark = ? WHERE id = ?", (watermark, session_id)),
+        ])
+    
+    def delete_session(self, session_id):
+        """Slet session og dens beskeder"""
+        self._transaction([
+            ("DELETE FROM messages WHERE session_id = ?", (session_id,)),
+            ("DELETE FROM sessions WHERE id = ?", (session_id,)),
+        ])
+    
+    def list_sessions(self, user):
+        """Load kun metadata (navn, tidspunkter, antal brugerbeskeder, resumé) for en brugers sessions, ældste først"""
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT id, name, created, user, user_count, summary, summary_upto, memory_watermark, updated
+                   FROM sessions WHERE user = ? ORDER BY created, id""", (user,)).fetchall()
+        
+        return {session_id: {
+                    "name": name,
+                    "created": datetime.fromisoformat(created),
+                    "updated": datetime.fromisoformat(updated or created),
+                    "user": owner,
+                    "user_count": user_count,
+                    "summary": summary,
+                    "summary_upto": summary_upto,
+                    "memory_watermark": memory_watermark
+                } for session_id, name, created, owner, user_count, summary, summary_upto, memory_watermark, updated in rows}
+    
+    def load_history(self, session_id):
+        """Load den fulde historik for én session"""
+        with self.lock:
+            return [{"role": role, "content": content} for role, content in self.conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq", (session_id,))]
+    
+    def import_legacy_pickle(self, pickle_path, user):
+        """Importer sessions fra det gamle chat_sessions.pkl format"""
+        with open(pickle_path, 'rb') as f:
+            all_sessions = pickle.load(f)
+        
+        count = 0
+        for session_id, session_data in all_sessions.items():
+            if session_data.get("user") != user:
+                continue
+            self.create_session(session_id, session_data.get("name", session_id),
+                                session_data.get("created", datetime.now()), user,
+                                session_data.get("history", []))
+            count += 1
+        return count
+    
+    def compact(self):
+        """Flyt WAL ind i databasen og frigiv slettede sider"""
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.conn.execute("PRAGMA incremental_vacuum")
+    
+    def close(self):
+        """Komprimer og luk databasen"""
+        try:
+            self.compact()
+        finally:
+            with self.lock:
+                self.conn.close()
+
+class ResponseCache:
+    """SQLite cache med færdige svar nøglet på de præcise beskeder + sampling parametre
+
+    Gamle svar (efter `max_age` sekunder) bruges ikke, og når cachen fylder mere
+    end `max_bytes` fjernes de mindst brugte først (LRU).
+    """
+    
+    SAMPLING_KEYS = ("model", "temperature", "top_p", "top_k", "min_p", "max_tokens", "seed",
+                     "stop", "presence_penalty", "frequency_penalty", "repeat_penalty")
+    
+    def __init__(self, db_path, max_bytes=50 * 1024 * 1024, max_age=7 * 24 * 3600):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                reply TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+        """)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.evict()
+    
+    @classmethod
+    def key_for(cls, data):
+        """Hash af beskederne og sampling parametrene (backend hints som cache_prompt tæller ikke)"""
+        keyed = {name: data[name] for name in cls.SAMPLING_KEYS if name in data}
+        keyed["messages"] = data["messages"]
+        encoded = json.dumps(keyed, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+    
+    def get(self, key):
+        """Hent et svar (None hvis det mangler eller er for gammelt) og marker det som brugt"""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT reply, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        return row[0]
+    
+    def put(self, key, reply):
+        """Gem et svar og ryd op hvis cachen er blevet for stor"""
+        now = time.time()
+        size = len(reply.encode("utf-8"))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                              (key, reply, size, now, now))
+            self.total_bytes += size - (old[0] if old else 0)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+    
+    def evict(self):
+        """Fjern for gamle svar og derefter de mindst brugte indtil cachen er under max_bytes"""
+        with self.lock:
+            self.conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+            self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if self.total_bytes <= self.max_bytes:
+                return
+            
+            # Ryd ned til 90% så der ikke skal ryddes op ved hver ny gemning
+            target = self.max_bytes * 0.9
+            doomed = []
+            for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+                if self.total_bytes <= target:
+                    break
+                doomed.append((key,))
+                self.total_bytes -= size
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+    
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.total_bytes = 0
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def write_atomic(path, data):
+    """Skriv bytes til en fil via temp fil + rename, så en halv skrivning aldrig erstatter den gamle fil"""
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                     dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+class PersistenceWriter:
+    """Én baggrundstråd der samler skrivninger til disk, så kaldere aldrig venter på I/O
+
+    Kaldere melder en nøgle beskidt med den funktion der skriver den. Gentagne
+    meldinger samles (debounce) og skrives tidligst `delay` sekunder efter den
+    seneste, men aldrig senere end `max_delay` efter den første.
+    """
+    
+    def __init__(self, delay=1.0, max_delay=5.0, metrics=None):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.metrics = metrics  # Måler tiden pr. skrivning (persist_seconds, op = nøglens type)
+        self._pending = {}  # nøgle -> (skrive funktion, første melding, seneste melding)
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()  # Én skrivning ad gangen (tråden og flush)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="persistence-writer", daemon=True)
+        self._thread.start()
+    
+    def mark_dirty(self, key, write):
+        """Planlæg write() for nøglen (erstatter en ventende skrivning af samme nøgle)"""
+        now = time.monotonic()
+        with self._condition:
+            if not self._closed:
+                first = self._pending[key][1] if key in self._pending else now
+                self._pending[key] = (write, first, now)
+                self._condition.notify()
+                return
+        # Efter close skrives med det samme
+        self._write([(key, write)])
+    
+    def _deadline(self, entry):
+        write, first, last = entry
+        return min(last + self.delay, first + self.max_delay)
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    now = time.monotonic()
+                    due = [key for key, entry in self._pending.items()
+                           if self._closed or self._deadline(entry) <= now]
+                    if due:
+                        batch = [(key, self._pending.pop(key)[0]) for key in due]
+                        break
+                    timeout = min(map(self._deadline, self._pending.values())) - now if self._pending else None
+                    self._condition.wait(timeout)
+            self._write(batch)
+    
+    def _write(self, batch):
+        with self._write_lock:
+            for key, write in batch:
+                started = time.perf_counter()
+                try:
+                    write()
+                except Exception as e:
+                    print(f"Fejl ved gemning: {e}")
+                if self.metrics is not None:
+                    op = key[0] if isinstance(key, tuple) else key
+                    self.metrics.observe("persist_seconds", time.perf_counter() - started, op=op)
+    
+    def flush(self):
+        """Skriv alt ventende nu (i den kaldende tråd)"""
+        with self._condition:
+            batch = [(key, entry[0]) for key, entry in self._pending.items()]
+            self._pending.clear()
+        self._write(batch)
+    
+    def close(self):
+        """Skriv alt ventende og stop tråden"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+class ChatEngine:
+    """Chat, hukommelse og sessions for én bruger - alle netværkskald er coroutines på én event loop"""
+    
+    def __init__(self, user_id, data_dir=None, llm_url=DEFAULT_LLM_URL, llm_client=None):
+        self.user_id = user_id
+        self.data_dir = data_dir or user_data_dir(user_id)
+        os.makedirs(self.data_dir, exist_ok=True)
+        
+        # Konfigurerbare indstillinger
+        self.timeout_seconds = 45  # Standard timeout
+        self.timeout_enabled = True  # Om timeout er aktiveret
+        self.stream_enabled = True  # Giv svar løbende mens de genereres
+        self.temperature = 0.7
+        self.max_response_tokens = 400  # Max tokens i et svar
+        self.context_length = 4096  # Modellens kontekst længde (opdateres fra backend)
+        self.context_budget = None  # Loft over tokens pr. forespørgsel (None = hele konteksten)
+        self.summary_enabled = True  # Opsummer beskeder der ikke længere er plads til
+        self.summary_max_tokens = 250  # Max længde på resuméet
+        
+        # Stabilt prompt-prefix så backenden kan genbruge sin KV-cache
+        self.stable_prefix_enabled = True
+        self.stable_prefix_fill_ratio = 0.6  # Andel af budgettet der bruges efter en rebase
+        self.cache_prompt_hints = True  # Send cache_prompt (llama.cpp) med forespørgsler
+        self.llm_slot_count = None  # Antal llama.cpp slots (sæt for at fastholde session -> slot)
+        
+        # Cache af færdige svar på disk (kun for deterministiske forespørgsler med mindre det tvinges)
+        self.response_cache_enabled = False
+        self.response_cache_force = False  # Brug også cachen når temperature > 0
+        self.response_cache_max_mb = 50
+        self.response_cache_max_age_days = 7
+        self.response_cache_file = os.path.join(self.data_dir, "response_cache.db")
+        self._response_cache = None  # Åbnes først når cachen bruges
+        
+        # System prompts
+        self.danish_prompt = DANISH_PROMPT
+        self.english_prompt = ENGLISH_PROMPT
+        self.system_prompt = {"role": "system", "content": self.danish_prompt}
+        
+        # Tidsmålinger af LLM kald, gemning og UI (vises i GUI'en og kan eksporteres)
+        self.metrics = Metrics()
+        
+        # Én pool til alle LLM kald (chat, hukommelse, status) - llm_url kan være flere URLs.
+        # En server kan give en fælles pool (llm_client) til alle brugeres motorer
+        self.health_check_interval = 30  # Sekunder mellem tjek af backends
+        self._owns_llm_client = llm_client is None
+        if self._owns_llm_client:
+            llm_client = BackendPool(llm_url, self.timeout_seconds, self.timeout_enabled,
+                                     health_interval=self.health_check_interval, metrics=self.metrics)
+            llm_client.on_health_change = lambda healthy, total: self._emit("backend_status", healthy=healthy, total=total)
+        self.llm_client = llm_client
+        self.context_builder = ContextBuilder(self.context_length, self.max_response_tokens, self.context_budget)
+        
+        # Session management (per bruger)
+        self.sessions = {}  # Metadata for alle sessions, historik kun for de indlæste
+        self._session_order = []  # Session id'er ældste først (vedligeholdes løbende, sorteres ikke ved visning)
+        self.sessions_version = 0  # Tælles op når sessions oprettes/slettes
+        self._filter_cache = None  # (version, filter, id'er) for seneste navne-filter
+        self.loaded_sessions = OrderedDict()  # LRU over sessions med historik i RAM
+        self.session_cache_max_messages = 5000  # Loft over beskeder holdt i RAM
+        self.sessions_file = os.path.join(self.data_dir, "chat_sessions.pkl")  # Gammelt format (importeres)
+        self.sessions_db = os.path.join(self.data_dir, "chat_sessions.db")
+        self.session_store = SessionStore(self.sessions_db)
+        self._persist_lock = threading.Lock()  # Sessions gemmes både fra event loopet og skrive-tråden
+        self._summarizing = set()  # Sessions hvor et resumé er ved at blive lavet
+        self._active_sessions = {}  # Session id -> task med et svar undervejs (må ikke fjernes fra RAM, kan annulleres)
+        
+        # AI Hukommelse system (automatisk og persistent)
+        self.user_memory = MemoryStore()  # Opfører sig som {memory_id: memory_data}
+        self.memory_file = os.path.join(self.data_dir, "user_memory.json")
+        self.auto_memory_enabled = True
+        self.auto_memory_threshold = 3  # Antal svar før automatisk memory-opdatering
+        self.message_count = 0
+        self._memory_queue = asyncio.Queue()  # (session_id, opdater snapshot) til hukommelse-workeren
+        self._memory_worker_task = None
+        self._memory_task = None  # Igangværende udtræk (kan annulleres uden at stoppe workeren)
+        
+        # Relevans-sortering af minder via embeddings
+        self.memory_index = MemoryIndex(os.path.join(self.data_dir, "user_memory_vectors.npz"))
+        self.embedding_model = None  # None = backendens standard embedding model
+        self.memory_top_k = 8  # Antal minder der sendes med til AI'en
+        self.memory_similarity_weight = 0.7  # 1.0 = kun relevans, 0.0 = kun vigtighed
+        
+        # Dublet-tjek af nye minder (0-1, andel fælles indholdsord når den ene blot tilføjer ord)
+        self.memory_duplicate_threshold = 0.7
+        self.memory_dedup = MemoryDedupIndex(self.memory_duplicate_threshold)
+        
+        self._memory_snapshot = None  # Minde-blok der kun ændres ved eksplicitte opdateringer
+        self._memory_snapshot_version = 0
+        
+        # Al løbende gemning sker debounced i én baggrundstråd
+        self.autosave_delay = 1.0  # Sekunder efter sidste ændring
+        self.autosave_max_delay = 5.0  # Max sekunder ændringer kan vente på disk
+        self.writer = PersistenceWriter(self.autosave_delay, self.autosave_max_delay, self.metrics)
+        
+        self.listeners = []  # Callbacks (event, data) fx til en GUI
+        self._tasks = set()
+        
+        # Load eksisterende data
+        self.load_sessions()
+        self.load_user_memory()
+    
+    # Livscyklus og events
+    async def start(self):
+        """Start baggrundsarbejde (hukommelse-worker og indeksering af minder)"""
+        if self._memory_worker_task is None:
+            self._memory_worker_task = asyncio.create_task(self._memory_worker())
+        if self._memory_relevance_enabled():
+            self._spawn(self._backfill_memory_index())
+        if self._owns_llm_client and len(self.llm_client.clients) > 1:
+            self._spawn(self.llm_client.run_health_checks())
+    
+    async def close(self):
+        """Gem alt og luk forbindelser"""
+        if self._memory_worker_task is not None:
+            self._memory_worker_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._memory_worker_task
+            self._memory_worker_task = None
+        for task in list(self._tasks):
+            task.cancel()
+        
+        # Ventende skrivninger først, så de resterende beskeder, og til sidst databasen
+        self.writer.close()
+        self.save_sessions()
+        self.session_store.close()
+        if self._response_cache is not None:
+            self._response_cache.close()
+        if self._owns_llm_client:
+            await self.llm_client.close()
+    
+    def add_listener(self, callback):
+        """Registrer callback(event, data) for status hændelser"""
+        self.listeners.append(callback)
+    
+    def _emit(self, event, **data):
+        for callback in list(self.listeners):
+            try:
+                callback(event, data)
+            except Exception as e:
+                print(f"Fejl i event listener: {e}")
+    
+    def _spawn(self, coro):
+        """Start en baggrunds-task og hold en reference til den er færdig"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    def update_settings(self, **settings):
+        """Opdater indstillinger og giv dem videre til klient og kontekst builder"""
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise AttributeError(f"Ukendt indstilling: {name}")
+            setattr(self, name, value)
+        
+        if "stable_prefix_enabled" in settings and self._memory_relevance_enabled() and self._memory_worker_task:
+            # Relevans-søgning kan være slået til - indekser de minder der er kommet imens
+            self._spawn(self._backfill_memory_index())
+        
+        if self._owns_llm_client:
+            self.llm_client.configure(self.timeout_seconds, self.timeout_enabled)
+            self.llm_client.health_interval = self.health_check_interval
+        self.context_builder.context_length = self.context_length
+        self.context_builder.max_tokens = self.max_response_tokens
+        self.context_builder.context_budget = self.context_budget
+        self.memory_dedup.threshold = self.memory_duplicate_threshold
+        self.writer.delay = self.autosave_delay
+        self.writer.max_delay = self.autosave_max_delay
+        if self._response_cache is not None:
+            self._response_cache.max_bytes = self.response_cache_max_mb * 1024 * 1024
+            self._response_cache.max_age = self.response_cache_max_age_days * 24 * 3600
+    
+    async def check_connection(self):
+        """Test LLM forbindelse - returnerer antal modeller og tilpasser kontekst længden"""
+        models = await self.llm_client.models()
+        
+        # Tilpas kontekst budget til den indlæste model
+        context_length = await self.llm_client.context_length()
+        if context_length:
+            self.update_settings(context_length=context_length)
+        return len(models.get('data', []))
+    
+    async def set_english(self, enabled, session_id=None):
+        """Skift mellem dansk og engelsk system prompt (og opdater den i session_id's historik)"""
+        self.system_prompt["content"] = self.english_prompt if enabled else self.danish_prompt
+        
+        # Opdater system prompt i samtale historik
+        if session_id and self.owns_session(session_id):
+            history = self._ensure_session_loaded(session_id)
+            if history and history[0]["role"] == "system":
+                history[0] = self.system_prompt.copy()
+                self._persist_session(session_id, rewrite=True)
+    
+    # Chat
+    async def stream(self, session_id, prompt):
+        """Send besked og giv svaret token for token (async generator)
+
+        Brugerbeskeden fjernes igen hvis turen fejler, og svaret kommer først
+        i historikken når det er modtaget helt. Annulleres turen (cancel eller
+        en ny besked i samme samtale) beholdes det delvise svar som det blev
+        vist - uden tokens fjernes brugerbeskeden som ved en fejl.
+        """
+        if not self.owns_session(session_id):
+            raise PermissionError("Du har ikke adgang til denne samtale!")
+        
+        # En ny besked afbryder et svar der stadig genereres i samme samtale
+        previous = self._active_sessions.get(session_id)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            await asyncio.wait([previous])
+        
+        session_data = self.sessions[session_id]
+        history = self._ensure_session_loaded(session_id)
+        user_message = {"role": "user", "content": prompt}
+        history.append(user_message)
+        self._note_history_change(session_data, 1)
+        task = asyncio.current_task()
+        self._active_sessions[session_id] = task
+        
+        try:
+            tokens = []
+            cache_key = cached = None
+            try:
+                # System prompt med minder og resumé + så meget nyere historik som budgettet tillader
+                messages, start = await self._assemble_messages(session_data, history, prompt)
+                data = self._chat_payload(session_id, messages)
+                
+                cache_key = self._response_cache_key(data)
+                if cache_key:
+                    cached = self._get_response_cache().get(cache_key)
+                
+                if cached is not None:
+                    self._emit("response_cached", session_id=session_id)
+                    tokens.append(cached)
+                    yield cached
+                elif self.stream_enabled:
+                    # aclosing lukker forbindelsen med det samme hvis forbrugeren stopper
+                    async with contextlib.aclosing(self.llm_client.stream_chat(data)) as token_stream:
+                        async for token in token_stream:
+                            tokens.append(token)
+                            yield token
+                else:
+                    result = await self.llm_client.chat(data)
+                    reply = result['choices'][0]['message']['content']
+                    tokens.append(reply)
+                    yield reply
+            except (asyncio.CancelledError, GeneratorExit):
+                if tokens:
+                    history.append({"role": "assistant", "content": "".join(tokens)})
+                    self._note_history_change(session_data)
+                    self.schedule_session_save(session_id)
+                else:
+                    self._rollback_user_message(session_id, history, user_message)
+                raise
+            except BaseException:
+                # Fjern sidste brugerbesked ved fejl
+                self._rollback_user_message(session_id, history, user_message)
+                raise
+            
+            reply = "".join(tokens)
+            history.append({"role": "assistant", "content": reply})
+            self._note_history_change(session_data)
+            if cache_key and cached is None:
+                self._response_cache.put(cache_key, reply)
+            
+            # Gem den nye tur i baggrunden (skriver kun de nye beskeder)
+            self.schedule_session_save(session_id)
+        finally:
+            if self._active_sessions.get(session_id) is task:
+                del self._active_sessions[session_id]
+        
+        # Opsummer beskeder der faldt ud af konteksten denne gang
+        self._schedule_summary(session_id, start)
+        self._count_turn(session_id)
+    
+    def _rollback_user_message(self, session_id, history, user_message):
+        """Fjern turens brugerbesked igen (fejl, eller afbrudt før første token)"""
+        with self._persist_lock:
+            if not history or history[-1] is not user_message:
+                return
+            history.pop()
+            session_data = self.sessions.get(session_id)
+            if session_data is None:
+                return
+            session_data["user_count"] = session_data.get("user_count", 0) - 1
+            if session_data.get("saved_count", 0) <= len(history):
+                return
+            # Skrive-tråden nåede at gemme beskeden. Næste besked ville ellers få dens
+            # plads i tællingen og aldrig blive skrevet, så hele historikken skrives om
+            session_data["rewrite_pending"] = True
+        self.schedule_session_save(session_id)
+    
+    @staticmethod
+    def _note_history_change(session_data, user_messages=0):
+        """Antal brugerbeskeder og tidspunkt følger historikken i RAM (lageret gemmer dem bare)"""
+        session_data["user_count"] = session_data.get("user_count", 0) + user_messages
+        session_data["updated"] = datetime.now()
+    
+    def export_metrics(self, directory=None):
+        """Skriv metrics som Prometheus tekst og JSONL - returnerer stierne"""
+        directory = directory or self.data_dir
+        prom_path = os.path.join(directory, "metrics.prom")
+        jsonl_path = os.path.join(directory, "metrics.jsonl")
+        self.metrics.write_prometheus(prom_path)
+        self.metrics.write_jsonl(jsonl_path)
+        return prom_path, jsonl_path
+    
+    def cancel(self, session_id):
+        """Afbryd svaret der genereres i en samtale - returnerer om der var et"""
+        task = self._active_sessions.get(session_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+    
+    def cancel_memory(self):
+        """Afbryd en igangværende hukommelse-analyse (beskederne analyseres igen senere)"""
+        if self._memory_task is None or self._memory_task.done():
+            return False
+        self._memory_task.cancel()
+        return True
+    
+    async def send(self, session_id, prompt):
+        """Send besked og returner hele svaret"""
+        return "".join([token async for token in self.stream(session_id, prompt)])
+    
+    def _chat_payload(self, session_id, messages):
+        data = {
+            "messages": messages,
+            "temperature": self.temperature,
+            "max_tokens": self.max_response_tokens
+        }
+        if self.stable_prefix_enabled and self.cache_prompt_hints:
+            data["cache_prompt"] = True
+            if self.llm_slot_count and session_id:
+                data["id_slot"] = zlib.crc32(session_id.encode("utf-8")) % self.llm_slot_count
+        return data
+    
+    def _response_cache_key(self, data):
+        """Cache nøgle for en forespørgsel - None når cachen ikke skal bruges"""
+        if not self.response_cache_enabled:
+            return None
+        if data.get("temperature", 0) > 0 and not self.response_cache_force:
+            return None  # Tilfældige svar skal ikke gentages
+        return ResponseCache.key_for(data)
+    
+    def _get_response_cache(self):
+        if self._response_cache is None:
+            self._response_cache = ResponseCache(self.response_cache_file,
+                                                 self.response_cache_max_mb * 1024 * 1024,
+                                                 self.response_cache_max_age_days * 24 * 3600)
+        return self._response_cache
+    
+    def clear_response_cache(self):
+        """Slet alle cachede svar"""
+        self._get_response_cache().clear()
+    
+    def _build_system_content(self, session_data, memory_block):
+        """System prompt + minder + resumé - returnerer (indhold, index resuméet dækker op til)"""
+        system_content = self.system_prompt["content"] + memory_block
+        summary_upto = 0
+        if self.summary_enabled and session_data.get("summary"):
+            system_content += f"\n\nResumé af den tidligere samtale:\n{session_data['summary']}\n"
+            summary_upto = session_data.get("summary_upto", 0)
+        return system_content, summary_upto
+    
+    async def _assemble_messages(self, session_data, history, prompt):
+        """Byg beskeder til LLM - returnerer (beskeder, index på ældste medtagne besked)"""
+        if not self.stable_prefix_enabled:
+            memory_block = await self.get_memory_for_ai(prompt)
+            system_content, summary_upto = self._build_system_content(session_data, memory_block)
+            return self.context_builder.build(history, system_content, summary_upto)
+        
+        # Stabilt prefix: system beskeden og vinduets start ligger fast indtil en rebase,
+        # så hver ny forespørgsel kun forlænger den forrige byte for byte
+        if self._memory_snapshot is None:
+            self.refresh_memory_snapshot()
+        
+        prefix = session_data.get("prefix")
+        if (prefix and prefix["base"] == self.system_prompt["content"] and
+                prefix["memory_version"] == self._memory_snapshot_version):
+            if self.context_builder.fits(history, prefix["system"], prefix["start"]):
+                return self.context_builder.build(history, prefix["system"], prefix["start"])
+            # Vinduet er fuldt - ryk starten et godt stykke frem så næste rebase er langt væk
+            fill_ratio = self.stable_prefix_fill_ratio
+        else:
+            fill_ratio = 1.0
+        
+        system_content, summary_upto = self._build_system_content(session_data, self._memory_snapshot)
+        messages, start = self.context_builder.build(history, system_content, summary_upto, fill_ratio)
+        session_data["prefix"] = {
+            "base": self.system_prompt["content"],
+            "memory_version": self._memory_snapshot_version,
+            "system": system_content,
+            "start": start
+        }
+        return messages, start
+    
+    def _schedule_summary(self, session_id, evicted_upto):
+        """Start opsummering hvis der er beskeder før evicted_upto der ikke er opsummeret"""
+        session_data = self.sessions.get(session_id)
+        if not self.summary_enabled or not session_data or "history" not in session_data:
+            return
+        if evicted_upto <= session_data.get("summary_upto", 0):
+            return
+        if session_id in self._summarizing:
+            return  # Næste tur tager de nye beskeder med
+        
+        self._summarizing.add(session_id)
+        self._spawn(self._update_summary(session_id, evicted_upto))
+    
+    async def _update_summary(self, session_id, evicted_upto):
+        """Fold nye udfaldne beskeder ind i sessionens resumé"""
+        try:
+            session_data = self.sessions[session_id]
+            history = session_data["history"]
+            summary_upto = session_data.get("summary_upto", 0)
+            
+            # Kun beskeder der ikke allerede er opsummeret - og højst et halvt kontekst vindue ad gangen
+            limit = max(self.context_builder.context_length // 2, 512)
+            lines = []
+            used = 0
+            end = summary_upto
+            for message in history[summary_upto:evicted_upto]:
+                end += 1
+                if message["role"] not in ("user", "assistant"):
+                    continue
+                used += self.context_builder.message_tokens(message)
+                lines.append(f"{message['role']}: {message['content']}")
+                if used >= limit:
+                    break
+            
+            if not lines:
+                session_data["summary_upto"] = end
+                self.session_store.update_summary(session_id, session_data.get("summary", ""), end)
+                return
+            
+            previous = session_data.get("summary") or "(intet endnu)"
+            summary_prompt = f"""Opdater resuméet af en samtale mellem en bruger og en assistent.
+
+TIDLIGERE RESUMÉ:
+{previous}
+
+NYE BESKEDER:
+{chr(10).join(lines)}
+
+Skriv et samlet, kort resumé (højst 150 ord) med de vigtigste emner, fakta og aftaler. Svar kun med resuméet."""
+            
+            data = {
+                "messages": [{"role": "user", "content": summary_prompt}],
+                "temperature": 0.2,
+                "max_tokens": self.summary_max_tokens
+            }
+            result = await self.llm_client.chat(data, kind="memory")
+            summary = result['choices'][0]['message']['content'].strip()
+            
+            # Spring over hvis historikken er blevet ryddet/udskiftet imens
+            if summary and session_data.get("history") is history:
+                session_data["summary"] = summary
+                session_data["summary_upto"] = end
+                self.session_store.update_summary(session_id, summary, end)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Fejl ved opsummering af samtale: {e}")
+        finally:
+            self._summarizing.discard(session_id)
+    
+    # AI Hukommelse
+    def load_user_memory(self):
+        """Load bruger hukommelse fra fil"""
+        try:
+            if os.path.exists(self.memory_file):
+                with open(self.memory_file, 'r', encoding='utf-8') as f:
+                    self.user_memory.load(json.load(f))
+            else:
+                self.user_memory.clear()
+        except Exception as e:
+            print(f"Fejl ved loading af hukommelse: {e}")
+            self.user_memory.clear()
+        
+        self.memory_dedup.rebuild(self.user_memory)
+        
+        try:
+            self.memory_index.load()
+            self.memory_index.sync(self.user_memory.keys())
+        except Exception as e:
+            print(f"Fejl ved loading af hukommelse indeks: {e}")
+            self.memory_index.clear()
+    
+    def save_user_memory(self):
+        """Gem bruger hukommelse til fil (i baggrunden)"""
+        self.writer.mark_dirty("memory", self._write_user_memory)
+    
+    def _write_user_memory(self):
+        """Skriv hukommelsen kompakt og atomisk (kører i skrive-tråden)"""
+        # Minderne ændres ikke efter de er tilføjet, så en kopi af dict'en er et konsistent øjebliksbillede
+        # (MemoryStore.copy giver en almindelig dict)
+        data = json.dumps(self.user_memory.copy(), ensure_ascii=False, separators=(",", ":"))
+        write_atomic(self.memory_file, data.encode("utf-8"))
+    
+    def save_memory_index(self):
+        """Gem embedding indekset (i baggrunden)"""
+        self.writer.mark_dirty("memory_index", self.memory_index.save)
+    
+    def _count_turn(self, session_id):
+        """Tæl et svar og bed om udtræk af minder når tærsklen nås"""
+        if not self.auto_memory_enabled:
+            return
+        
+        self.message_count += 1
+        self._emit("memory_progress", count=self.message_count, threshold=self.auto_memory_threshold)
+        
+        if self.message_count >= self.auto_memory_threshold:
+            self.message_count = 0
+            self.request_memory_extraction(session_id)
+    
+    def request_memory_extraction(self, session_id, refresh_snapshot=False):
+        """Læg en session i kø til hukommelse-workeren"""
+        self._emit("memory_status", text="🔄 Analyserer samtale...")
+        self._memory_queue.put_nowait((session_id, refresh_snapshot))
+    
+    async def _memory_worker(self):
+        """Eneste worker der udtrækker minder - ventende forespørgsler samles til én kørsel pr. session"""
+        while True:
+            pending = OrderedDict([await self._memory_queue.get()])
+            while not self._memory_queue.empty():
+                session_id, refresh_snapshot = self._memory_queue.get_nowait()
+                pending[session_id] = pending.get(session_id, False) or refresh_snapshot
+            
+            for session_id, refresh_snapshot in pending.items():
+                # Egen task så cancel_memory kun stopper dette udtræk og ikke workeren
+                self._memory_task = asyncio.create_task(self.extract_memories(session_id, refresh_snapshot))
+                try:
+                    await asyncio.wait([self._memory_task])
+                except asyncio.CancelledError:
+                    self._memory_task.cancel()
+                    raise
+                if self._memory_task.cancelled():
+                    self._emit("memory_status", text="⏹️ Hukommelse stoppet", reset_after=3000)
+                self._memory_task = None
+    
+    async def extract_memories(self, session_id, refresh_snapshot=False):
+        """Analyser alle endnu ikke analyserede beskeder i en session - returnerer nye minde id'er"""
+        new_ids = []
+        try:
+            session_data = self.sessions.get(session_id)
+            if not session_data:
+                return new_ids
+            history = in_memory = session_data.get("history")
+            if history is None:
+                history = self.session_store.load_history(session_id)
+            
+            # Analyser fra vandmærket og frem, højst et halvt kontekst vindue pr. kald
+            limit = max(self.context_builder.context_length // 2, 512)
+            watermark = min(session_data.get("memory_watermark", 0), len(history))
+            
+            while watermark < len(history):
+                recent_messages = []
+                used = 0
+                end = watermark
+                for msg in history[watermark:]:
+                    end += 1
+                    if msg["role"] in ["user", "assistant"]:
+                        recent_messages.append(f"{msg['role']}: {msg['content']}")
+                        used += self.context_builder.message_tokens(msg)
+                        if used >= limit:
+                            break
+                
+                if len(recent_messages) < 2 and end >= len(history):
+                    break  # Vent på flere beskeder
+                
+                if recent_messages:
+                    new_ids.extend(await self._extract_from_text("\n".join(recent_messages)))
+                
+                if self.sessions.get(session_id) is not session_data or session_data.get("history") is not in_memory:
+                    # Samtalen blev slettet, ryddet eller erstattet under kaldet - vandmærket
+                    # ville pege forbi beskeder der aldrig er analyseret
+                    break
+                
+                # Beskederne er analyseret - flyt vandmærket så de aldrig analyseres igen
+                watermark = end
+                session_data["memory_watermark"] = watermark
+                self.session_store.update_memory_watermark(session_id, watermark)
+            
+            if new_ids:
+                await self._index_memories(new_ids)
+                if refresh_snapshot:
+                    self.refresh_memory_snapshot()
+                self._emit("memories_added", count=len(new_ids))
+            else:
+                # Vis at systemet kører, selvom ingen nye minder
+                self._emit("memory_status", text="🤖 Ingen nye minder denne gang", reset_after=3000)
+        
+        except asyncio.CancelledError:
+            raise
+        except json.JSONDecodeError as e:
+            print(f"Auto-hukommelse JSON fejl: {e}")
+            self._emit("memory_status", text="❌ Hukommelse JSON fejl")
+        except LLMTimeout:
+            print("Auto-hukommelse timeout")
+            self._emit("memory_status", text="⏱️ Hukommelse timeout (juster i indstillinger)", reset_after=5000)
+        except LLMUnavailable:
+            print("Auto-hukommelse forbindelse fejl")
+            self._emit("memory_status", text="❌ LLM ikke tilgængelig")
+        except Exception as e:
+            print(f"Auto-hukommelse generel fejl: {e}")
+            self._emit("memory_status", text="❌ Hukommelse fejl")
+        finally:
+            # Også minder fra tidligere bidder gemmes hvis en senere bid fejler
+            if new_ids:
+                self.save_user_memory()
+        return new_ids
+    
+    async def _extract_from_text(self, conversation_text):
+        """Bed LLM om at finde facts i samtalen og tilføj nye minder (returnerer deres id'er)"""
+        # Fokuseret prompt for at fange interessante information
+        analysis_prompt = f"""Analyser denne samtale og find interessant information om brugeren som jeg skal huske.
+
+SAMTALE:
+{conversation_text}
+
+Find ALLE interessante facts om personen - navn, hobbier, præferencer, job, familie, mål, problemer, etc.
+
+Svar med JSON:
+{{
+    "memories": [
+        {{"info": "konkret fact om personen", "importance": 1-10}}
+    ]
+}}
+
+Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
+        
+        data = {
+            "messages": [{"role": "user", "content": analysis_prompt}],
+            "temperature": 0.1,
+            "max_tokens": 300
+        }
+        
+        result = await self.llm_client.chat(data, kind="memory")
+        
+        ai_response = result['choices'][0]['message']['content'].strip()
+        
+        # Parse JSON respons
+        ai_response = ai_response.replace('```json', '').replace('```', '').strip()
+        start = ai_response.find('{')
+        end = ai_response.rfind('}') + 1
+        if start < 0 or end <= start:
+            return []
+        
+        memory_updates = json.loads(ai_response[start:end])
+        
+        # Tilføj nye minder
+        new_ids = []
+        for memory_data in memory_updates.get("memories", []):
+            importance = memory_data.get("importance", 0)
+            if importance >= 5:  # Kun vigtige minder
+                info = memory_data.get("info", "")
+                
+                if info and not self.memory_exists(info):
+                    memory_id = self.user_memory.add({
+                        "info": info,
+                        "created": datetime.now().strftime("%Y-%m-%d %H:%M"),
+                        "importance": importance
+                    })
+                    self.memory_dedup.add(memory_id, info)
+                    new_ids.append(memory_id)
+        return new_ids
+    
+    def memory_exists(self, new_info):
+        """Tjek om lignende hukommelse allerede eksisterer"""
+        return self.memory_dedup.find_duplicate(new_info) is not None
+    
+    async def clear_memory(self):
+        """Slet alle minder"""
+        self.user_memory.clear()
+        self.save_user_memory()
+        self.memory_dedup.clear()
+        self.memory_index.clear()
+        self.refresh_memory_snapshot()
+        self.save_memory_index()
+    
+    async def get_memory_for_ai(self, prompt=None):
+        """Få minder til AI system prompt (de mest relevante for prompt hvis muligt)"""
+        if not self.user_memory:
+            return ""
+        
+        if not self._relevance_search_possible(prompt):
+            # Samme top-k som sidst så længe minderne ikke er ændret
+            return self.user_memory.prompt_block(self.memory_top_k)
+        
+        lines = []
+        for memory_id in await self._select_memories(prompt):
+            info = self.user_memory[memory_id].get("info", "")
+            if info:
+                lines.append(f"- {info}\n")
+        
+        return MemoryStore.HEADER + "".join(lines)
+    
+    def refresh_memory_snapshot(self):
+        """Byg minde-blokken til det stabile prefix (deterministisk rækkefølge)"""
+        block = self.user_memory.prompt_block(self.memory_top_k)
+        if block != self._memory_snapshot:
+            self._memory_snapshot = block
+            self._memory_snapshot_version += 1
+    
+    def _relevance_search_possible(self, prompt):
+        return bool(prompt) and self.memory_index.available and len(self.memory_index) > 0
+    
+    async def _select_memories(self, prompt=None):
+        """Vælg top-k minder efter relevans for prompt blandet med vigtighed"""
+        k = self.memory_top_k
+        selected = []
+        
+        if self._relevance_search_possible(prompt):
+            try:
+                query = (await self.llm_client.embed([prompt], self.embedding_model))[0]
+                selected = [memory_id for memory_id in self.memory_index.search(query, k, self.memory_similarity_weight)
+                            if memory_id in self.user_memory]
+            except Exception as e:
+                print(f"Fejl ved relevans-søgning i hukommelse: {e}")
+        
+        if len(selected) < k:
+            # Fyld op med de vigtigste minder (fx dem uden embedding endnu) - top 2k er altid nok
+            for memory_id, _ in self.user_memory.top(2 * k):
+                if len(selected) >= k:
+                    break
+                if memory_id not in selected:
+                    selected.append(memory_id)
+        
+        return selected
+    
+    def _memory_relevance_enabled(self):
+        """Relevans-søgning bruges kun uden stabilt prefix (der er minde-blokken fast)"""
+        return not self.stable_prefix_enabled and self.memory_index.available
+    
+    async def _index_memories(self, memory_ids):
+        """Beregn og gem embeddings for nye minder"""
+        # Ingen /embeddings kald (og fejl på backends uden embedding model) når de ikke bruges
+        if not memory_ids or not self._memory_relevance_enabled():
+            return
+        
+        try:
+            memory_ids = [memory_id for memory_id in memory_ids if memory_id in self.user_memory]
+            texts = [self.user_memory[memory_id].get("info", "") for memory_id in memory_ids]
+            importances = [self.user_memory[memory_id].get("importance", 0) for memory_id in memory_ids]
+            vectors = await self.llm_client.embed(texts, self.embedding_model)
+            self.memory_index.add(memory_ids, vectors, importances)
+            self.save_memory_index()
+        except Exception as e:
+            print(f"Fejl ved indeksering af minder: {e}")
+    
+    async def _backfill_memory_index(self):
+        """Indekser minder der endnu ikke har en embedding"""
+        missing = [memory_id for memory_id in list(self.user_memory) if memory_id not in self.memory_index]
+        await self._index_memories(missing)
+    
+    # Session Management
+    def load_sessions(self):
+        """Load kun denne brugers sessions"""
+        try:
+            # Første gang: flyt sessions fra det gamle pickle format over
+            if self.session_store.is_empty() and os.path.exists(self.sessions_file):
+                self.session_store.import_legacy_pickle(self.sessions_file, self.user_id)
+            
+            # Kun metadata - historik loades først når en session åbnes
+            self.sessions = self.session_store.list_sessions(self.user_id)
+        except Exception as e:
+            print(f"Fejl ved loading af sessions: {e}")
+            self.sessions = {}
+        self.loaded_sessions.clear()
+        self._session_order = list(self.sessions)  # Lageret leverer dem allerede ældste først
+        self.sessions_version += 1
+    
+    def list_sessions(self, name_filter=None, offset=0, limit=None):
+        """Denne brugers sessions som (id, metadata), nyeste først - evt. filtreret på navn og kun én side"""
+        session_ids = self.find_sessions(name_filter) if name_filter else self._session_order
+        end = len(session_ids) - offset
+        if end <= 0:
+            return []
+        start = 0 if limit is None else max(0, end - limit)
+        return [(session_id, self.sessions[session_id]) for session_id in reversed(session_ids[start:end])]
+    
+    def find_sessions(self, name_filter):
+        """Id'er (ældste først) på sessions hvis navn indeholder name_filter - genbruges til listen ændres"""
+        needle = name_filter.casefold()
+        cached = self._filter_cache
+        if cached and cached[0] == self.sessions_version and cached[1] == needle:
+            return cached[2]
+        session_ids = [session_id for session_id in self._session_order
+                       if needle in self.sessions[session_id]["name"].casefold()]
+        self._filter_cache = (self.sessions_version, needle, session_ids)
+        return session_ids
+    
+    def session_count(self, name_filter=None):
+        """Antal sessions (evt. kun dem der matcher name_filter)"""
+        return len(self.find_sessions(name_filter) if name_filter else self._session_order)
+    
+    def owns_session(self, session_id):
+        """Tjek at sessionen findes og tilhører brugeren"""
+        return session_id in self.sessions and self.sessions[session_id].get("user") == self.user_id
+    
+    async def create_session(self, name=None):
+        """Opret ny session - returnerer session id"""
+        name = name or f"Samtale {len(self.sessions) + 1}"
+        session_id = f"{self.user_id}_{int(time.time())}"  # Bruger-specifik ID
+        suffix = 1
+        while session_id in self.sessions:
+            # Flere sessions i samme sekund (fx via serveren) - overskriv aldrig en eksisterende
+            suffix += 1
+            session_id = f"{self.user_id}_{int(time.time())}_{suffix}"
+        created = datetime.now()
+        self.sessions[session_id] = {
+            "name": name,
+            "history": [self.system_prompt.copy()],
+            "created": created,
+            "updated": created,
+            "user_count": 0,
+            "user": self.user_id,  # Sikr bruger tilhørighed
+            "summary": "",
+            "summary_upto": 0,
+            "memory_watermark": 0
+        }
+        
+        try:
+            session = self.sessions[session_id]
+            self.session_store.create_session(session_id, name, session["created"],
+                                              self.user_id, session["history"])
+            session["saved_count"] = len(session["history"])
+        except Exception as e:
+            print(f"Fejl ved oprettelse af session: {e}")
+        self._session_order.append(session_id)
+        self.sessions_version += 1
+        self._touch_loaded_session(session_id)
+        self.message_count = 0  # Reset message counter
+        self.refresh_memory_snapshot()
+        return session_id
+    
+    async def load_session(self, session_id):
+        """Load en sessions historik (kun hvis den tilhører brugeren)"""
+        if not self.owns_session(session_id):
+            raise PermissionError("Du har ikke adgang til denne samtale!")
+        
+        self.save_sessions()  # Gem evt. ugemte beskeder i de andre sessions
+        history = self._ensure_session_loaded(session_id)
+        self.message_count = 0  # Reset counter for loaded session
+        self.refresh_memory_snapshot()
+        return history
+    
+    async def delete_session(self, session_id):
+        """Slet session (kun hvis den tilhører brugeren)"""
+        if not self.owns_session(session_id):
+            raise PermissionError("Du kan ikke slette denne samtale!")
+        
+        del self.sessions[session_id]
+        self._session_order.remove(session_id)
+        self.sessions_version += 1
+        self.loaded_sessions.pop(session_id, None)
+        try:
+            self.session_store.delete_session(session_id)
+        except Exception as e:
+            print(f"Fejl ved sletning af session: {e}")
+    
+    async def clear_session(self, session_id):
+        """Ryd en sessions historik (system prompten bevares)"""
+        if not self.owns_session(session_id):
+            raise PermissionError("Du har ikke adgang til denne samtale!")
+        
+        session_data = self.sessions[session_id]
+        session_data["history"] = [self.system_prompt.copy()]
+        session_data["user_count"] = 0
+        session_data["updated"] = datetime.now()
+        self._touch_loaded_session(session_id)
+        self.message_count = 0  # Reset message counter
+        self.refresh_memory_snapshot()
+        self._persist_session(session_id, rewrite=True)
+    
+    async def save_session(self, session_id):
+        """Gem ugemte beskeder i en session"""
+        if not self.owns_session(session_id):
+            raise PermissionError("Ingen valid samtale at gemme")
+        self._persist_session(session_id)
+        self.writer.flush()  # Også hukommelse o.l. der venter på at blive skrevet
+    
+    def history(self, session_id):
+        """Historik for en indlæst session"""
+        return self._ensure_session_loaded(session_id)
+    
+    def _ensure_session_loaded(self, session_id):
+        """Load historik for en session hvis den ikke allerede er i RAM"""
+        session_data = self.sessions[session_id]
+        if "history" not in session_data:
+            with self.metrics.timer("session_load_seconds"):
+                session_data["history"] = self.session_store.load_history(session_id)
+            session_data["saved_count"] = len(session_data["history"])
+        self._touch_loaded_session(session_id)
+        return session_data["history"]
+    
+    def _touch_loaded_session(self, session_id):
+        """Marker session som senest brugt og fjern gamle fra RAM over loftet"""
+        self.loaded_sessions[session_id] = True
+        self.loaded_sessions.move_to_end(session_id)
+        
+        total_messages = sum(len(self.sessions[sid].get("history", ()))
+                             for sid in self.loaded_sessions if sid in self.sessions)
+        for old_id in list(self.loaded_sessions):
+            if total_messages <= self.session_cache_max_messages:
+                break
+            if old_id == session_id or old_id in self._active_sessions:
+                continue
+            total_messages -= self._unload_session(old_id)
+    
+    def _unload_session(self, session_id):
+        """Gem og fjern en sessions historik fra RAM (returnerer antal frigivne beskeder)"""
+        self.loaded_sessions.pop(session_id, None)
+        session_data = self.sessions.get(session_id)
+        if not session_data or "history" not in session_data:
+            return 0
+        
+        self._persist_session(session_id)
+        if session_data.get("saved_count") != len(session_data["history"]) or session_data.get("rewrite_pending"):
+            # Kunne ikke gemmes - behold i RAM så intet går tabt
+            self.loaded_sessions[session_id] = True
+            return 0
+        
+        history = session_data.pop("history")
+        session_data.pop("saved_count", None)
+        session_data.pop("prefix", None)
+        return len(history)
+    
+    def schedule_session_save(self, session_id):
+        """Gem en sessions nye beskeder i baggrunden"""
+        self.writer.mark_dirty(("session", session_id), lambda: self._persist_session(session_id))
+    
+    def save_sessions(self):
+        """Gem ugemte beskeder i denne brugers indlæste sessions"""
+        for session_id in list(self.loaded_sessions):
+            session_data = self.sessions.get(session_id)
+            if session_data and session_data.get("user") == self.user_id:
+                self._persist_session(session_id)
+    
+    def _persist_session(self, session_id, rewrite=False):
+        """Skriv kun de beskeder der ikke allerede er gemt (rewrite=True gemmer hele historikken)"""
+        with self._persist_lock:
+            self._persist_session_locked(session_id, rewrite)
+    
+    def _persist_session_locked(self, session_id, rewrite):
+        session_data = self.sessions.get(session_id)
+        if not session_data or "history" not in session_data:
+            return
+        
+        # Kopi, så beskeder der tilføjes imens (fra en anden tråd) gemmes næste gang
+        history = list(session_data["history"])
+        saved_count = session_data.get("saved_count", 0)
+        try:
+            if rewrite or saved_count > len(history) or session_data.get("rewrite_pending"):
+                # Historikken er blevet ændret bagud (ryddet, fejl rullet tilbage osv.)
+                self.session_store.replace_history(session_id, history, session_data.get("updated"))
+                session_data.pop("prefix", None)  # Det stabile prefix passer ikke længere
+                if session_data.get("memory_watermark", 0) > len(history):
+                    session_data["memory_watermark"] = len(history)
+                    self.session_store.update_memory_watermark(session_id, len(history))
+                if session_data.get("summary_upto", 0) > len(history):
+                    # Resuméet dækker beskeder der ikke findes længere
+                    session_data["summary"] = ""
+                    session_data["summary_upto"] = 0
+                    self.session_store.update_summary(session_id, "", 0)
+                session_data.pop("rewrite_pending", None)
+            elif saved_count < len(history):
+                new_messages = history[saved_count:]
+                self.session_store.append_messages(session_id, saved_count, new_messages, session_data.get("updated"))
+            session_data["saved_count"] = len(history)
+        except Exception as e:
+            print(f"Fejl ved gemning af session: {e}")
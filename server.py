@@ -0,0 +1,447 @@
+"""Flerbruger HTTP/WebSocket server til LLM chatten (hele teamet på én maskine).
+
+Hver bruger logger ind med et token og får sin egen ChatEngine med de samme
+filer som desktop appen (user_data_<hash>/ under --data-dir). Alle motorer
+deler én pool af LLM backends, og antallet af samtidige svar er begrænset.
+
+    python server.py --add-user alice        # Opret bruger og print token
+    python server.py --url http://gpu1:1234/v1,http://gpu2:1234/v1
+
+HTTP (Authorization: Bearer <token>):
+    GET    /api/sessions                  Samtaler (?filter=&offset=&limit=)
+    POST   /api/sessions                  Ny samtale {"name": ...}
+    GET    /api/sessions/{id}             Historik
+    DELETE /api/sessions/{id}             Slet samtale
+    POST   /api/sessions/{id}/clear       Ryd samtale
+    POST   /api/sessions/{id}/chat        Send besked {"message": ...} og få hele svaret
+    POST   /api/sessions/{id}/cancel      Stop svaret der genereres
+    GET    /api/memory                    Minder
+    POST   /api/memory/refresh            Analyser en samtale nu {"session_id": ...}
+    DELETE /api/memory                    Slet alle minder
+
+WebSocket /ws (?token=<token>): send {"type": "chat", "session_id", "message"}
+eller {"type": "cancel", "session_id"} og få token/done/cancelled/error beskeder
+samt hukommelse hændelser tilbage.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import secrets
+import socket
+
+from aiohttp import web, WSMsgType
+
+from chat_engine import (BackendPool, ChatEngine, DEFAULT_LLM_URL, LLMTimeout, LLMUnavailable, Metrics,
+                         get_user_id, user_data_dir, write_atomic)
+
+class TokenStore:
+    """Login tokens -> bruger - kun hashes af tokens gemmes på disk"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.users = {}  # sha256(token) -> {"name": ..., "user_id": ...}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.users = json.load(f)
+    
+    @staticmethod
+    def _hash(token):
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+    
+    def lookup(self, token):
+        """Brugeren for et token (None hvis ukendt)"""
+        return self.users.get(self._hash(token)) if token else None
+    
+    def add_user(self, name):
+        """Opret et nyt token til en bruger - returnerer tokenet (vises kun denne ene gang)"""
+        token = secrets.token_urlsafe(32)
+        # Samme ID som desktop appen giver name@denne maskine, så data kan deles
+        self.users[self._hash(token)] = {"name": name, "user_id": get_user_id(name, socket.gethostname())}
+        write_atomic(self.path, json.dumps(self.users, indent=2, ensure_ascii=False).encode("utf-8"))
+        return token
+
+class UserState:
+    """En logget ind brugers motor, lås og åbne WebSockets"""
+    
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.lock = asyncio.Lock()  # Én ændring af samtaler og minder ad gangen (holdes ikke mens der svares)
+        self.sockets = set()
+        self.replies = {}  # session_id -> task for svaret (også mens det venter på en plads)
+    
+    def cancel_reply(self, session_id):
+        """Afbryd svaret i en samtale - returnerer dets task (None hvis der ikke var et)"""
+        task = self.replies.get(session_id)
+        if task is None or task.done():
+            return None
+        task.cancel()
+        return task
+    
+    def broadcast(self, message):
+        """Send en besked til alle brugerens WebSockets (fejl ignoreres - forbindelsen lukker selv)"""
+        for ws in list(self.sockets):
+            if not ws.closed:
+                task = asyncio.ensure_future(ws.send_json(message))
+                task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+class ChatServer:
+    """aiohttp app med én ChatEngine pr. bruger oven på en fælles backend pool"""
+    
+    def __init__(self, llm_url, data_dir=".", tokens=None, max_concurrent=4):
+        self.data_dir = data_dir
+        self.tokens = tokens
+        self.metrics = Metrics()
+        self.llm_client = BackendPool(llm_url, metrics=self.metrics)
+        self.turns = asyncio.Semaphore(max_concurrent)  # Samtidige svar på tværs af brugere
+        self.users = {}  # user_id -> UserState
+        self.context_length = None  # Fra backend ved opstart (gives til nye motorer)
+        self._users_lock = asyncio.Lock()
+        self._health_task = None
+    
+    def make_app(self):
+        app = web.Application(middlewares=[self.error_middleware])
+        app.add_routes([
+            web.get("/health", self.handle_health),
+            web.get("/metrics", self.handle_metrics),
+            web.get("/api/sessions", self.handle_list_sessions),
+            web.post("/api/sessions", self.handle_create_session),
+            web.get("/api/sessions/{session_id}", self.handle_get_session),
+            web.delete("/api/sessions/{session_id}", self.handle_delete_session),
+            web.post("/api/sessions/{session_id}/clear", self.handle_clear_session),
+            web.post("/api/sessions/{session_id}/chat", self.handle_chat),
+            web.post("/api/sessions/{session_id}/cancel", self.handle_cancel),
+            web.get("/api/memory", self.handle_list_memory),
+            web.post("/api/memory/refresh", self.handle_refresh_memory),
+            web.delete("/api/memory", self.handle_clear_memory),
+            web.get("/ws", self.handle_websocket),
+        ])
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+    
+    # Livscyklus
+    async def on_startup(self, app):
+        """Tjek backends og start periodiske health checks"""
+        try:
+            await self.llm_client.models()
+            self.context_length = await self.llm_client.context_length()
+        except LLMUnavailable:
+            print("⚠️ Ingen LLM backends svarer endnu")
+        if len(self.llm_client.clients) > 1:
+            self._health_task = asyncio.create_task(self.llm_client.run_health_checks())
+    
+    async def on_cleanup(self, app):
+        """Gem alle brugeres data og luk forbindelser"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+        for user in list(self.users.values()):
+            await user.engine.close()
+        await self.llm_client.close()
+    
+    # Brugere
+    async def get_user(self, request):
+        """Find brugeren for requestens token og start dens motor første gang"""
+        token = request.query.get("token")
+        auth = request.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            token = auth[len("Bearer "):].strip()
+        account = self.tokens.lookup(token)
+        if account is None:
+            raise web.HTTPUnauthorized(text=json.dumps({"error": "Ugyldigt token"}), content_type="application/json")
+        
+        user_id = account["user_id"]
+        async with self._users_lock:
+            if user_id not in self.users:
+                engine = ChatEngine(user_id, os.path.join(self.data_dir, user_data_dir(user_id)),
+                                    llm_client=self.llm_client)
+                if self.context_length:
+                    engine.update_settings(context_length=self.context_length)
+                user = UserState(account["name"], engine)
+                engine.add_listener(lambda event, data: user.broadcast({"type": "event", "event": event, "data": data}))
+                await engine.start()
+                self.users[user_id] = user
+        return self.users[user_id]
+    
+    @staticmethod
+    def _session_id(request, user):
+        session_id = request.match_info["session_id"]
+        if not user.engine.owns_session(session_id):
+            raise PermissionError("Du har ikke adgang til denne samtale!")
+        return session_id
+    
+    @staticmethod
+    def _bad_request(error):
+        return web.HTTPBadRequest(text=json.dumps({"error": error}), content_type="application/json")
+    
+    @staticmethod
+    def _text_fields(body, *names):
+        """Felter der skal være tekst (eller mangle) - returnerer dem, None for manglende"""
+        values = [body.get(name) for name in names]
+        for name, value in zip(names, values):
+            if value is not None and not isinstance(value, str):
+                return None, name
+        return values, None
+    
+    async def _json_body(self, request, *names):
+        """JSON objektet i requesten og dets tekst felter names (400 ved alt andet)"""
+        try:
+            body = await request.json() if request.can_read_body else {}
+        except json.JSONDecodeError:
+            raise self._bad_request("Ugyldig JSON")
+        if not isinstance(body, dict):
+            raise self._bad_request("JSON skal være et objekt")
+        values, invalid = self._text_fields(body, *names)
+        if invalid:
+            raise self._bad_request(f"Ugyldig {invalid}")
+        return values
+    
+    async def run_turn(self, user, session_id, message, on_token=None):
+        """Én chat tur begrænset af den fælles semaphore
+
+        Brugerens samtaler svarer uafhængigt af hinanden. En ny besked i samme
+        samtale erstatter et svar der stadig genereres eller venter på en plads.
+        """
+        user.cancel_reply(session_id)
+        task = asyncio.current_task()
+        user.replies[session_id] = task
+        tokens = []
+        try:
+            async with self.turns:
+                async for token in user.engine.stream(session_id, message):
+                    tokens.append(token)
+                    if on_token is not None:
+                        await on_token(token)
+        finally:
+            if user.replies.get(session_id) is task:
+                del user.replies[session_id]
+        return "".join(tokens)
+    
+    def _int_query(self, request, name, default=None):
+        """Heltal >= 0 fra query string (400 ved ugyldig værdi)"""
+        if name not in request.query:
+            return default
+        try:
+            value = int(request.query[name])
+        except ValueError:
+            value = -1
+        if value < 0:
+            raise self._bad_request(f"Ugyldig {name}")
+        return value
+    
+    @staticmethod
+    async def _stop_reply(user, session_id):
+        """Afbryd svaret i en samtale og vent til det er gemt færdigt"""
+        task = user.cancel_reply(session_id)
+        if task is not None:
+            await asyncio.wait([task])
+    
+    @web.middleware
+    async def error_middleware(self, request, handler):
+        """Oversæt motorens fejl til HTTP status koder"""
+        try:
+            return await handler(request)
+        except PermissionError:
+            return web.json_response({"error": "Ukendt samtale"}, status=404)
+        except LLMTimeout:
+            return web.json_response({"error": "LLM timeout"}, status=504)
+        except LLMUnavailable:
+            return web.json_response({"error": "Kan ikke forbinde til LLM"}, status=502)
+    
+    # HTTP handlers
+    async def handle_health(self, request):
+        return web.json_response({"status": "ok", "users": len(self.users),
+                                  "backends": {"healthy": self.llm_client.healthy_count,
+                                               "total": len(self.llm_client.clients)}})
+    
+    async def handle_metrics(self, request):
+        return web.Response(text=self.metrics.prometheus_text(), content_type="text/plain")
+    
+    async def handle_list_sessions(self, request):
+        user = await self.get_user(request)
+        name_filter = request.query.get("filter") or None
+        offset = self._int_query(request, "offset", 0)
+        limit = self._int_query(request, "limit")
+        sessions = [{
+            "id": session_id,
+            "name": session_data["name"],
+            "created": session_data["created"].isoformat(),
+            "updated": session_data.get("updated", session_data["created"]).isoformat(),
+            "messages": session_data.get("user_count", 0),
+        } for session_id, session_data in user.engine.list_sessions(name_filter, offset, limit)]
+        return web.json_response({"sessions": sessions, "total": user.engine.session_count(name_filter)})
+    
+    async def handle_create_session(self, request):
+        user = await self.get_user(request)
+        name, = await self._json_body(request, "name")
+        async with user.lock:
+            session_id = await user.engine.create_session(name)
+        return web.json_response({"id": session_id, "name": user.engine.sessions[session_id]["name"]}, status=201)
+    
+    async def handle_get_session(self, request):
+        user = await self.get_user(request)
+        session_id = self._session_id(request, user)
+        # Kun rolle og tekst - beskederne bærer også motorens interne felter (fx token cache)
+        history = [{"role": msg["role"], "content": msg["content"]}
+                   for msg in user.engine.history(session_id) if msg["role"] != "system"]
+        return web.json_response({"id": session_id, "name": user.engine.sessions[session_id]["name"],
+                                  "history": history})
+    
+    async def handle_delete_session(self, request):
+        user = await self.get_user(request)
+        session_id = self._session_id(request, user)
+        await self._stop_reply(user, session_id)
+        async with user.lock:
+            await user.engine.delete_session(session_id)
+        return web.json_response({"deleted": session_id})
+    
+    async def handle_clear_session(self, request):
+        user = await self.get_user(request)
+        session_id = self._session_id(request, user)
+        await self._stop_reply(user, session_id)
+        async with user.lock:
+            await user.engine.clear_session(session_id)
+        return web.json_response({"cleared": session_id})
+    
+    async def handle_chat(self, request):
+        user = await self.get_user(request)
+        session_id = self._session_id(request, user)
+        message, = await self._json_body(request, "message")
+        message = (message or "").strip()
+        if not message:
+            return web.json_response({"error": "Tom besked"}, status=400)
+        
+        # Turen kører i sin egen task, så /cancel kun stopper svaret og ikke requesten
+        tokens = []
+        
+        async def collect(token):
+            tokens.append(token)
+        
+        turn = asyncio.create_task(self.run_turn(user, session_id, message, collect))
+        try:
+            await asyncio.wait([turn])
+        except asyncio.CancelledError:
+            turn.cancel()  # Klienten lukkede forbindelsen
+            raise
+        if turn.cancelled():
+            return web.json_response({"reply": "".join(tokens), "cancelled": True})
+        return web.json_response({"reply": turn.result(), "cancelled": False})
+    
+    async def handle_cancel(self, request):
+        user = await self.get_user(request)
+        session_id = self._session_id(request, user)
+        return web.json_response({"cancelled": user.cancel_reply(session_id) is not None})
+    
+    async def handle_list_memory(self, request):
+        user = await self.get_user(request)
+        memories = [dict(memory_data, id=memory_id) for memory_id, memory_data in user.engine.user_memory.by_importance()]
+        return web.json_response({"memories": memories})
+    
+    async def handle_refresh_memory(self, request):
+        user = await self.get_user(request)
+        session_id, = await self._json_body(request, "session_id")
+        if not user.engine.owns_session(session_id):
+            raise PermissionError("Du har ikke adgang til denne samtale!")
+        user.engine.request_memory_extraction(session_id, True)
+        return web.json_response({"queued": session_id}, status=202)
+    
+    async def handle_clear_memory(self, request):
+        user = await self.get_user(request)
+        user.engine.cancel_memory()
+        async with user.lock:
+            await user.engine.clear_memory()
+        return web.json_response({"cleared": True})
+    
+    # WebSocket
+    async def handle_websocket(self, request):
+        """Streaming chat: tokens sendes efterhånden som de genereres"""
+        user = await self.get_user(request)
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        user.sockets.add(ws)
+        turns = set()
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    command = json.loads(msg.data)
+                except json.JSONDecodeError:
+                    await ws.send_json({"type": "error", "error": "Ugyldig JSON"})
+                    continue
+                if not isinstance(command, dict):
+                    await ws.send_json({"type": "error", "error": "JSON skal være et objekt"})
+                    continue
+                fields, invalid = self._text_fields(command, "type", "session_id", "message")
+                if invalid:
+                    await ws.send_json({"type": "error", "error": f"Ugyldig {invalid}"})
+                    continue
+                
+                command_type, session_id, message = fields
+                message = (message or "").strip()
+                if not user.engine.owns_session(session_id):
+                    await ws.send_json({"type": "error", "session_id": session_id, "error": "Ukendt samtale"})
+                elif command_type == "chat" and message:
+                    turn = asyncio.create_task(self._websocket_turn(ws, user, session_id, message))
+                    turns.add(turn)
+                    turn.add_done_callback(turns.discard)
+                elif command_type == "cancel":
+                    user.cancel_reply(session_id)
+                else:
+                    await ws.send_json({"type": "error", "session_id": session_id, "error": "Ukendt kommando"})
+        finally:
+            user.sockets.discard(ws)
+            for turn in list(turns):
+                turn.cancel()
+        return ws
+    
+    async def _websocket_turn(self, ws, user, session_id, message):
+        async def send_token(token):
+            await ws.send_json({"type": "token", "session_id": session_id, "text": token})
+        
+        try:
+            reply = await self.run_turn(user, session_id, message, send_token)
+            await ws.send_json({"type": "done", "session_id": session_id, "reply": reply})
+        except asyncio.CancelledError:
+            if not ws.closed:
+                with contextlib.suppress(Exception):
+                    await ws.send_json({"type": "cancelled", "session_id": session_id})
+            raise
+        except LLMTimeout:
+            await ws.send_json({"type": "error", "session_id": session_id, "error": "LLM timeout"})
+        except LLMUnavailable:
+            await ws.send_json({"type": "error", "session_id": session_id, "error": "Kan ikke forbinde til LLM"})
+        except Exception as e:
+            print(f"WebSocket tur fejl: {e}")
+            if not ws.closed:
+                await ws.send_json({"type": "error", "session_id": session_id, "error": str(e)})
+
+def main():
+    """Hovedfunktion"""
+    parser = argparse.ArgumentParser(description="LLM chat som flerbruger HTTP/WebSocket server")
+    parser.add_argument("--host", default="127.0.0.1", help="adresse at lytte på (standard: %(default)s)")
+    parser.add_argument("--port", type=int, default=8765, help="port (standard: %(default)s)")
+    parser.add_argument("--url", default=DEFAULT_LLM_URL, help="LLM endpoint, flere adskilles med komma (standard: %(default)s)")
+    parser.add_argument("--data-dir", default=".", help="mappe med user_data_<hash>/ mapperne (standard: %(default)s)")
+    parser.add_argument("--tokens", default="server_tokens.json", help="fil med login tokens (standard: %(default)s)")
+    parser.add_argument("--max-concurrent", type=int, default=4, help="max samtidige svar (standard: %(default)s)")
+    parser.add_argument("--add-user", metavar="NAVN", help="opret et login token til en bruger og afslut")
+    args = parser.parse_args()
+    
+    tokens = TokenStore(args.tokens)
+    if args.add_user:
+        print(f"🔑 Token til {args.add_user}: {tokens.add_user(args.add_user)}")
+        return
+    if not tokens.users:
+        print("❌ Ingen brugere - opret en med --add-user NAVN")
+        return
+    
+    server = ChatServer(args.url, args.data_dir, tokens, args.max_concurrent)
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""Hurtig terminal klient til LLM chatten (fx over SSH på inference maskinen).
+
+Bruger de samme sessions og minder som GUI'en (user_data_<hash>/) og skriver
+svarene ud efterhånden som de genereres. Importerer hverken tkinter, pyttsx3
+eller speech_recognition, så den er klar med det samme.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import signal
+import sys
+import threading
+
+from chat_engine import ChatEngine, DEFAULT_LLM_URL, LLMTimeout, LLMUnavailable, get_user_id, user_data_dir
+
+HELP_TEXT = """Kommandoer:
+  /ny [navn]       Start en ny samtale
+  /samtaler        Vis dine samtaler
+  /skift <nr|id>   Skift til en anden samtale
+  /historik        Vis den aktuelle samtale
+  /hukommelse      Vis hvad AI'en husker om dig
+  /husk            Opdater hukommelsen nu
+  /ryd             Ryd den aktuelle samtale
+  /engelsk         Skift mellem dansk og engelsk svar
+  /stats           Vis tidsmålinger og gem dem (Prometheus + JSONL)
+  /hjælp           Vis denne hjælp
+  /afslut          Gem og afslut (eller Ctrl-D)
+
+Ctrl-C mens et svar skrives stopper svaret."""
+
+class TerminalChat:
+    """Chat i terminalen oven på ChatEngine"""
+    
+    def __init__(self, engine, out=sys.stdout):
+        self.engine = engine
+        self.out = out
+        self.session_id = None
+        self.english = False
+        self.notices = []  # Status beskeder vises før næste prompt (ikke midt i et svar)
+        self._connection_check = None
+        self._reply_cached = False
+        
+        engine.add_listener(self._handle_engine_event)
+    
+    def write(self, text=""):
+        self.out.write(text + "\n")
+        self.out.flush()
+    
+    def _handle_engine_event(self, event, data):
+        """Saml hukommelse status fra motoren"""
+        if event == "memories_added" and data["count"]:
+            self.notices.append(f"🧠 {data['count']} nye minder!")
+        elif event == "memory_status" and data["text"].startswith("❌"):
+            self.notices.append(data["text"])
+        elif event == "response_cached":
+            self._reply_cached = True
+        elif event == "backend_status":
+            self.notices.append(f"🖥️ LLM servere: {data['healthy']}/{data['total']} svarer")
+    
+    def _show_notices(self):
+        while self.notices:
+            self.write(self.notices.pop(0))
+    
+    async def start(self, new_session=False, session_id=None):
+        """Start motoren og vælg samtale (seneste, en bestemt eller en ny)"""
+        await self.engine.start()
+        # Forbindelsen testes i baggrunden så prompten er klar med det samme
+        self._connection_check = asyncio.create_task(self._check_connection())
+        
+        if session_id:
+            await self.switch_session(session_id)
+        elif not new_session and self.engine.list_sessions():
+            await self.switch_session(self.engine.list_sessions()[0][0])
+        else:
+            await self.new_session()
+    
+    async def _check_connection(self):
+        try:
+            await self.engine.check_connection()
+        except LLMUnavailable:
+            self.notices.append("❌ LM Studio ikke startet")
+        except Exception as e:
+            self.notices.append(f"❌ Forbindelsesfejl: {e}")
+    
+    async def new_session(self, name=None):
+        self.session_id = await self.engine.create_session(name)
+        self.write(f"📝 Ny samtale '{self.engine.sessions[self.session_id]['name']}' oprettet!")
+        memory_count = len(self.engine.user_memory)
+        if memory_count > 0:
+            self.write(f"AI'en husker allerede {memory_count} ting om dig.")
+    
+    async def switch_session(self, key):
+        """Skift samtale ud fra nummer i /samtaler eller session id"""
+        sessions = self.engine.list_sessions()
+        if key.isdigit() and 1 <= int(key) <= len(sessions):
+            key = sessions[int(key) - 1][0]
+        try:
+            history = await self.engine.load_session(key)
+        except PermissionError:
+            self.write("❌ Ukendt samtale (se /samtaler)")
+            return
+        self.session_id = key
+        turns = sum(1 for msg in history if msg["role"] == "user")
+        self.write(f"📝 Aktuel: {self.engine.sessions[key]['name']} ({turns} beskeder)")
+    
+    def list_sessions(self):
+        for number, (session_id, session_data) in enumerate(self.engine.list_sessions(), 1):
+            marker = "*" if session_id == self.session_id else " "
+            created_str = session_data["created"].strftime("%d/%m %H:%M")
+            msg_count = session_data.get("user_count", 0)
+            self.write(f"{marker}{number:3}. {session_data['name']} ({msg_count} beskeder, {created_str}) [{session_id}]")
+    
+    def show_history(self):
+        for msg in self.engine.history(self.session_id):
+            if msg["role"] == "user":
+                self.write(f"👤 Du: {msg['content']}")
+            elif msg["role"] == "assistant":
+                self.write(f"🤖 Assistant: {msg['content']}\n")
+    
+    def show_memory(self):
+        if not self.engine.user_memory:
+            self.write("Ingen minder endnu.")
+            return
+        for _, memory_data in self.engine.user_memory.by_importance():
+            stars = "⭐" * min(memory_data.get("importance", 0), 5)
+            self.write(f"• {memory_data.get('info', '')} {stars}")
+    
+    async def send(self, prompt):
+        """Send besked og skriv svaret ud token for token (Ctrl-C stopper svaret)"""
+        if self._connection_check and not self._connection_check.done():
+            await self._connection_check  # Kontekst længden tilpasses i forbindelsestesten
+        
+        loop = asyncio.get_running_loop()
+        reply = asyncio.create_task(self._print_reply(prompt))
+        previous_handler = signal.getsignal(signal.SIGINT)
+        stoppable = False
+        with contextlib.suppress(NotImplementedError):  # Ikke understøttet på Windows
+            loop.add_signal_handler(signal.SIGINT, reply.cancel)
+            stoppable = True
+        try:
+            await asyncio.wait([reply])
+        finally:
+            if stoppable:
+                loop.remove_signal_handler(signal.SIGINT)
+                signal.signal(signal.SIGINT, previous_handler)
+        if reply.cancelled():
+            self.write(" ⏹️ (stoppet)\n")
+    
+    async def _print_reply(self, prompt):
+        self.out.write("🤖 Assistant: ")
+        self.out.flush()
+        self._reply_cached = False
+        try:
+            async for token in self.engine.stream(self.session_id, prompt):
+                self.out.write(token)
+                self.out.flush()
+            self.write(" ⚡ (fra cache)\n" if self._reply_cached else "\n")
+        except LLMTimeout:
+            self.write(f"\nTimeout efter {self.engine.timeout_seconds}s.")
+        except LLMUnavailable:
+            self.write("\nKan ikke forbinde til LLM. Er LM Studio kørende?")
+        except Exception as e:
+            self.write(f"\nFejl: {e}")
+    
+    def show_stats(self):
+        """Nøgletal pr. måling og eksport til brugerens data mappe"""
+        for histogram in self.engine.metrics.snapshot()["histograms"]:
+            if "p50" not in histogram:
+                continue
+            labels = ",".join(f"{name}={value}" for name, value in histogram["labels"].items())
+            unit, scale = ("ms", 1000) if histogram["name"].endswith("_seconds") else ("", 1)
+            self.write(f"  {histogram['name']}{{{labels}}}: n={histogram['count']} "
+                       f"p50={histogram['p50'] * scale:.1f}{unit} p90={histogram['p90'] * scale:.1f}{unit} "
+                       f"max={histogram['max'] * scale:.1f}{unit}")
+        prom_path, jsonl_path = self.engine.export_metrics()
+        self.write(f"📊 Gemt i {prom_path} og {jsonl_path}")
+    
+    async def handle_command(self, line):
+        """Udfør en /kommando - returnerer False når programmet skal afslutte"""
+        command, _, argument = line[1:].partition(" ")
+        argument = argument.strip()
+        
+        if command in ("afslut", "quit", "exit"):
+            return False
+        elif command == "ny":
+            await self.new_session(argument or None)
+        elif command == "samtaler":
+            self.list_sessions()
+        elif command == "skift" and argument:
+            await self.switch_session(argument)
+        elif command == "historik":
+            self.show_history()
+        elif command == "hukommelse":
+            self.show_memory()
+        elif command == "husk":
+            self.engine.request_memory_extraction(self.session_id, True)
+            self.write("🔄 Opdaterer hukommelse...")
+        elif command == "ryd":
+            await self.engine.clear_session(self.session_id)
+            self.write("Chat ryddet.")
+        elif command == "stats":
+            self.show_stats()
+        elif command == "engelsk":
+            self.english = not self.english
+            await self.engine.set_english(self.english, self.session_id)
+            self.write("🇬🇧 Engelsk svar: TIL" if self.english else "🇩🇰 Dansk svar: TIL")
+        else:
+            self.write(HELP_TEXT)
+        return True
+    
+    async def read_line(self, prompt):
+        """input() i en daemon tråd så hukommelse o.l. kan arbejde imens
+
+        Ikke i loopets executor: asyncio.run venter på dens tråde ved lukning,
+        så Ctrl-C ved prompten ville hænge indtil der blev trykket enter.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        
+        def resolve(line, error):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(line)
+        
+        def read():
+            try:
+                line, error = input(prompt), None
+            except (EOFError, OSError) as e:
+                line, error = None, e
+            with contextlib.suppress(RuntimeError):  # Loopet er allerede lukket
+                loop.call_soon_threadsafe(resolve, line, error)
+        
+        threading.Thread(target=read, daemon=True).start()
+        return await future
+    
+    async def run(self):
+        """Læs beskeder fra stdin indtil /afslut eller EOF"""
+        self.write("Skriv /hjælp for kommandoer.")
+        while True:
+            self._show_notices()
+            try:
+                line = await self.read_line("👤 Du: ")
+            except EOFError:
+                self.write()
+                break
+            
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("/"):
+                if not await self.handle_command(line):
+                    break
+            else:
+                await self.send(line)
+
+async def run(args):
+    user_id = get_user_id()
+    engine = ChatEngine(user_id, user_data_dir(user_id), args.url)
+    if args.no_stream:
+        engine.update_settings(stream_enabled=False)
+    if args.cache:
+        # Scriptet brug ønsker samme svar hver gang, også ved temperature > 0
+        engine.update_settings(response_cache_enabled=True, response_cache_force=True)
+    
+    chat = TerminalChat(engine)
+    try:
+        await chat.start(new_session=args.new, session_id=args.session)
+        if args.message:
+            # Enkelt besked (scripts): svar og afslut
+            await chat.send(" ".join(args.message))
+        else:
+            await chat.run()
+    finally:
+        # Gem alle data og luk forbindelser
+        await engine.close()
+
+def main():
+    """Hovedfunktion"""
+    parser = argparse.ArgumentParser(description="LLM chat i terminalen")
+    parser.add_argument("message", nargs="*", help="send én besked og afslut")
+    parser.add_argument("--url", default=DEFAULT_LLM_URL, help="LLM endpoint, flere adskilles med komma (standard: %(default)s)")
+    parser.add_argument("--ny", dest="new", action="store_true", help="start en ny samtale")
+    parser.add_argument("--session", help="fortsæt en bestemt samtale (id)")
+    parser.add_argument("--ingen-stream", dest="no_stream", action="store_true",
+                        help="vis først svaret når det er færdigt")
+    parser.add_argument("--cache", action="store_true",
+                        help="genbrug gemte svar på identiske forespørgsler (også ved temperature > 0)")
+    args = parser.parse_args()
+    
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        # Alt er gemt i run(). Læse-tråden kan stadig vente i input() og holde stdin låst,
+        # så afslut uden interpreterens oprydning af stdin
+        sys.stdout.flush()
+        os._exit(130)
+
+if __name__ == "__main__":
+    main()
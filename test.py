@@ -1,92 +1,611 @@
-import requests
+import asyncio
 import json
-import pyttsx3
-import speech_recognition as sr
-import time
+import os
+import re
 import threading
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, simpledialog
-import os
-import pickle
-import hashlib
-import getpass
+
+from chat_engine import ChatEngine, DEFAULT_LLM_URL, LLMTimeout, LLMUnavailable, get_user_id, user_data_dir
+
+class ChatRenderer:
+    """Chat visning i et ScrolledText - kun et vindue af beskeder ligger i widgettet ad gangen"""
+    
+    # Tags konfigureres én gang når visningen oprettes
+    TAGS = {
+        "system_sender": {"foreground": "purple", "font": ("Arial", 11, "bold")},
+        "system_msg": {"foreground": "purple"},
+        "user_sender": {"foreground": "blue", "font": ("Arial", 11, "bold")},
+        "user_msg": {"foreground": "black"},
+        "assistant_sender": {"foreground": "green", "font": ("Arial", 11, "bold")},
+        "assistant_msg": {"foreground": "dark green"},
+    }
+    
+    def __init__(self, widget, window_size=300, chunk_size=50):
+        self.widget = widget
+        self.window_size = window_size  # Max beskeder i widgettet
+        self.chunk_size = chunk_size  # Beskeder der tegnes pr. event-loop tick
+        self.entries = []  # [afsender, tekst, type, tidspunkt] for hele samtalen
+        self.first = 0  # Index på første besked i widgettet
+        self.last = 0  # Index efter sidste besked i widgettet
+        self._streaming = None  # Index på beskeden der streames lige nu
+        self._load_job = None
+        
+        for tag, options in self.TAGS.items():
+            widget.tag_config(tag, **options)
+        
+        # Hent ældre/nyere beskeder når der scrolles til kanten af vinduet
+        self._set_scrollbar = widget.vbar.set
+        widget.config(yscrollcommand=self._on_scroll)
+    
+    def _segments(self, index):
+        """Tekst og tags for én besked (alle dele får også et tag pr. besked)"""
+        sender, text, msg_type, timestamp = self.entries[index]
+        tag = f"msg{index}"
+        if msg_type == "system":
+            header, body = f"[{timestamp}] {sender}: ", f"{text}\n\n"
+        elif msg_type == "user":
+            header, body = f"[{timestamp}] Du: ", f"{text}\n"
+        else:  # assistant
+            header, body = f"[{timestamp}] 🤖 Assistant: ", f"{text}\n\n"
+        if index == self._streaming:
+            body = text  # Afsluttes i end_stream
+        return [header, (f"{msg_type}_sender", tag), body, (f"{msg_type}_msg", tag)]
+    
+    def _render(self, start, stop, at_top=False):
+        """Indsæt beskeder [start, stop) i toppen eller bunden med ét Tk kald"""
+        segments = []
+        for index in range(start, stop):
+            segments.extend(self._segments(index))
+        if not segments:
+            return
+        self.widget.config(state=tk.NORMAL)
+        self.widget.insert("1.0" if at_top else tk.END, *segments)
+        self.widget.config(state=tk.DISABLED)
+    
+    def _trim(self, from_top):
+        """Fjern beskeder så højst window_size ligger i widgettet - returnerer antal fjernede linjer i toppen"""
+        excess = (self.last - self.first) - self.window_size
+        if excess <= 0:
+            return 0
+        
+        removed_lines = 0
+        self.widget.config(state=tk.NORMAL)
+        if from_top:
+            new_first = self.first + excess
+            start = self.widget.index(f"msg{new_first}.first")
+            removed_lines = int(start.split(".")[0]) - 1
+            self.widget.delete("1.0", start)
+            removed = range(self.first, new_first)
+            self.first = new_first
+        else:
+            new_last = self.last - excess
+            self.widget.delete(f"msg{new_last}.first", tk.END)
+            removed = range(new_last, self.last)
+            self.last = new_last
+        self.widget.config(state=tk.DISABLED)
+        self.widget.tag_delete(*[f"msg{index}" for index in removed])
+        return removed_lines
+    
+    def clear(self):
+        """Ryd visningen"""
+        if self._load_job is not None:
+            self.widget.after_cancel(self._load_job)
+            self._load_job = None
+        self.widget.config(state=tk.NORMAL)
+        self.widget.delete("1.0", tk.END)
+        self.widget.config(state=tk.DISABLED)
+        if self.last > self.first:
+            self.widget.tag_delete(*[f"msg{index}" for index in range(self.first, self.last)])
+        self.entries = []
+        self.first = self.last = 0
+        self._streaming = None
+    
+    def show(self, messages):
+        """Vis en hel samtale af (afsender, tekst, type) - nyeste først, ældre tegnes løbende"""
+        self.clear()
+        timestamp = datetime.now().strftime("%H:%M")
+        self.entries = [[sender, text, msg_type, timestamp] for sender, text, msg_type in messages]
+        self._show_tail()
+    
+    def _show_tail(self):
+        """Tegn den nyeste chunk med det samme og fyld op med ældre i de næste ticks"""
+        self.widget.config(state=tk.NORMAL)
+        self.widget.delete("1.0", tk.END)
+        self.widget.config(state=tk.DISABLED)
+        if self.last > self.first:
+            self.widget.tag_delete(*[f"msg{index}" for index in range(self.first, self.last)])
+        
+        self.last = len(self.entries)
+        self.first = max(0, self.last - self.chunk_size)
+        self._render(self.first, self.last)
+        self.widget.see(tk.END)
+        self._schedule_load(self._prefill)
+    
+    def _prefill(self):
+        """Tegn ældre beskeder en chunk ad gangen til der er et halvt vindue at scrolle i"""
+        self._load_job = None
+        if self.first == 0 or self.last - self.first >= self.window_size // 2:
+            return
+        self._load_older()
+        self.widget.see(tk.END)
+        self._schedule_load(self._prefill)
+    
+    def _schedule_load(self, callback):
+        if self._load_job is None:
+            self._load_job = self.widget.after(1, callback)
+    
+    def _on_scroll(self, first, last):
+        """Scrollbar callback - henter flere beskeder ved kanten af vinduet"""
+        self._set_scrollbar(first, last)
+        if float(first) <= 0.0 and self.first > 0:
+            self._schedule_load(self._load_older)
+        elif float(last) >= 1.0 and self.last < len(self.entries):
+            self._schedule_load(self._load_newer)
+    
+    def _load_older(self):
+        """Tegn en chunk ældre beskeder i toppen uden at flytte det man kigger på"""
+        self._load_job = None
+        if self.first == 0:
+            return
+        
+        top = self.widget.index("@0,0")
+        old_first = self.first
+        self.first = max(0, old_first - self.chunk_size)
+        self._render(self.first, old_first, at_top=True)
+        
+        added_lines = int(self.widget.index(f"msg{old_first}.first").split(".")[0]) - 1
+        self.widget.yview(f"{top} + {added_lines} lines")
+        self._trim(from_top=False)
+    
+    def _load_newer(self):
+        """Tegn en chunk nyere beskeder i bunden (efter man har scrollet op i historikken)"""
+        self._load_job = None
+        if self.last >= len(self.entries):
+            return
+        
+        top = self.widget.index("@0,0")
+        old_last = self.last
+        self.last = min(len(self.entries), old_last + self.chunk_size)
+        self._render(old_last, self.last)
+        
+        removed_lines = self._trim(from_top=True)
+        if removed_lines:
+            self.widget.yview(f"{top} - {removed_lines} lines")
+    
+    def add(self, sender, text, msg_type="user"):
+        """Tilføj en ny besked nederst"""
+        if msg_type not in ("system", "user"):
+            msg_type = "assistant"
+        self.entries.append([sender, text, msg_type, datetime.now().strftime("%H:%M")])
+        self._append_latest()
+    
+    def _append_latest(self):
+        """Vis den nyeste besked - hopper tilbage til bunden hvis man har scrollet op i historikken"""
+        if self.last < len(self.entries) - 1:
+            self._show_tail()
+            return
+        
+        self._render(self.last, len(self.entries))
+        self.last = len(self.entries)
+        self._trim(from_top=True)
+        self.widget.see(tk.END)
+    
+    def begin_stream(self):
+        """Start en assistent besked der fyldes ud løbende"""
+        self.entries.append(["Assistant", "", "assistant", datetime.now().strftime("%H:%M")])
+        self._streaming = len(self.entries) - 1
+        self._append_latest()
+    
+    def _insert_in_stream(self, text):
+        index = self._streaming
+        if not self.first <= index < self.last:
+            return  # Ikke i vinduet lige nu - tegnes fra entries når der scrolles tilbage
+        self.widget.config(state=tk.NORMAL)
+        self.widget.insert(f"msg{index}.last", text, ("assistant_msg", f"msg{index}"))
+        self.widget.see(tk.END)
+        self.widget.config(state=tk.DISABLED)
+    
+    def append_stream(self, text):
+        """Tilføj tokens til beskeden der streames"""
+        if self._streaming is None:
+            return
+        self.entries[self._streaming][1] += text
+        self._insert_in_stream(text)
+    
+    def end_stream(self):
+        """Afslut beskeden der streames"""
+        if self._streaming is None:
+            return
+        self._insert_in_stream("\n\n")
+        self._streaming = None
+
+class SpeechWorker:
+    """Oplæsning i én tråd der ejer pyttsx3 engine - siger hver sætning så snart den er færdig"""
+    
+    # Sætning slutter ved . ! ? … efterfulgt af mellemrum, eller ved linjeskift
+    SENTENCE_END = re.compile(r'(?<=[.!?…])["\')\]]*\s+|\n+')
+    
+    def __init__(self, on_status=None, rate=150, volume=0.9):
+        self.on_status = on_status or (lambda text: None)
+        self.rate = rate
+        self.volume = volume
+        self.ready = False  # Engine er initialiseret
+        self._engine = None
+        self._queue = queue.Queue()  # (generation, sætning)
+        self._lock = threading.Lock()
+        self._generation = 0  # Tælles op ved afbrydelse - ældre sætninger springes over
+        self._buffer = ""  # Tekst fra streaming der endnu ikke er en hel sætning
+        self._speaking_generation = None  # Generation for sætningen der læses op lige nu
+        self._thread = None
+    
+    def start(self):
+        """Start tråden (importerer og initialiserer pyttsx3 i tråden selv)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+    
+    def _init_engine(self):
+        import pyttsx3  # Importeres først her - tager tid og bruges kun til oplæsning
+        engine = pyttsx3.init()
+        engine.setProperty('rate', self.rate)
+        engine.setProperty('volume', self.volume)
+        
+        # Prøv at finde dansk stemme
+        voices = engine.getProperty('voices')
+        for voice in voices:
+            if any(lang in voice.id.lower() for lang in ['danish', 'dansk', 'da_dk', 'da-dk']):
+                engine.setProperty('voice', voice.id)
+                break
+        
+        # Afbrydelse tjekkes ved hvert ord i tråden selv - engine kaldes aldrig fra andre tråde
+        engine.connect('started-word', self._check_interrupted)
+        return engine
+    
+    def _run(self):
+        try:
+            self._engine = self._init_engine()
+            self.ready = True
+            self.on_status("✅ TTS klar")
+        except Exception as e:
+            self.on_status(f"❌ TTS fejl: {str(e)[:30]}")
+            return
+        
+        while True:
+            generation, text = self._queue.get()
+            if text is None:
+                break
+            if generation != self._generation:
+                continue  # Afbrudt efter den blev lagt i kø
+            try:
+                self._speaking_generation = generation
+                self._engine.say(text)
+                self._engine.runAndWait()
+            except Exception as e:
+                print(f"TTS fejl: {e}")
+            finally:
+                self._speaking_generation = None
+    
+    def _check_interrupted(self, name, location, length):
+        """pyttsx3 callback (i oplæsningstråden): stop sætningen hvis den er afbrudt"""
+        if self._speaking_generation is not None and self._speaking_generation != self._generation:
+            self._engine.stop()
+    
+    def _enqueue(self, text):
+        if text.strip():
+            self._queue.put((self._generation, text.strip()))
+    
+    def speak(self, text):
+        """Læs en hel tekst op (en sætning ad gangen, så den kan afbrydes)"""
+        with self._lock:
+            for sentence in self.SENTENCE_END.split(text):
+                self._enqueue(sentence)
+    
+    def feed(self, text):
+        """Tilføj streamet tekst - hele sætninger læses op med det samme"""
+        with self._lock:
+            parts = self.SENTENCE_END.split(self._buffer + text)
+            self._buffer = parts.pop()
+            for sentence in parts:
+                self._enqueue(sentence)
+    
+    def finish(self):
+        """Streamingen er slut - læs resten op"""
+        with self._lock:
+            self._enqueue(self._buffer)
+            self._buffer = ""
+    
+    def interrupt(self):
+        """Stop oplæsningen og glem alt der venter"""
+        with self._lock:
+            self._generation += 1  # Oplæsningstråden stopper ved næste ord
+            self._buffer = ""
+    
+    def close(self):
+        self.interrupt()
+        self._queue.put((None, None))
+
+class SpeechBackend:
+    """Talegenkendelse - recognize(audio, sprog) giver (tekst, sikkerhed 0-1) eller None"""
+    
+    name = ""
+    
+    def supports(self, language):
+        return True
+    
+    def preload(self, languages):
+        """Forbered backenden (fx load modeller) så første genkendelse er hurtig"""
+    
+    def recognize(self, audio, language):
+        raise NotImplementedError
+
+class GoogleSpeechBackend(SpeechBackend):
+    """Googles web API via speech_recognition (kræver internet)"""
+    
+    name = "google"
+    
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+    
+    def recognize(self, audio, language):
+        result = self.recognizer.recognize_google(audio, language=language, show_all=True)
+        if not isinstance(result, dict) or not result.get("alternative"):
+            return None
+        best = result["alternative"][0]
+        return best["transcript"], best.get("confidence", 0.5)  # Google oplyser ikke altid sikkerhed
+
+class VoskSpeechBackend(SpeechBackend):
+    """Lokal genkendelse på CPU med Vosk - én model pr. sprog i model_dir (fx vosk_models/da-DK)"""
+    
+    name = "vosk"
+    SAMPLE_RATE = 16000
+    
+    def __init__(self, model_dir="vosk_models"):
+        self.model_dir = model_dir
+        self._models = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def installed():
+        try:
+            import vosk  # noqa: F401
+            return True
+        except ImportError:
+            return False
+    
+    def model_path(self, language):
+        """Mappe med modellen for et sprog ("da-DK" eller bare "da")"""
+        for name in (language, language.split("-")[0]):
+            path = os.path.join(self.model_dir, name)
+            if os.path.isdir(path):
+                return path
+        return None
+    
+    def supports(self, language):
+        return self.model_path(language) is not None
+    
+    def _model(self, language):
+        with self._lock:
+            if language not in self._models:
+                import vosk
+                vosk.SetLogLevel(-1)
+                self._models[language] = vosk.Model(self.model_path(language))
+            return self._models[language]
+    
+    def preload(self, languages):
+        for language in languages:
+            if self.supports(language):
+                self._model(language)
+    
+    def recognize(self, audio, language):
+        import vosk
+        recognizer = vosk.KaldiRecognizer(self._model(language), self.SAMPLE_RATE)
+        recognizer.SetWords(True)
+        recognizer.AcceptWaveform(audio.get_raw_data(convert_rate=self.SAMPLE_RATE, convert_width=2))
+        result = json.loads(recognizer.FinalResult())
+        
+        text = result.get("text", "").strip()
+        if not text:
+            return None
+        words = result.get("result") or []
+        confidence = sum(word.get("conf", 0.0) for word in words) / len(words) if words else 0.0
+        return text, confidence
+
+class VoiceRecognizer:
+    """Kører alle kandidat-sprog (og backends) samtidig og vælger resultatet med størst sikkerhed"""
+    
+    def __init__(self, backends, languages=("da-DK", "en-US")):
+        self.backends = list(backends)
+        self.languages = list(languages)
+        self.candidates = [(backend, language) for backend in self.backends
+                           for language in self.languages if backend.supports(language)]
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.candidates)),
+                                            thread_name_prefix="speech")
+    
+    def preload(self):
+        for backend in self.backends:
+            backend.preload(self.languages)
+    
+    def recognize(self, audio):
+        """Genkend tale - returnerer teksten eller None"""
+        futures = [self._executor.submit(backend.recognize, audio, language)
+                   for backend, language in self.candidates]
+        best = None
+        for (backend, language), future in zip(self.candidates, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Talegenkendelse ({backend.name}, {language}) fejl: {e}")
+                continue
+            # Ved lige sikkerhed vinder det første sprog i listen (dansk)
+            if result and (best is None or result[1] > best[1]):
+                best = result
+        return best[0] if best else None
+    
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
 class LLMChatGUI:
-    def __init__(self, llm_url="http://localhost:1234/v1/chat/completions"):
+    def __init__(self, llm_url=DEFAULT_LLM_URL):
+        self.started_at = time.perf_counter()  # Til måling af opstartstid
+        
         # LLM URL
         self.llm_url = llm_url
         
-        # Konfigurerbare indstillinger
-        self.timeout_seconds = 45  # Standard timeout
-        self.timeout_enabled = True  # Om timeout er aktiveret
+        # Streaming visning
+        self.stream_flush_ms = 50  # Hvor ofte streamede tokens skrives til chatten
         
-        # Bruger identifikation
-        self.current_user = self.get_or_create_user()
-        self.user_data_dir = f"user_data_{self.current_user}"
-        self.ensure_user_directory()
+        # Sessions liste (vises en side ad gangen)
+        self.session_page_size = 50
+        self.session_page = 0
+        self.session_row_ids = []  # Session id for hver række i listen
         
-        # Session management (per bruger)
-        self.sessions = {}
-        self.current_session_id = None
-        self.sessions_file = os.path.join(self.user_data_dir, "chat_sessions.pkl")
-        
-        # AI Hukommelse system (automatisk og persistent)
-        self.user_memory = {}  # Format: {memory_id: memory_data}
-        self.memory_file = os.path.join(self.user_data_dir, "user_memory.json")
-        self.auto_memory_threshold = 3  # Antal beskeder før automatisk memory-opdatering
-        self.message_count = 0
+        # Chat visning
+        self.chat_window_size = 300  # Max beskeder i chat widgettet ad gangen
+        self.chat_chunk_size = 50  # Beskeder der tegnes pr. tick ved lange samtaler
         
-        # Load eksisterende data
-        self.load_sessions()
-        self.load_user_memory()
+        # Streaming tilstand (deles mellem engine tråden og GUI)
+        self._stream_lock = threading.Lock()
+        self._stream_buffer = []
+        self._stream_flush_pending = False
+        self._stream_active = False
+        self._reply_cached = False  # Det aktuelle svar kom fra svar-cachen
+        self._reply_future = None  # Svaret der genereres lige nu (kan annulleres)
+        self._reply_generation = 0  # Tælles op pr. besked så et afløst svar ikke rører chatten
         
-        # System prompts
-        self.danish_prompt = """Du er en hjælpsom assistent der svarer på dansk. Hold svarene korte og præcise. 
-        Du har adgang til information om brugeren som kan hjælpe dig med at give bedre og mere personlige svar."""
+        # Kald fra engine tråden til GUI'en (main thread blokerer aldrig på root.after fra en anden tråd)
+        self._ui_queue = queue.Queue()
+        self.ui_poll_ms = 20
         
-        self.english_prompt = """You are a helpful assistant that always responds in English, even if the user writes in Danish or other languages. 
-        Keep responses concise and clear. You have access to user information that can help you provide better, more personalized responses."""
+        # Bruger identifikation
+        self.current_user = self.get_or_create_user()
+        self.user_data_dir = user_data_dir(self.current_user)
+        self.current_session_id = None
         
-        self.system_prompt = {
-            "role": "system",
-            "content": self.danish_prompt
-        }
+        # Chat motoren (sessions, hukommelse, LLM kald) kører på sin egen event loop
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.engine = ChatEngine(self.current_user, self.user_data_dir, llm_url)
         
-        # TTS og Speech Recognition
-        self.tts_engine = None
+        # TTS og Speech Recognition (importeres og startes i baggrunden)
+        self.speech = SpeechWorker(on_status=lambda text: self._post(self.update_status, text))
         self.tts_enabled = True
-        self.recognizer = sr.Recognizer()
+        self._speak_stream = False  # Den aktuelle streamede besked læses op
+        self.recognizer = None
         self.microphone = None
+        self.microphone_checked = False  # Mikrofon forsøgt initialiseret (ok eller fejl)
+        self.voice_recognizer = None
+        self.speech_backend = "auto"  # "auto" (lokal hvis muligt), "vosk" eller "google"
+        self.speech_languages = ["da-DK", "en-US"]  # Genkendes samtidig - sikreste resultat vinder
+        self.vosk_model_dir = "vosk_models"
         self.is_listening = False
+        self._audio_thread = None
+        self._voice_pending = False  # 🎤 trykket før mikrofonen var klar
+        self.audio_init_delay_ms = 500  # Lad vinduet tegne før lyd loades
+        self.stats_interval_ms = 2000  # Hvor ofte stats panelet opdateres
         
         # GUI setup
         self.setup_gui()
         
+        # Engine hændelser (hukommelse status osv.) håndteres i main thread
+        self._drain_ui_queue()
+        self.engine.add_listener(lambda event, data: self._post(self._handle_engine_event, event, data))
+        self._engine_call(self.engine.start())
+        
         # Start med ny session
         self.create_new_session()
         
-        self.init_tts()
-        self.init_microphone()
+        # Lyd tager over et sekund at starte - det sker i baggrunden når vinduet er oppe
+        self.root.after(self.audio_init_delay_ms, self.init_audio)
         
         # Test forbindelse ved start
         self.test_connection()
+        self.update_stats()
     
-    def get_or_create_user(self):
-        """Få eller opret bruger ID baseret på system"""
-        # Kombiner username og computer navn for unik ID
-        username = getpass.getuser()
-        computer_name = os.environ.get('COMPUTERNAME', os.environ.get('HOSTNAME', 'unknown'))
-        user_string = f"{username}@{computer_name}"
+    @property
+    def sessions(self):
+        return self.engine.sessions
+    
+    @property
+    def user_memory(self):
+        return self.engine.user_memory
+    
+    @property
+    def conversation_history(self):
+        return self._engine_sync(self.engine.history, self.current_session_id)
+    
+    def _engine_call(self, coro):
+        """Kør en coroutine på engine loopet og vent på resultatet (kun til hurtige lokale operationer)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+    
+    def _engine_sync(self, func, *args):
+        """Kør en synkron engine metode på engine loopet og vent på resultatet"""
+        async def call():
+            return func(*args)
+        return self._engine_call(call())
+    
+    def _engine_submit(self, coro, on_done=None, on_error=None):
+        """Start en coroutine på engine loopet - resultat/fejl leveres i main thread"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
         
-        # Lav hash for privatliv
-        user_hash = hashlib.md5(user_string.encode()).hexdigest()[:8]
-        return user_hash
+        def done(future):
+            if future.cancelled():
+                return  # Annulleret med vilje (Stop eller ny besked)
+            try:
+                result = future.result()
+            except Exception as e:
+                if on_error:
+                    self._post(on_error, e)
+                else:
+                    print(f"Engine fejl: {e}")
+                return
+            if on_done:
+                self._post(on_done, result)
+        
+        future.add_done_callback(done)
+        return future
+    
+    def _post(self, func, *args):
+        """Kør en funktion i main thread (sikker at kalde fra engine og andre baggrundstråde)"""
+        self._ui_queue.put((func, args))
+    
+    def _drain_ui_queue(self):
+        """Udfør ventende GUI kald fra engine tråden (kører i main thread)"""
+        try:
+            while True:
+                func, args = self._ui_queue.get_nowait()
+                try:
+                    func(*args)
+                except Exception as e:
+                    print(f"GUI fejl: {e}")
+        except queue.Empty:
+            pass
+        self.root.after(self.ui_poll_ms, self._drain_ui_queue)
     
-    def ensure_user_directory(self):
-        """Sikr at bruger directory eksisterer"""
-        if not os.path.exists(self.user_data_dir):
-            os.makedirs(self.user_data_dir)
+    def _handle_engine_event(self, event, data):
+        """Håndter hændelser fra chat motoren (kører i main thread)"""
+        if event == "memory_progress":
+            # Vis at systemet tæller beskeder
+            self.auto_memory_label.config(text=f"🤖 Auto-hukommelse: {data['count']}/{data['threshold']}")
+        elif event == "memory_status":
+            self.auto_memory_label.config(text=data["text"])
+            if data.get("reset_after"):
+                self.root.after(data["reset_after"], lambda: self.auto_memory_label.config(text="🤖 Auto-hukommelse: Aktiveret"))
+        elif event == "memories_added":
+            self._handle_auto_memory_success(data["count"])
+        elif event == "response_cached":
+            self._reply_cached = True
+        elif event == "backend_status":
+            icon = "✅" if data["healthy"] == data["total"] else "⚠️" if data["healthy"] else "❌"
+            self.update_status(f"{icon} LLM servere: {data['healthy']}/{data['total']} svarer")
+    
+    def get_or_create_user(self):
+        """Få eller opret bruger ID baseret på system"""
+        return get_user_id()
     
     def setup_gui(self):
         """Opret GUI vindue"""
@@ -114,11 +633,26 @@ class LLMChatGUI:
         ttk.Button(sessions_controls, text="💾 Gem", command=self.save_current_session, width=8).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(sessions_controls, text="🗑️ Slet", command=self.delete_session, width=8).pack(side=tk.LEFT, padx=(0, 5))
         
-        # Sessions liste
+        # Filtrer på navn
+        filter_frame = ttk.Frame(sessions_frame)
+        filter_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(filter_frame, text="🔍").pack(side=tk.LEFT, padx=(0, 5))
+        self.session_filter_var = tk.StringVar()
+        self.session_filter_var.trace_add("write", lambda *args: self.filter_sessions())
+        ttk.Entry(filter_frame, textvariable=self.session_filter_var).pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        # Sessions liste (kun den aktuelle side ligger i listboxen)
         self.sessions_listbox = tk.Listbox(sessions_frame, height=4, font=("Arial", 10))
         self.sessions_listbox.pack(fill=tk.BOTH, expand=True)
         self.sessions_listbox.bind('<Double-Button-1>', self.load_selected_session)
         
+        page_frame = ttk.Frame(sessions_frame)
+        page_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Button(page_frame, text="◀", width=3, command=lambda: self.change_sessions_page(-1)).pack(side=tk.LEFT)
+        self.sessions_page_label = ttk.Label(page_frame, text="1/1", font=("Arial", 8))
+        self.sessions_page_label.pack(side=tk.LEFT, expand=True)
+        ttk.Button(page_frame, text="▶", width=3, command=lambda: self.change_sessions_page(1)).pack(side=tk.RIGHT)
+        
         # AI Hukommelse panel (højre)
         memory_frame = ttk.LabelFrame(top_panel, text="🧠 AI Hukommelse (Permanent)", padding="5")
         memory_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=(5, 0))
@@ -156,6 +690,9 @@ class LLMChatGUI:
         )
         self.chat_display.pack(fill=tk.BOTH, expand=True)
         
+        # Lange samtaler tegnes i bidder og kun et vindue af beskeder ligger i widgettet
+        self.chat_view = ChatRenderer(self.chat_display, self.chat_window_size, self.chat_chunk_size)
+        
         # Input område
         input_frame = ttk.LabelFrame(main_frame, text="✏️ Skriv besked", padding="5")
         input_frame.pack(fill=tk.X, pady=(0, 10))
@@ -181,6 +718,14 @@ class LLMChatGUI:
         )
         self.send_button.pack(fill=tk.X, pady=(0, 5))
         
+        self.stop_button = ttk.Button(
+            button_frame, 
+            text="⏹️ Stop", 
+            command=self.stop_generation,
+            width=10
+        )
+        self.stop_button.pack(fill=tk.X, pady=(0, 5))
+        
         self.voice_button = ttk.Button(
             button_frame, 
             text="🎤 Tal", 
@@ -249,6 +794,16 @@ class LLMChatGUI:
         status_frame = ttk.Frame(controls_row)
         status_frame.pack(side=tk.RIGHT)
         
+        # Stats panel (tidsmålinger) til venstre for status
+        stats_frame = ttk.Frame(controls_row)
+        stats_frame.pack(side=tk.RIGHT, padx=(0, 15))
+        
+        self.stats_label = ttk.Label(stats_frame, text="📊 Ingen målinger endnu", 
+                                    font=("Arial", 8), justify=tk.RIGHT)
+        self.stats_label.pack(side=tk.LEFT, padx=(0, 5))
+        
+        ttk.Button(stats_frame, text="📊 Eksporter", command=self.export_metrics).pack(side=tk.LEFT)
+        
         self.status_label = ttk.Label(status_frame, text="🟡 Starter...")
         self.status_label.pack(anchor=tk.E)
         
@@ -269,7 +824,7 @@ class LLMChatGUI:
         """Åbn indstillinger vindue"""
         settings_window = tk.Toplevel(self.root)
         settings_window.title("⚙️ Indstillinger")
-        settings_window.geometry("400x300")
+        settings_window.geometry("400x500")
         settings_window.resizable(False, False)
         
         # Timeout indstillinger
@@ -277,7 +832,7 @@ class LLMChatGUI:
         timeout_frame.pack(fill=tk.X, padx=10, pady=10)
         
         # Timeout enabled checkbox
-        self.timeout_enabled_var = tk.BooleanVar(value=self.timeout_enabled)
+        self.timeout_enabled_var = tk.BooleanVar(value=self.engine.timeout_enabled)
         ttk.Checkbutton(timeout_frame, text="Aktiver timeout", 
                        variable=self.timeout_enabled_var).pack(anchor=tk.W, pady=(0, 5))
         
@@ -286,17 +841,35 @@ class LLMChatGUI:
         timeout_frame_inner = ttk.Frame(timeout_frame)
         timeout_frame_inner.pack(fill=tk.X, pady=5)
         
-        self.timeout_var = tk.IntVar(value=self.timeout_seconds)
+        self.timeout_var = tk.IntVar(value=self.engine.timeout_seconds)
         self.timeout_scale = tk.Scale(timeout_frame_inner, from_=10, to=120, 
                                      orient=tk.HORIZONTAL, variable=self.timeout_var)
         self.timeout_scale.pack(side=tk.LEFT, fill=tk.X, expand=True)
         
-        self.timeout_label = ttk.Label(timeout_frame_inner, text=f"{self.timeout_seconds}s")
+        self.timeout_label = ttk.Label(timeout_frame_inner, text=f"{self.engine.timeout_seconds}s")
         self.timeout_label.pack(side=tk.RIGHT, padx=(5, 0))
         
         # Bind scale update
         self.timeout_scale.bind("<Motion>", self.update_timeout_label)
         
+        # Streaming
+        self.stream_enabled_var = tk.BooleanVar(value=self.engine.stream_enabled)
+        ttk.Checkbutton(timeout_frame, text="Vis svar løbende (streaming)", 
+                       variable=self.stream_enabled_var).pack(anchor=tk.W, pady=(5, 0))
+        
+        self.stable_prefix_var = tk.BooleanVar(value=self.engine.stable_prefix_enabled)
+        ttk.Checkbutton(timeout_frame, text="Stabilt prompt-prefix (genbrug backend cache)", 
+                       variable=self.stable_prefix_var).pack(anchor=tk.W)
+        
+        # Svar-cache (kun ved temperature 0 med mindre den tvinges)
+        self.response_cache_var = tk.BooleanVar(value=self.engine.response_cache_enabled)
+        ttk.Checkbutton(timeout_frame, text="Cache svar på gentagne spørgsmål", 
+                       variable=self.response_cache_var).pack(anchor=tk.W)
+        
+        self.response_cache_force_var = tk.BooleanVar(value=self.engine.response_cache_force)
+        ttk.Checkbutton(timeout_frame, text="Brug cache selv ved temperature > 0", 
+                       variable=self.response_cache_force_var).pack(anchor=tk.W)
+        
         # Auto-hukommelse indstillinger
         memory_frame = ttk.LabelFrame(settings_window, text="🧠 Hukommelse Indstillinger", padding="10")
         memory_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -305,16 +878,25 @@ class LLMChatGUI:
         memory_threshold_frame = ttk.Frame(memory_frame)
         memory_threshold_frame.pack(fill=tk.X, pady=5)
         
-        self.memory_threshold_var = tk.IntVar(value=self.auto_memory_threshold)
+        self.memory_threshold_var = tk.IntVar(value=self.engine.auto_memory_threshold)
         self.memory_threshold_scale = tk.Scale(memory_threshold_frame, from_=1, to=10, 
                                               orient=tk.HORIZONTAL, variable=self.memory_threshold_var)
         self.memory_threshold_scale.pack(side=tk.LEFT, fill=tk.X, expand=True)
         
-        self.memory_threshold_label = ttk.Label(memory_threshold_frame, text=f"{self.auto_memory_threshold}")
+        self.memory_threshold_label = ttk.Label(memory_threshold_frame, text=f"{self.engine.auto_memory_threshold}")
         self.memory_threshold_label.pack(side=tk.RIGHT, padx=(5, 0))
         
         self.memory_threshold_scale.bind("<Motion>", self.update_memory_threshold_label)
         
+        # Talegenkendelse
+        voice_frame = ttk.LabelFrame(settings_window, text="🎤 Talegenkendelse", padding="10")
+        voice_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        ttk.Label(voice_frame, text="Backend:").pack(side=tk.LEFT, padx=(0, 5))
+        self.speech_backend_var = tk.StringVar(value=self.speech_backend)
+        ttk.Combobox(voice_frame, textvariable=self.speech_backend_var, values=["auto", "vosk", "google"],
+                     state="readonly", width=10).pack(side=tk.LEFT)
+        
         # Gem og luk knapper
         button_frame = ttk.Frame(settings_window)
         button_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -334,164 +916,29 @@ class LLMChatGUI:
     
     def save_settings(self, window):
         """Gem indstillinger"""
-        self.timeout_enabled = self.timeout_enabled_var.get()
-        self.timeout_seconds = self.timeout_var.get()
-        self.auto_memory_threshold = self.memory_threshold_var.get()
-        
-        # Reset message counter
-        self.message_count = 0
+        engine = self.engine
+        self._engine_sync(lambda: engine.update_settings(
+            timeout_enabled=self.timeout_enabled_var.get(),
+            timeout_seconds=self.timeout_var.get(),
+            stream_enabled=self.stream_enabled_var.get(),
+            stable_prefix_enabled=self.stable_prefix_var.get(),
+            response_cache_enabled=self.response_cache_var.get(),
+            response_cache_force=self.response_cache_force_var.get(),
+            auto_memory_threshold=self.memory_threshold_var.get(),
+            message_count=0  # Reset message counter
+        ))
+        
+        if self.speech_backend_var.get() != self.speech_backend:
+            self.speech_backend = self.speech_backend_var.get()
+            if self.voice_recognizer:
+                self.voice_recognizer.close()
+                self.voice_recognizer = self._make_voice_recognizer()
+                threading.Thread(target=self.voice_recognizer.preload, daemon=True).start()
         
         window.destroy()
-        self.add_to_chat("System", f"⚙️ Indstillinger gemt! Timeout: {'ON' if self.timeout_enabled else 'OFF'} ({self.timeout_seconds}s), Hukommelse: hver {self.auto_memory_threshold}. besked", "system")
+        self.add_to_chat("System", f"⚙️ Indstillinger gemt! Timeout: {'ON' if engine.timeout_enabled else 'OFF'} ({engine.timeout_seconds}s), Streaming: {'ON' if engine.stream_enabled else 'OFF'}, Hukommelse: hver {engine.auto_memory_threshold}. besked", "system")
     
     # AI Hukommelse System (Forenklet og automatisk)
-    def load_user_memory(self):
-        """Load bruger hukommelse fra fil"""
-        try:
-            if os.path.exists(self.memory_file):
-                with open(self.memory_file, 'r', encoding='utf-8') as f:
-                    self.user_memory = json.load(f)
-            else:
-                self.user_memory = {}
-        except Exception as e:
-            print(f"Fejl ved loading af hukommelse: {e}")
-            self.user_memory = {}
-    
-    def save_user_memory(self):
-        """Gem bruger hukommelse til fil"""
-        try:
-            with open(self.memory_file, 'w', encoding='utf-8') as f:
-                json.dump(self.user_memory, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Fejl ved gemning af hukommelse: {e}")
-    
-    def check_auto_memory_update(self):
-        """Tjek om det er tid til automatisk hukommelse opdatering"""
-        if not self.auto_memory_var.get():
-            return
-            
-        self.message_count += 1
-        
-        # Vis at systemet tæller beskeder
-        if hasattr(self, 'auto_memory_label'):
-            self.auto_memory_label.config(text=f"🤖 Auto-hukommelse: {self.message_count}/{self.auto_memory_threshold}")
-        
-        if self.message_count >= self.auto_memory_threshold:
-            self.message_count = 0
-            self.auto_memory_label.config(text="🔄 Analyserer samtale...")
-            threading.Thread(target=self._auto_update_memory, daemon=True).start()
-    
-    def _auto_update_memory(self):
-        """Automatisk opdatering af hukommelse (baggrund)"""
-        try:
-            # Saml seneste beskeder til analyse
-            recent_messages = []
-            for msg in self.conversation_history[-4:]:  # Sidste 4 beskeder
-                if msg["role"] in ["user", "assistant"]:
-                    recent_messages.append(f"{msg['role']}: {msg['content']}")
-            
-            if len(recent_messages) < 2:
-                return
-            
-            conversation_text = "\n".join(recent_messages)
-            
-            # Fokuseret prompt for at fange interessante information
-            analysis_prompt = f"""Analyser denne samtale og find interessant information om brugeren som jeg skal huske.
-
-SAMTALE:
-{conversation_text}
-
-Find ALLE interessante facts om personen - navn, hobbier, præferencer, job, familie, mål, problemer, etc.
-
-Svar med JSON:
-{{
-    "memories": [
-        {{"info": "konkret fact om personen", "importance": 1-10}}
-    ]
-}}
-
-Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
-            
-            headers = {"Content-Type": "application/json"}
-            data = {
-                "messages": [{"role": "user", "content": analysis_prompt}],
-                "temperature": 0.1,
-                "max_tokens": 300,
-                "stream": False
-            }
-            
-            # Brug konfigurerbar timeout
-            timeout = self.timeout_seconds if self.timeout_enabled else None
-            
-            response = requests.post(self.llm_url, json=data, headers=headers, timeout=timeout)
-            response.raise_for_status()
-            result = response.json()
-            
-            ai_response = result['choices'][0]['message']['content'].strip()
-            
-            # Parse JSON respons
-            try:
-                ai_response = ai_response.replace('```json', '').replace('```', '').strip()
-                start = ai_response.find('{')
-                end = ai_response.rfind('}') + 1
-                
-                if start >= 0 and end > start:
-                    json_str = ai_response[start:end]
-                    memory_updates = json.loads(json_str)
-                    
-                    # Tilføj nye minder
-                    new_count = 0
-                    if "memories" in memory_updates:
-                        for memory_data in memory_updates["memories"]:
-                            importance = memory_data.get("importance", 0)
-                            if importance >= 5:  # Kun vigtige minder
-                                info = memory_data.get("info", "")
-                                
-                                if info and not self._memory_exists(info):
-                                    memory_id = str(int(time.time() * 1000))
-                                    self.user_memory[memory_id] = {
-                                        "info": info,
-                                        "created": datetime.now().strftime("%Y-%m-%d %H:%M"),
-                                        "importance": importance
-                                    }
-                                    new_count += 1
-                    
-                    # Gem og opdater GUI hvis der er nye minder
-                    if new_count > 0:
-                        self.save_user_memory()
-                        self.root.after(0, self._handle_auto_memory_success, new_count)
-                    else:
-                        # Vis at systemet kører, selvom ingen nye minder
-                        self.root.after(0, lambda: self.auto_memory_label.config(text="🤖 Ingen nye minder denne gang"))
-                        self.root.after(3000, lambda: self.auto_memory_label.config(text="🤖 Auto-hukommelse: Aktiveret"))
-                    
-            except json.JSONDecodeError as e:
-                print(f"Auto-hukommelse JSON fejl: {e}")
-                self.root.after(0, lambda: self.auto_memory_label.config(text="❌ Hukommelse JSON fejl"))
-                
-        except requests.exceptions.Timeout:
-            print("Auto-hukommelse timeout")
-            self.root.after(0, lambda: self.auto_memory_label.config(text="⏱️ Hukommelse timeout (juster i indstillinger)"))
-            self.root.after(5000, lambda: self.auto_memory_label.config(text="🤖 Auto-hukommelse: Aktiveret"))
-        except requests.exceptions.ConnectionError:
-            print("Auto-hukommelse forbindelse fejl")
-            self.root.after(0, lambda: self.auto_memory_label.config(text="❌ LLM ikke tilgængelig"))
-        except Exception as e:
-            print(f"Auto-hukommelse generel fejl: {e}")
-            self.root.after(0, lambda: self.auto_memory_label.config(text="❌ Hukommelse fejl"))
-    
-    def _memory_exists(self, new_info):
-        """Tjek om lignende hukommelse allerede eksisterer"""
-        new_info_lower = new_info.lower()
-        for memory_data in self.user_memory.values():
-            existing_info = memory_data.get("info", "").lower()
-            # Simpel check for overlap (kan forbedres)
-            if len(new_info_lower) > 10 and new_info_lower in existing_info:
-                return True
-            if len(existing_info) > 10 and existing_info in new_info_lower:
-                return True
-        return False
-    
     def _handle_auto_memory_success(self, new_count):
         """Håndter succesfuld auto-hukommelse opdatering"""
         self.refresh_memory_display()
@@ -511,7 +958,8 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
             return
         
         self.auto_memory_label.config(text="🔄 Opdaterer hukommelse...")
-        threading.Thread(target=self._auto_update_memory, daemon=True).start()
+        # Manuel opdatering er et af de steder hvor prompt-prefixet må ændres
+        self.loop.call_soon_threadsafe(self.engine.request_memory_extraction, self.current_session_id, True)
     
     def refresh_memory_display(self):
         """Opdater hukommelse display"""
@@ -522,12 +970,8 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
         self.memory_display.delete("1.0", tk.END)
         
         if self.user_memory:
-            # Sorter efter vigtighed og dato
-            sorted_memories = sorted(self.user_memory.items(), 
-                                   key=lambda x: (x[1].get("importance", 0), x[1].get("created", "")), 
-                                   reverse=True)
-            
-            for memory_id, memory_data in sorted_memories[:10]:  # Vis top 10
+            # Motoren holder minderne sorteret efter vigtighed og dato
+            for memory_id, memory_data in self.user_memory.top(10):  # Vis top 10
                 info = memory_data.get("info", "")
                 importance = memory_data.get("importance", 0)
                 created = memory_data.get("created", "")
@@ -570,17 +1014,14 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
                 text_widget.config(state=tk.DISABLED)
                 return
             
-            # Sorter baseret på valg
+            # Sorteret baseret på valg (indekserne holdes sorteret af motoren)
             sort_choice = sort_var.get()
             if sort_choice == "Vigtighed":
-                sorted_memories = sorted(self.user_memory.items(), 
-                                       key=lambda x: x[1].get("importance", 0), reverse=True)
+                sorted_memories = self.user_memory.by_importance()
             elif sort_choice == "Dato (nyeste)":
-                sorted_memories = sorted(self.user_memory.items(), 
-                                       key=lambda x: x[1].get("created", ""), reverse=True)
+                sorted_memories = self.user_memory.by_created(newest=True)
             else:  # Dato (ældste)
-                sorted_memories = sorted(self.user_memory.items(), 
-                                       key=lambda x: x[1].get("created", ""))
+                sorted_memories = self.user_memory.by_created()
             
             for i, (memory_id, memory_data) in enumerate(sorted_memories, 1):
                 info = memory_data.get("info", "")
@@ -601,8 +1042,7 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
     def clear_memory(self):
         """Ryd alle minder efter bekræftelse"""
         if messagebox.askyesno("Bekræft", "Slet ALLE minder? Dette kan ikke fortrydes!"):
-            self.user_memory = {}
-            self.save_user_memory()
+            self._engine_call(self.engine.clear_memory())
             self.refresh_memory_display()
             self.update_memory_counter()
             self.add_to_chat("System", "🧹 Alle minder er slettet!", "system")
@@ -616,6 +1056,7 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
     def toggle_auto_memory(self):
         """Toggle automatiske minder"""
         enabled = self.auto_memory_var.get()
+        self.engine.auto_memory_enabled = enabled
         status = "Aktiveret" if enabled else "Deaktiveret"
         self.auto_memory_label.config(text=f"🤖 Auto-hukommelse: {status}")
         
@@ -624,164 +1065,117 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
         else:
             self.add_to_chat("System", "🤖 Automatisk hukommelse deaktiveret.", "system")
     
-    def get_memory_for_ai(self):
-        """Få minder til AI system prompt"""
-        if not self.user_memory:
-            return ""
-        
-        memory_summary = "\n\nVigtig information om brugeren (brug til at give bedre svar):\n"
-        
-        # Få de mest vigtige minder
-        sorted_memories = sorted(self.user_memory.items(), 
-                               key=lambda x: x[1].get("importance", 0), reverse=True)
-        
-        for memory_id, memory_data in sorted_memories[:8]:  # Top 8 vigtigste minder
-            info = memory_data.get("info", "")
-            if info:
-                memory_summary += f"- {info}\n"
-        
-        return memory_summary
-    
     # Session Management (forbedret med bruger isolation)
     def create_new_session(self):
         """Opret ny session"""
-        if not hasattr(self, 'sessions_listbox'):
-            session_name = f"Samtale {len(self.sessions) + 1}"
-        else:
-            session_name = simpledialog.askstring("Ny samtale", "Navn på samtale:", 
-                                                 initialvalue=f"Samtale {len(self.sessions) + 1}")
-            if not session_name:
+        session_name = simpledialog.askstring("Ny samtale", "Navn på samtale:", 
+                                             initialvalue=f"Samtale {len(self.sessions) + 1}")
+        if not session_name:
+            if self.current_session_id:
                 return
+            # Der skal altid være en aktiv samtale
+            session_name = f"Samtale {len(self.sessions) + 1}"
         
-        session_id = f"{self.current_user}_{int(time.time())}"  # Bruger-specifik ID
-        self.sessions[session_id] = {
-            "name": session_name,
-            "history": [self.system_prompt.copy()],
-            "created": datetime.now(),
-            "user": self.current_user  # Sikr bruger tilhørighed
-        }
+        self.current_session_id = self._engine_call(self.engine.create_session(session_name))
         
-        self.current_session_id = session_id
-        self.conversation_history = self.sessions[session_id]["history"]
-        self.message_count = 0  # Reset message counter
+        self.refresh_sessions_list()
+        self.clear_chat_display()
+        self.update_session_label()
         
-        if hasattr(self, 'sessions_listbox'):
-            self.refresh_sessions_list()
-            self.clear_chat_display()
-            self.update_session_label()
-            
-            # Vis hvor mange minder AI'en allerede har
-            memory_count = len(self.user_memory)
-            if memory_count > 0:
-                self.add_to_chat("System", f"Ny samtale '{session_name}' oprettet! AI'en husker allerede {memory_count} ting om dig.", "system")
-            else:
-                self.add_to_chat("System", f"Ny samtale '{session_name}' oprettet!", "system")
-    
-    def load_sessions(self):
-        """Load kun denne brugers sessions"""
-        try:
-            if os.path.exists(self.sessions_file):
-                with open(self.sessions_file, 'rb') as f:
-                    all_sessions = pickle.load(f)
-                    # Filtrer kun denne brugers sessions
-                    self.sessions = {k: v for k, v in all_sessions.items() 
-                                   if v.get("user") == self.current_user}
-            else:
-                self.sessions = {}
-        except:
-            self.sessions = {}
+        # Vis hvor mange minder AI'en allerede har
+        memory_count = len(self.user_memory)
+        if memory_count > 0:
+            self.add_to_chat("System", f"Ny samtale '{session_name}' oprettet! AI'en husker allerede {memory_count} ting om dig.", "system")
+        else:
+            self.add_to_chat("System", f"Ny samtale '{session_name}' oprettet!", "system")
     
     def load_selected_session(self, event=None):
         """Load valgt session (kun hvis den tilhører brugeren)"""
-        selection = self.sessions_listbox.curselection()
-        if not selection:
+        session_id = self._selected_session_id()
+        if not session_id:
             return
         
-        session_info = self.sessions_listbox.get(selection[0])
-        session_id = session_info.split(" - ")[0]
-        
         # Sikr at sessionen tilhører denne bruger
-        if (session_id in self.sessions and 
-            self.sessions[session_id].get("user") == self.current_user):
-            self.current_session_id = session_id
-            self.conversation_history = self.sessions[session_id]["history"]
-            self.refresh_chat_from_history()
-            self.update_session_label()
-            self.message_count = 0  # Reset counter for loaded session
-        else:
+        try:
+            self._engine_call(self.engine.load_session(session_id))
+        except PermissionError:
             messagebox.showerror("Adgang nægtet", "Du har ikke adgang til denne samtale!")
+            return
+        
+        self.current_session_id = session_id
+        self.refresh_chat_from_history()
+        self.refresh_sessions_list()
+        self.update_session_label()
     
     def save_current_session(self):
         """Gem aktuel session"""
-        if (self.current_session_id and 
-            self.current_session_id in self.sessions and
-            self.sessions[self.current_session_id].get("user") == self.current_user):
-            self.sessions[self.current_session_id]["history"] = self.conversation_history.copy()
-            self.save_sessions()
+        try:
+            self._engine_call(self.engine.save_session(self.current_session_id))
             self.add_to_chat("System", "Samtale gemt! 💾", "system")
-        else:
+        except PermissionError:
             messagebox.showwarning("Advarsel", "Ingen valid samtale at gemme")
     
     def delete_session(self):
         """Slet valgt session (kun hvis den tilhører brugeren)"""
-        selection = self.sessions_listbox.curselection()
-        if not selection:
+        session_id = self._selected_session_id()
+        if not session_id:
             messagebox.showinfo("Info", "Vælg en samtale at slette")
             return
         
-        session_info = self.sessions_listbox.get(selection[0])
-        session_id = session_info.split(" - ")[0]
-        
         # Sikr at sessionen tilhører denne bruger
-        if (session_id in self.sessions and 
-            self.sessions[session_id].get("user") == self.current_user):
-            if messagebox.askyesno("Bekræft", f"Slet samtale '{self.sessions[session_id]['name']}'?"):
-                del self.sessions[session_id]
-                if self.current_session_id == session_id:
-                    self.create_new_session()
-                self.refresh_sessions_list()
-                self.save_sessions()
-        else:
+        if not self.engine.owns_session(session_id):
             messagebox.showerror("Adgang nægtet", "Du kan ikke slette denne samtale!")
+            return
+        
+        if messagebox.askyesno("Bekræft", f"Slet samtale '{self.sessions[session_id]['name']}'?"):
+            self._engine_call(self.engine.delete_session(session_id))
+            if self.current_session_id == session_id:
+                self.current_session_id = None
+                self.create_new_session()
+            self.refresh_sessions_list()
     
-    def save_sessions(self):
-        """Gem sessions til fil (med bruger data)"""
-        try:
-            # Load eksisterende sessions fra andre brugere
-            all_sessions = {}
-            if os.path.exists(self.sessions_file):
-                try:
-                    with open(self.sessions_file, 'rb') as f:
-                        all_sessions = pickle.load(f)
-                except:
-                    pass
-            
-            # Opdater med denne brugers sessions
-            all_sessions.update(self.sessions)
-            
-            # Gem alt
-            with open(self.sessions_file, 'wb') as f:
-                pickle.dump(all_sessions, f)
-        except Exception as e:
-            print(f"Fejl ved gemning af sessions: {e}")
+    def _selected_session_id(self):
+        """Session id for den valgte række (None hvis intet er valgt)"""
+        selection = self.sessions_listbox.curselection()
+        if not selection or selection[0] >= len(self.session_row_ids):
+            return None
+        return self.session_row_ids[selection[0]]
+    
+    def filter_sessions(self):
+        """Navne-filteret er ændret - vis første side af resultatet"""
+        self.session_page = 0
+        self.refresh_sessions_list()
+    
+    def change_sessions_page(self, step):
+        """Bladr i sessions listen"""
+        self.session_page += step
+        self.refresh_sessions_list()
     
     def refresh_sessions_list(self):
-        """Opdater sessions liste (kun denne brugers)"""
+        """Opdater sessions liste (kun denne brugers og kun den viste side)"""
         if not hasattr(self, 'sessions_listbox'):
             return
-            
-        self.sessions_listbox.delete(0, tk.END)
         
-        # Filtrer og sorter kun denne brugers sessions
-        user_sessions = {k: v for k, v in self.sessions.items() 
-                        if v.get("user") == self.current_user}
+        name_filter = self.session_filter_var.get().strip()
+        page_size = self.session_page_size
+        
+        def fetch_page():
+            total = self.engine.session_count(name_filter)
+            pages = max(1, (total + page_size - 1) // page_size)
+            page = min(max(self.session_page, 0), pages - 1)
+            return page, pages, self.engine.list_sessions(name_filter, page * page_size, page_size)
+        
+        self.session_page, pages, rows = self._engine_sync(fetch_page)
         
-        for session_id, session_data in sorted(user_sessions.items(), 
-                                              key=lambda x: x[1]["created"], reverse=True):
-            created_str = session_data["created"].strftime("%d/%m %H:%M")
-            msg_count = len([msg for msg in session_data["history"] if msg["role"] == "user"])
-            display_text = f"{session_id} - {session_data['name']} ({msg_count} beskeder, {created_str})"
-            self.sessions_listbox.insert(0, display_text)
+        self.sessions_listbox.delete(0, tk.END)
+        self.session_row_ids = []
+        for session_id, session_data in rows:
+            updated_str = session_data.get("updated", session_data["created"]).strftime("%d/%m %H:%M")
+            msg_count = session_data.get("user_count", 0)
+            marker = "▶ " if session_id == self.current_session_id else ""
+            self.sessions_listbox.insert(tk.END, f"{marker}{session_data['name']} ({msg_count} beskeder, {updated_str})")
+            self.session_row_ids.append(session_id)
+        self.sessions_page_label.config(text=f"{self.session_page + 1}/{pages}")
     
     def update_session_label(self):
         """Opdater session label"""
@@ -791,69 +1185,130 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
             self.session_name_label.config(text=f"📝 Aktuel: {name}")
     
     def refresh_chat_from_history(self):
-        """Genopbyg chat fra historie"""
-        self.clear_chat_display()
-        
+        """Genopbyg chat fra historie (nyeste beskeder vises først)"""
+        messages = []
         for msg in self.conversation_history:
             if msg["role"] == "user":
-                self.add_to_chat("Du", msg["content"], "user")
+                messages.append(("Du", msg["content"], "user"))
             elif msg["role"] == "assistant":
-                self.add_to_chat("Assistant", msg["content"], "assistant")
+                messages.append(("Assistant", msg["content"], "assistant"))
+        with self.engine.metrics.timer("ui_render_seconds", op="show"):
+            self.chat_view.show(messages)
     
     def clear_chat_display(self):
         """Ryd kun chat display"""
-        self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.delete("1.0", tk.END)
-        self.chat_display.config(state=tk.DISABLED)
+        self.chat_view.clear()
     
     # TTS og Speech Recognition
+    def init_audio(self):
+        """Start TTS og mikrofon i en baggrundstråd (kun første gang)"""
+        if self._audio_thread is not None:
+            return
+        self._audio_thread = threading.Thread(target=self._init_audio_worker, daemon=True)
+        self._audio_thread.start()
+    
+    def _init_audio_worker(self):
+        """Initialiser TTS og mikrofon (kører i baggrunden)"""
+        self.init_tts()
+        self.init_microphone()
+    
     def init_tts(self):
-        """Initialiser TTS engine"""
-        try:
-            self.tts_engine = pyttsx3.init()
-            self.tts_engine.setProperty('rate', 150)
-            self.tts_engine.setProperty('volume', 0.9)
-            
-            # Prøv at finde dansk stemme
-            voices = self.tts_engine.getProperty('voices')
-            for voice in voices:
-                if any(lang in voice.id.lower() for lang in ['danish', 'dansk', 'da_dk', 'da-dk']):
-                    self.tts_engine.setProperty('voice', voice.id)
-                    break
-            
-            self.update_status("✅ TTS klar")
-        except Exception as e:
-            self.update_status(f"❌ TTS fejl: {str(e)[:30]}")
-            self.tts_engine = None
+        """Start oplæsnings-tråden (den initialiserer selv TTS engine)"""
+        self.speech.start()
     
     def init_microphone(self):
-        """Initialiser mikrofon"""
+        """Initialiser mikrofon (kører i baggrunden)"""
         try:
-            self.microphone = sr.Microphone()
-            with self.microphone as source:
-                self.recognizer.adjust_for_ambient_noise(source, duration=1)
-            self.update_status("✅ Mikrofon klar")
+            import speech_recognition as sr  # Importeres først her - bruges kun til 🎤
+            recognizer = sr.Recognizer()
+            microphone = sr.Microphone()
+            with microphone as source:
+                recognizer.adjust_for_ambient_noise(source, duration=1)
+            self.recognizer = recognizer
+            self.microphone = microphone
+            self.voice_recognizer = self._make_voice_recognizer()
+            self.voice_recognizer.preload()
+            self._post(self.update_status, f"✅ Mikrofon klar ({', '.join(sorted({backend.name for backend in self.voice_recognizer.backends}))})")
         except Exception as e:
-            self.update_status(f"❌ Mikrofon fejl: {str(e)[:30]}")
+            self._post(self.update_status, f"❌ Mikrofon fejl: {str(e)[:30]}")
             self.microphone = None
+        finally:
+            self.microphone_checked = True
+            self._post(self._handle_microphone_ready)
+    
+    def _make_voice_recognizer(self):
+        """Vælg backend: lokal Vosk hvis den er installeret og har modeller, ellers Google"""
+        backends = []
+        if self.speech_backend in ("auto", "vosk") and VoskSpeechBackend.installed():
+            vosk_backend = VoskSpeechBackend(self.vosk_model_dir)
+            if any(vosk_backend.supports(language) for language in self.speech_languages):
+                backends.append(vosk_backend)
+        if not backends or self.speech_backend == "google":
+            backends = [GoogleSpeechBackend(self.recognizer)]
+        return VoiceRecognizer(backends, self.speech_languages)
+    
+    def _handle_microphone_ready(self):
+        """Mikrofonen er klar (eller fejlede) - start lytning hvis 🎤 blev trykket imens (main thread)"""
+        if not self._voice_pending:
+            return
+        self._voice_pending = False
+        self.voice_button.config(state=tk.NORMAL, text="🎤 Tal")
+        self.toggle_voice_input()
     
     def test_connection(self):
         """Test LLM forbindelse"""
-        def test():
-            try:
-                response = requests.get("http://localhost:1234/v1/models", timeout=3)
-                if response.status_code == 200:
-                    models = response.json()
-                    model_count = len(models.get('data', []))
-                    self.update_status(f"✅ LLM forbundet ({model_count} modeller)")
-                else:
-                    self.update_status(f"❌ LLM fejl: HTTP {response.status_code}")
-            except requests.exceptions.ConnectionError:
+        def connected(model_count):
+            pool = self.engine.llm_client
+            servers = f", {pool.healthy_count}/{len(pool.clients)} servere" if len(pool.clients) > 1 else ""
+            self.update_status(f"✅ LLM forbundet ({model_count} modeller{servers})")
+        
+        def failed(error):
+            if isinstance(error, LLMUnavailable):
                 self.update_status("❌ LM Studio ikke startet")
-            except Exception as e:
-                self.update_status(f"❌ Forbindelsesfejl: {str(e)[:20]}")
+            elif getattr(error, "status", None):
+                self.update_status(f"❌ LLM fejl: HTTP {error.status}")
+            else:
+                self.update_status(f"❌ Forbindelsesfejl: {str(error)[:20]}")
         
-        threading.Thread(target=test, daemon=True).start()
+        self._engine_submit(self.engine.check_connection(), on_done=connected, on_error=failed)
+    
+    def update_stats(self):
+        """Vis nøgletal fra motorens metrics (p50/p90 over de seneste kald)"""
+        metrics = self.engine.metrics
+        ms = lambda seconds: f"{seconds * 1000:.0f}"
+        llm_parts, local_parts = [], []
+        
+        ttft = metrics.summary("llm_ttft_seconds", kind="chat")
+        if ttft:
+            llm_parts.append(f"⚡ TTFT {ms(ttft['p50'])}/{ms(ttft['p90'])} ms")
+        total = metrics.summary("llm_request_seconds", kind="chat")
+        if total:
+            llm_parts.append(f"⏱️ Svar {total['p50']:.1f}s")
+        rate = metrics.summary("llm_tokens_per_second", kind="chat")
+        if rate:
+            llm_parts.append(f"🚀 {rate['p50']:.0f} tok/s")
+        queue_wait = metrics.summary("llm_queue_wait_seconds", kind="chat")
+        if queue_wait:
+            llm_parts.append(f"⏳ Kø {ms(queue_wait['p90'])} ms")
+        
+        persist = metrics.summary("persist_seconds", op="session")
+        if persist:
+            local_parts.append(f"💾 Gem {persist['p90'] * 1000:.1f} ms")
+        render = metrics.summary("ui_render_seconds", op="stream") or metrics.summary("ui_render_seconds", op="add")
+        if render:
+            local_parts.append(f"🖥️ UI {render['p90'] * 1000:.1f} ms")
+        
+        lines = ["  ".join(parts) for parts in (llm_parts, local_parts) if parts]
+        self.stats_label.config(text="\n".join(lines) or "📊 Ingen målinger endnu")
+        self.root.after(self.stats_interval_ms, self.update_stats)
+    
+    def export_metrics(self):
+        """Gem metrics som Prometheus tekst og JSONL i brugerens data mappe"""
+        try:
+            prom_path, jsonl_path = self._engine_sync(self.engine.export_metrics)
+            self.add_to_chat("System", f"📊 Metrics gemt: {prom_path} og {jsonl_path}", "system")
+        except Exception as e:
+            self.add_to_chat("System", f"❌ Kunne ikke gemme metrics: {e}", "system")
     
     def update_status(self, message):
         """Opdater status label"""
@@ -862,33 +1317,8 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
     
     def add_to_chat(self, sender, message, msg_type="user"):
         """Tilføj besked til chat display"""
-        self.chat_display.config(state=tk.NORMAL)
-        
-        # Timestamp
-        timestamp = datetime.now().strftime("%H:%M")
-        
-        # Farver baseret på type
-        if msg_type == "system":
-            self.chat_display.insert(tk.END, f"[{timestamp}] {sender}: ", "system_sender")
-            self.chat_display.insert(tk.END, f"{message}\n\n", "system_msg")
-        elif msg_type == "user":
-            self.chat_display.insert(tk.END, f"[{timestamp}] Du: ", "user_sender")
-            self.chat_display.insert(tk.END, f"{message}\n", "user_msg")
-        else:  # assistant
-            self.chat_display.insert(tk.END, f"[{timestamp}] 🤖 Assistant: ", "assistant_sender")
-            self.chat_display.insert(tk.END, f"{message}\n\n", "assistant_msg")
-        
-        # Scroll til bunden
-        self.chat_display.see(tk.END)
-        self.chat_display.config(state=tk.DISABLED)
-        
-        # Konfigurer tags for farver
-        self.chat_display.tag_config("system_sender", foreground="purple", font=("Arial", 11, "bold"))
-        self.chat_display.tag_config("system_msg", foreground="purple")
-        self.chat_display.tag_config("user_sender", foreground="blue", font=("Arial", 11, "bold"))
-        self.chat_display.tag_config("user_msg", foreground="black")
-        self.chat_display.tag_config("assistant_sender", foreground="green", font=("Arial", 11, "bold"))
-        self.chat_display.tag_config("assistant_msg", foreground="dark green")
+        with self.engine.metrics.timer("ui_render_seconds", op="add"):
+            self.chat_view.add(sender, message, msg_type)
     
     def send_message(self):
         """Send besked til LLM"""
@@ -899,102 +1329,155 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
         # Ryd input felt
         self.input_entry.delete("1.0", tk.END)
         
+        # Stop oplæsning af det forrige svar
+        self.speech.interrupt()
+        
+        # En ny besked afbryder et svar der stadig genereres (motoren beholder det delvise svar)
+        self._reply_generation += 1
+        if self._reply_future and not self._reply_future.done():
+            self._end_stream_message()
+            self._reply_cached = False
+        
         # Tilføj til chat
         self.add_to_chat("Du", message, "user")
+        self.update_status("🤖 Tænker...")
         
-        # Disable send button mens vi venter
-        self.send_button.config(state=tk.DISABLED, text="⏳ Sender...")
-        
-        # Send i baggrunden
-        threading.Thread(target=self._send_to_llm, args=(message,), daemon=True).start()
+        # Send via chat motoren
+        self._reply_future = self._engine_submit(
+            self._stream_reply(self.current_session_id, message, self._reply_generation))
+    
+    def stop_generation(self):
+        """Stop svaret (og en evt. hukommelse-analyse) - forbindelsen lukkes så backenden stopper"""
+        self.speech.interrupt()
+        if self._reply_future and not self._reply_future.done():
+            self._reply_future.cancel()
+        self.loop.call_soon_threadsafe(self.engine.cancel_memory)
     
-    def _send_to_llm(self, prompt):
-        """Send forespørgsel til LLM (kører i baggrunden)"""
+    def _post_reply(self, generation, func, *args):
+        """Post et GUI kald for et svar - droppes hvis svaret er afløst af en nyere besked"""
+        def call():
+            if generation == self._reply_generation:
+                func(*args)
+        self._post(call)
+    
+    async def _stream_reply(self, session_id, prompt, generation):
+        """Hent svar fra chat motoren og send tokens til chatten (kører på engine loopet)"""
+        streaming = self.engine.stream_enabled
+        tokens = []
         try:
-            headers = {"Content-Type": "application/json"}
-            
-            # Byg forbedret system prompt med AI minder
-            enhanced_system_prompt = self.system_prompt["content"]
-            memory_summary = self.get_memory_for_ai()
-            if memory_summary:
-                enhanced_system_prompt += memory_summary
-            
-            # Tilføj til historie
-            self.conversation_history.append({"role": "user", "content": prompt})
-            
-            # Begræns historik og tilføj enhanced system prompt
-            recent_messages = self.conversation_history[-12:]  # Mere historie for bedre kontekst
-            messages = [{"role": "system", "content": enhanced_system_prompt}] + [msg for msg in recent_messages if msg["role"] != "system"]
-            
-            data = {
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 400,
-                "stream": False
-            }
-            
-            self.update_status("🤖 Tænker...")
-            
-            # Brug konfigurerbar timeout
-            timeout = self.timeout_seconds if self.timeout_enabled else None
-            
-            response = requests.post(self.llm_url, json=data, headers=headers, timeout=timeout)
-            response.raise_for_status()
-            result = response.json()
-            
-            assistant_response = result['choices'][0]['message']['content']
-            self.conversation_history.append({"role": "assistant", "content": assistant_response})
+            async for token in self.engine.stream(session_id, prompt):
+                if streaming and generation == self._reply_generation:
+                    if not tokens:
+                        self._post_reply(generation, self._begin_stream_message)
+                    self._queue_stream_token(token)
+                tokens.append(token)
             
             # Opdater GUI i main thread
-            self.root.after(0, self._handle_llm_response, assistant_response)
+            self._post_reply(generation, self._handle_llm_response, "".join(tokens), streaming)
             
-        except requests.exceptions.Timeout:
-            timeout_msg = f"Timeout efter {self.timeout_seconds}s. Juster i indstillinger hvis nødvendigt."
-            self.root.after(0, self._handle_llm_error, timeout_msg)
-        except requests.exceptions.ConnectionError:
+        except asyncio.CancelledError:
+            self._post_reply(generation, self._handle_llm_cancelled, "".join(tokens), streaming)
+            raise
+        except LLMTimeout:
+            timeout_msg = f"Timeout efter {self.engine.timeout_seconds}s. Juster i indstillinger hvis nødvendigt."
+            self._post_reply(generation, self._handle_llm_error, timeout_msg)
+        except LLMUnavailable:
             error_msg = "Kan ikke forbinde til LLM. Er LM Studio kørende?"
-            self.root.after(0, self._handle_llm_error, error_msg)
+            self._post_reply(generation, self._handle_llm_error, error_msg)
         except Exception as e:
             error_msg = f"Fejl: {str(e)}"
-            self.root.after(0, self._handle_llm_error, error_msg)
+            self._post_reply(generation, self._handle_llm_error, error_msg)
+    
+    def _queue_stream_token(self, token):
+        """Læg token i buffer og planlæg en samlet skrivning til chatten"""
+        with self._stream_lock:
+            self._stream_buffer.append(token)
+            if self._stream_flush_pending:
+                return
+            self._stream_flush_pending = True
+        self._post(self.root.after, self.stream_flush_ms, self._flush_stream_buffer)
+    
+    def _begin_stream_message(self):
+        """Start en assistent besked der fyldes ud løbende (kører i main thread)"""
+        self._stream_active = True
+        self._speak_stream = self.tts_var.get() and self.speech.ready
+        self.chat_view.begin_stream()
+        self.update_status("✍️ Skriver...")
     
-    def _handle_llm_response(self, response):
+    def _flush_stream_buffer(self):
+        """Skriv bufferede tokens til chatten (kører i main thread)"""
+        with self._stream_lock:
+            text = "".join(self._stream_buffer)
+            self._stream_buffer = []
+            self._stream_flush_pending = False
+        
+        if not text or not self._stream_active:
+            return
+        
+        with self.engine.metrics.timer("ui_render_seconds", op="stream"):
+            self.chat_view.append_stream(text)
+        if self._speak_stream:
+            self.speech.feed(text)  # Hele sætninger læses op mens resten genereres
+    
+    def _end_stream_message(self):
+        """Afslut den streamede besked i chatten (kører i main thread)"""
+        if not self._stream_active:
+            return
+        
+        self._flush_stream_buffer()
+        self._stream_active = False
+        self.chat_view.end_stream()
+        if self._speak_stream:
+            self.speech.finish()
+            self._speak_stream = False
+    
+    def _handle_llm_response(self, response, streamed=False):
         """Håndter LLM respons (kører i main thread)"""
-        self.add_to_chat("Assistant", response, "assistant")
-        self.send_button.config(state=tk.NORMAL, text="📤 Send")
-        self.update_status("✅ Klar")
+        if streamed and self._stream_active:
+            self._end_stream_message()
+        else:
+            self.add_to_chat("Assistant", response, "assistant")
+        self.update_status("⚡ Klar (svar fra cache)" if self._reply_cached else "✅ Klar")
+        self._reply_cached = False
         
-        # Tjek for automatisk hukommelse opdatering
-        self.check_auto_memory_update()
+        # Antal beskeder og tidspunkt er opdateret (kun den viste side tegnes)
+        self.refresh_sessions_list()
         
-        # Oplæs hvis aktiveret
-        if self.tts_var.get() and self.tts_engine:
-            threading.Thread(target=self._speak, args=(response,), daemon=True).start()
+        # Oplæs hvis aktiveret (streamede svar er allerede sendt til oplæsning undervejs)
+        if not streamed and self.tts_var.get() and self.speech.ready:
+            self.speech.speak(response)
+    
+    def _handle_llm_cancelled(self, partial, streamed):
+        """Svaret blev stoppet - det delvise svar bliver stående ligesom i historikken (kører i main thread)"""
+        if streamed and self._stream_active:
+            self._end_stream_message()
+        elif partial:
+            self.add_to_chat("Assistant", partial, "assistant")
+        self._reply_cached = False
+        self.add_to_chat("System", "⏹️ Svar stoppet", "system")
+        self.update_status("⏹️ Stoppet")
+        self.refresh_sessions_list()
     
     def _handle_llm_error(self, error_msg):
         """Håndter LLM fejl (kører i main thread)"""
+        # Luk en evt. halvfærdig streamet besked før fejlen vises
+        self._end_stream_message()
+        self._reply_cached = False
         self.add_to_chat("System", error_msg, "system")
-        self.send_button.config(state=tk.NORMAL, text="📤 Send")
         self.update_status("❌ Fejl")
-        
-        # Fjern sidste brugerbesked ved fejl
-        if self.conversation_history and self.conversation_history[-1]["role"] == "user":
-            self.conversation_history.pop()
-    
-    def _speak(self, text):
-        """Oplæs tekst (kører i baggrunden)"""
-        try:
-            if self.tts_engine and text.strip():
-                self.tts_engine.say(text)
-                self.tts_engine.runAndWait()
-        except Exception as e:
-            print(f"TTS fejl: {e}")
     
     def toggle_voice_input(self):
         """Toggle stemme input"""
         if self.is_listening:
             return
         
+        if not self.microphone_checked:
+            # Første brug før baggrunds-initialiseringen er færdig - lyt så snart mikrofonen er klar
+            self._voice_pending = True
+            self.voice_button.config(state=tk.DISABLED, text="🎤 Starter...")
+            self.init_audio()
+            return
+        
         if not self.microphone:
             messagebox.showerror("Fejl", "Mikrofon ikke tilgængelig")
             return
@@ -1010,20 +1493,14 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
             with self.microphone as source:
                 audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=10)
             
-            # Prøv dansk først, så engelsk
-            try:
-                text = self.recognizer.recognize_google(audio, language="da-DK")
-            except:
-                try:
-                    text = self.recognizer.recognize_google(audio, language="en-US")
-                except:
-                    text = None
+            # Alle sprog genkendes samtidig - det sikreste resultat vinder
+            text = self.voice_recognizer.recognize(audio)
             
             # Opdater GUI i main thread
-            self.root.after(0, self._handle_voice_result, text)
+            self._post(self._handle_voice_result, text)
             
-        except Exception as e:
-            self.root.after(0, self._handle_voice_result, None)
+        except Exception:
+            self._post(self._handle_voice_result, None)
         finally:
             self.is_listening = False
     
@@ -1039,32 +1516,31 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
     
     def toggle_english_response(self):
         """Toggle engelsk respons mode"""
-        if self.english_var.get():
+        english = self.english_var.get()
+        self._engine_call(self.engine.set_english(english, self.current_session_id))
+        
+        if english:
             # Skift til engelsk system prompt
-            self.system_prompt["content"] = self.english_prompt
             self.update_status("🇬🇧 Engelsk svar: TIL")
             self.add_to_chat("System", "Modellen vil nu svare på engelsk selvom du skriver dansk.", "system")
         else:
             # Skift tilbage til dansk system prompt
-            self.system_prompt["content"] = self.danish_prompt
             self.update_status("🇩🇰 Dansk svar: TIL")
             self.add_to_chat("System", "Modellen vil nu svare på dansk igen.", "system")
-        
-        # Opdater system prompt i samtale historik
-        if self.conversation_history and self.conversation_history[0]["role"] == "system":
-            self.conversation_history[0] = self.system_prompt.copy()
     
     def toggle_tts(self):
         """Toggle TTS"""
         self.tts_enabled = self.tts_var.get()
+        if not self.tts_enabled:
+            self.speech.interrupt()
+            self._speak_stream = False
         status = "TIL" if self.tts_enabled else "FRA"
         self.update_status(f"🔊 TTS: {status}")
     
     def clear_chat(self):
         """Ryd chat historie"""
-        self.conversation_history = [self.system_prompt.copy()]
+        self._engine_call(self.engine.clear_session(self.current_session_id))
         self.clear_chat_display()
-        self.message_count = 0  # Reset message counter
         
         # Vis eksisterende minder når chat ryddes
         memory_count = len(self.user_memory)
@@ -1072,15 +1548,11 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
             self.add_to_chat("System", f"Chat ryddet. AI'en husker stadig {memory_count} ting om dig! Start en ny samtale.", "system")
         else:
             self.add_to_chat("System", "Chat ryddet. Start en ny samtale!", "system")
-        
-        # Opdater session
-        if (self.current_session_id and 
-            self.current_session_id in self.sessions and
-            self.sessions[self.current_session_id].get("user") == self.current_user):
-            self.sessions[self.current_session_id]["history"] = self.conversation_history.copy()
     
     def run(self):
         """Start GUI"""
+        # Mål tid fra opstart til vinduet kan bruges
+        self.root.after_idle(lambda: print(f"⏱️ Klar efter {(time.perf_counter() - self.started_at) * 1000:.0f} ms"))
         try:
             # Gem sessions når programmet lukkes
             self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -1090,15 +1562,15 @@ Kun vigtig information (importance 5+). Tom liste hvis intet interessant."""
     
     def on_closing(self):
         """Håndter lukning af program"""
-        # Gem aktuel session (kun hvis den tilhører brugeren)
-        if (self.current_session_id and 
-            self.current_session_id in self.sessions and
-            self.sessions[self.current_session_id].get("user") == self.current_user):
-            self.sessions[self.current_session_id]["history"] = self.conversation_history.copy()
-        
-        # Gem alle data
-        self.save_sessions()
-        self.save_user_memory()
+        # Gem alle data (kun ugemte beskeder skrives) og luk forbindelser
+        try:
+            self._engine_call(self.engine.close())
+        except Exception as e:
+            print(f"Fejl ved lukning: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.speech.close()
+        if self.voice_recognizer:
+            self.voice_recognizer.close()
         
         self.root.destroy()
 
@@ -1112,7 +1584,8 @@ def main():
     print("  - Permanent hukommelse på tværs af samtaler")
     print("  - Indstillinger menu (⚙️)")
     print("  - Bruger isolation (sikre samtaler)")
-    app = LLMChatGUI()
+    # Flere LLM servere kan angives komma-separeret (kald fordeles mellem dem)
+    app = LLMChatGUI(os.environ.get("LLM_URL", DEFAULT_LLM_URL))
     app.run()
 
 if __name__ == "__main__":
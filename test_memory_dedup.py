@@ -0,0 +1,82 @@
+"""Regressionstest for dublet-tjekket på minder (python -m unittest test_memory_dedup)"""
+
+import unittest
+
+from chat_engine import MemoryDedupIndex
+
+class MemoryDedupTest(unittest.TestCase):
+    
+    def assert_duplicate(self, existing, new, expected):
+        index = MemoryDedupIndex()
+        index.add("1", existing)
+        self.assertEqual(index.find_duplicate(new) is not None, expected, f"{existing!r} / {new!r}")
+    
+    def test_similar_but_distinct_facts_are_kept(self):
+        pairs = [
+            ("Brugeren kan lide kaffe", "Brugeren kan lide te"),
+            ("Brugeren har en hund", "Brugeren har en kat"),
+            ("Brugeren arbejder som lærer", "Brugeren arbejder som læge"),
+            ("Brugeren bor i Aarhus", "Brugeren bor i Odense"),
+            ("Brugeren hedder Anna", "Brugeren hedder Mette"),
+            ("Brugeren har en hund", "Brugeren har en hunderace"),
+            ("Brugeren har to børn der hedder Anna og Peter og bor i Aarhus",
+             "Brugeren har to børn der hedder Anna og Peter og bor i Odense"),
+            ("Brugeren kan lide kaffe", "Brugeren kan ikke lide kaffe"),
+            ("Brugeren er 34 år", "Brugeren er 35 år"),
+            ("Brugerens navn er Anna", "Brugerens søster hedder Anna"),
+            ("Brugeren har en hund", "Brugeren vil gerne have en hund"),
+        ]
+        for existing, new in pairs:
+            self.assert_duplicate(existing, new, False)
+    
+    def test_duplicates_are_found(self):
+        pairs = [
+            ("Brugeren hedder Anna", "brugeren hedder anna!"),
+            ("Brugeren har to børn", "Brugeren har to børn der går i skole"),
+            ("Brugeren går til fodbold hver tirsdag og torsdag aften sammen med sine gamle venner fra "
+             "gymnasiet i den lokale klub tæt på hvor brugeren bor i det centrale Aarhus",
+             "Brugeren går til fodbold hver tirsdag og torsdag aften sammen med sine gamle venner fra "
+             "gymnasiet i den lokale klub tæt på hvor brugeren nu bor i det centrale Aarhus"),
+        ]
+        for existing, new in pairs:
+            self.assert_duplicate(existing, new, True)
+    
+    def test_rewordings_are_found(self):
+        pairs = [
+            ("Brugerens navn er Anna", "Brugeren hedder Anna"),
+            ("Brugeren elsker kaffe", "Brugeren kan godt lide kaffe"),
+            ("Brugeren har en hund og en kat", "Brugeren har en kat og en hund"),
+            ("Brugeren bor i Aarhus", "Brugeren er bosat i Aarhus"),
+            ("Brugeren arbejder som lærer på en skole", "Brugeren arbejder som lærer på skolen"),
+            ("Brugeren har en hund der hedder Max", "Brugeren har en sort hund der hedder Max"),
+        ]
+        for existing, new in pairs:
+            self.assert_duplicate(existing, new, True)
+            self.assert_duplicate(new, existing, True)
+    
+    def test_contained_memories_are_always_found(self):
+        # Mange andre minder med mange af de samme ord (men uden at indeholde parret)
+        bases = ["Brugeren hedder Anna", "Brugeren spiller guitar", "Brugeren bor i Aarhus", "Brugeren har to børn"]
+        extensions = ["og er 34 år gammel", "i et band om fredagen", "sammen med sin kæreste", "siden 2015"]
+        index = MemoryDedupIndex()
+        for number in range(200):
+            index.add(f"other{number}", f"Brugerens ven nummer {number} {extensions[number % 4]} og {bases[number % 4][9:]}")
+        for base in bases:
+            for extension in extensions:
+                extended = f"{base} {extension}"
+                for existing, new in ((base, extended), (extended, base)):
+                    index.add("pair", existing)
+                    self.assertEqual(index.find_duplicate(new), "pair", f"{existing!r} / {new!r}")
+                    index.remove("pair")
+    
+    def test_different_names_give_separate_memories(self):
+        index = MemoryDedupIndex()
+        names = ["Anna", "Mette", "Peter", "Lars"]
+        for number, name in enumerate(names):
+            info = f"Brugerens ven hedder {name}"
+            self.assertIsNone(index.find_duplicate(info))
+            index.add(str(number), info)
+        self.assertEqual(len(index.entries), len(names))
+
+if __name__ == "__main__":
+    unittest.main()